@@ -1,16 +1,52 @@
 import os
-from flask import Flask, render_template, request, redirect, flash, url_for, send_from_directory, jsonify, make_response, abort
+from flask import Flask, Request, render_template, request, redirect, flash, url_for, send_from_directory, send_file, jsonify, make_response, abort, g, has_request_context
+from flask.json.provider import JSONProvider
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session as FlaskSQLAlchemySession
 from werkzeug.utils import secure_filename
+from werkzeug.exceptions import HTTPException, RequestEntityTooLarge
+from werkzeug.wsgi import ClosingIterator
 from datetime import datetime, date, timedelta
-from sqlalchemy import func, extract, and_, or_
+from decimal import Decimal
+from sqlalchemy import func, extract, and_, or_, tuple_, event, select, create_engine
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session as SessionBase
+from sqlalchemy.sql.dml import UpdateBase
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from functools import wraps 
 import re
 import io
+import base64
+import json
+import math
+import threading
+import time
+import queue
+import warnings
 import csv
 import calendar
-from collections import defaultdict
+import gzip
+import hashlib
+import uuid
+import tempfile
+import shutil
+import zipfile
+import zlib
+import struct
+import mimetypes
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import click
+from collections import defaultdict, OrderedDict
+from itertools import groupby
 from dotenv import load_dotenv
+import numpy as np
+try:
+    import fcntl
+except ImportError:  # Windows development servers only get the per-worker limit
+    fcntl = None
+import orjson
+import brotli
 
 # Load environment variables
 load_dotenv()
@@ -22,15 +58,270 @@ app.secret_key = os.environ.get('SECRET_KEY', 'your-secret-key-here')
 app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///local.db').replace('postgres://', 'postgresql://')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
+# Optional read replica for read-only routes
+REPLICA_DATABASE_URL = os.environ.get('REPLICA_DATABASE_URL', '').replace('postgres://', 'postgresql://')
+REPLICA_MAX_LAG_SECONDS = float(os.environ.get('REPLICA_MAX_LAG_SECONDS', 30))
+REPLICA_CHECK_SECONDS = 5
+PRIMARY_CURSOR_COOKIE = 'primary_cursor'
+PRIMARY_CURSOR_MAX_AGE = 600
+
 # File upload configuration
 UPLOAD_FOLDER = os.path.join(os.getcwd(), os.environ.get('UPLOAD_FOLDER', 'static/uploads'))
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 ALLOWED_EXTENSIONS = {'pdf', 'png', 'jpg', 'jpeg', 'gif'}
-MAX_CONTENT_LENGTH = 10 * 1024 * 1024  # 10MB max file size
+# Per-file limits, enforced by ValidatingStream as each part arrives
+UPLOAD_SIZE_LIMITS = {
+    'pdf': 10 * 1024 * 1024,
+    'png': 5 * 1024 * 1024,
+    'jpg': 5 * 1024 * 1024,
+    'jpeg': 5 * 1024 * 1024,
+    'gif': 5 * 1024 * 1024,
+}
+# Room for the largest file plus form fields and multipart framing, so
+# oversized files reach the per-file check and its specific error
+MULTIPART_OVERHEAD = 1024 * 1024
+MAX_CONTENT_LENGTH = max(UPLOAD_SIZE_LIMITS.values()) + MULTIPART_OVERHEAD
 app.config['MAX_CONTENT_LENGTH'] = MAX_CONTENT_LENGTH
+BULK_MAX_CONTENT_LENGTH = int(os.environ.get('BULK_MAX_CONTENT_LENGTH', 200 * 1024 * 1024))
+STAGING_FOLDER = os.path.join(UPLOAD_FOLDER, '.staging')
+COPY_CHUNK_SIZE = 64 * 1024
+UPLOAD_WORKERS = 4
+upload_executor = ThreadPoolExecutor(max_workers=UPLOAD_WORKERS, thread_name_prefix='upload')
+
+# The leading bytes each allowed type must start with
+FILE_SIGNATURES = {
+    'pdf': (b'%PDF-',),
+    'png': (b'\x89PNG\r\n\x1a\n',),
+    'jpg': (b'\xff\xd8\xff',),
+    'jpeg': (b'\xff\xd8\xff',),
+    'gif': (b'GIF87a', b'GIF89a'),
+}
+SNIFF_BYTES = 1024  # PDF readers accept the header anywhere in the first 1KB
+
+def file_extension(filename):
+    return filename.rsplit('.', 1)[1].lower() if '.' in filename else ''
+
+def format_size(size):
+    return f"{size // (1024 * 1024)}MB"
+
+def check_file_signature(filename, head):
+    """Error message if the leading bytes don't match the file's extension, else None"""
+    ext = file_extension(filename)
+    if ext == 'pdf':
+        matched = b'%PDF-' in head[:SNIFF_BYTES]
+    else:
+        matched = head.startswith(FILE_SIGNATURES[ext])
+    if not matched:
+        return f"File content does not match its .{ext} extension"
+    return None
+
+class UploadRejected(HTTPException):
+    """An uploaded file failed validation while the request body was being read"""
+    def __init__(self, description, code=415):
+        super().__init__(description)
+        self.code = code
+
+class ValidatingStream:
+    """Wraps the stream a multipart file part is written to and checks it as
+    bytes arrive: the type from the first bytes, the size on every chunk.
+
+    Raising from write() stops werkzeug's form parser, so the rest of the
+    body is never buffered or spooled to disk.
+    """
+    def __init__(self, stream, filename):
+        self.stream = stream
+        self.filename = filename
+        ext = file_extension(filename)
+        if ext not in ALLOWED_EXTENSIONS:
+            raise UploadRejected(f"{filename}: only {', '.join(sorted(ALLOWED_EXTENSIONS))} files are allowed")
+        self.limit = UPLOAD_SIZE_LIMITS[ext]
+        self.size = 0
+        self.head = b''
+        self.sniffed = False
+
+    def _sniff(self):
+        self.sniffed = True
+        error = check_file_signature(self.filename, self.head)
+        if error:
+            raise UploadRejected(f"{self.filename}: {error}")
+
+    def write(self, data):
+        self.size += len(data)
+        if self.size > self.limit:
+            raise UploadRejected(f"{self.filename}: file exceeds the {format_size(self.limit)} limit", 413)
+        if not self.sniffed:
+            self.head += data[:SNIFF_BYTES - len(self.head)]
+            if len(self.head) >= SNIFF_BYTES:
+                self._sniff()
+        return self.stream.write(data)
+
+    def seek(self, *args):
+        # The parser rewinds once the part is complete; files shorter than
+        # SNIFF_BYTES are checked here
+        if not self.sniffed:
+            if not self.size:
+                raise UploadRejected(f"{self.filename}: file is empty")
+            self._sniff()
+        return self.stream.seek(*args)
+
+    def __iter__(self):
+        return iter(self.stream)
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+class UploadRequest(Request):
+    """Request class that allows larger bodies on the bulk ingest endpoint and
+    validates uploaded files while the body is being parsed"""
+    @property
+    def max_content_length(self):
+        if self.endpoint == 'bulk_ingest_attendance':
+            return BULK_MAX_CONTENT_LENGTH
+        return super().max_content_length
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        stream = super()._get_file_stream(total_content_length, content_type, filename, content_length)
+        # Bulk archives are checked member by member as they are extracted
+        if not filename or self.endpoint == 'bulk_ingest_attendance':
+            return stream
+        return ValidatingStream(stream, filename)
+
+app.request_class = UploadRequest
+
+@app.errorhandler(UploadRejected)
+def upload_rejected(e):
+    """Rejections abort form parsing, so they surface here rather than in the view"""
+    return jsonify({'success': False, 'message': e.description}), e.code
+
+@app.errorhandler(RequestEntityTooLarge)
+def request_too_large(e):
+    """Bodies over the request limit never reach the per-file checks"""
+    if request.path.startswith('/api/'):
+        return jsonify({
+            'success': False,
+            'message': f"Request exceeds the {format_size(request.max_content_length)} upload limit"
+        }), 413
+    return e
+
+# JSON serialisation
+def _orjson_default(obj):
+    """Encode the types orjson does not handle natively"""
+    if isinstance(obj, Decimal):
+        return float(obj)
+    if hasattr(obj, '_asdict'):
+        return obj._asdict()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+def row_table(query, rows):
+    """Column names and plain row tuples; orjson encodes tuples natively, so no dict is built per row"""
+    return [column['name'] for column in query.column_descriptions], [tuple(row) for row in rows]
+
+class OrjsonProvider(JSONProvider):
+    """JSON provider backed by orjson; dates, datetimes and Decimals are encoded natively"""
+    options = orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=_orjson_default, option=self.options).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        body = orjson.dumps(obj, default=_orjson_default, option=self.options | orjson.OPT_APPEND_NEWLINE)
+        return self._app.response_class(body, mimetype='application/json')
+
+app.json = OrjsonProvider(app)
+
+# Response compression configuration
+COMPRESS_MIN_SIZE = 1024  # bytes; smaller bodies are sent as-is
+COMPRESS_MIMETYPES = {'application/json', 'application/geo+json', 'text/csv', 'text/html'}
+COMPRESS_GZIP_LEVEL = 6
+COMPRESS_BROTLI_QUALITY = 5
+COMPRESS_CACHE_SIZE = 64  # compressed bodies kept per worker
+_compress_cache = OrderedDict()
+_compress_cache_lock = threading.Lock()
+
+def negotiate_encoding():
+    """Pick the best content coding the client accepts, preferring brotli"""
+    accepted = request.accept_encodings
+    for encoding in ('br', 'gzip'):
+        if accepted[encoding] > 0:
+            return encoding
+    return None
+
+def compress_body(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=COMPRESS_BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=COMPRESS_GZIP_LEVEL, mtime=0)
+
+def cached_compress(body, encoding):
+    """Compress a body once and reuse the result for identical payloads"""
+    key = (hashlib.sha1(body).digest(), encoding)
+    with _compress_cache_lock:
+        compressed = _compress_cache.get(key)
+        if compressed is not None:
+            _compress_cache.move_to_end(key)
+            return compressed
+    compressed = compress_body(body, encoding)
+    with _compress_cache_lock:
+        _compress_cache[key] = compressed
+        while len(_compress_cache) > COMPRESS_CACHE_SIZE:
+            _compress_cache.popitem(last=False)
+    return compressed
 
-db = SQLAlchemy(app)
+@app.after_request
+def compress_response(response):
+    """Compress sizeable text responses according to Accept-Encoding"""
+    if (response.direct_passthrough or response.is_streamed
+            or response.status_code < 200 or response.status_code >= 300
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESS_MIMETYPES):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encoding = negotiate_encoding()
+    if encoding is None:
+        return response
+
+    body = response.get_data()
+    if len(body) < COMPRESS_MIN_SIZE:
+        return response
+
+    cacheable = (request.method == 'GET' and response.status_code == 200
+                 and not response.cache_control.no_store)
+    compressed = cached_compress(body, encoding) if cacheable else compress_body(body, encoding)
+    if len(compressed) >= len(body):
+        return response
+
+    response.set_data(compressed)
+    response.headers['Content-Encoding'] = encoding
+    if response.headers.get('ETag'):
+        # Strong validators must differ between representations
+        etag, weak = response.get_etag()
+        response.set_etag(f"{etag}-{encoding}", weak=weak)
+    return response
+
+class RoutingSession(FlaskSQLAlchemySession):
+    """Session that sends reads to the replica when the current request opted in.
+
+    Flushes, pending ORM changes and bulk INSERT/UPDATE/DELETE statements
+    always go to the primary, so a read-only route that ends up writing
+    (e.g. seeding a generation counter) still writes to the primary. After
+    the first write the rest of the request stays on the primary so it
+    reads its own writes.
+    """
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and has_request_context() and g.get('replica_engine') is not None:
+            writing = (self._flushing or isinstance(clause, UpdateBase)
+                       or self.new or self.dirty or self.deleted)
+            if not writing:
+                return g.replica_engine
+            g.replica_engine = None
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+db = SQLAlchemy(app, session_options={'class_': RoutingSession})
 
 # Database Models
 class User(db.Model):
@@ -53,6 +344,14 @@ class AttendanceRecord(db.Model):
     upload_date = db.Column(db.DateTime, default=datetime.utcnow)
     page_count = db.Column(db.Integer, default=0)
 
+    __table_args__ = (
+        db.Index('ix_attendance_upload_date_id', 'upload_date', 'id'),
+        db.Index('ix_attendance_date_id', 'date', 'id'),
+        db.Index('ix_attendance_venue_id', 'venue', 'id'),
+        db.Index('ix_attendance_event_id', 'event', 'id'),
+        db.Index('ix_attendance_filename_id', 'filename', 'id'),
+    )
+
     def __repr__(self):
         return f'<AttendanceRecord {self.filename}>'
 
@@ -85,6 +384,9 @@ class IrrigationScheme(db.Model):
 
 class GPSData(db.Model):
     __tablename__ = 'gps_data'
+    __table_args__ = (
+        db.Index('ix_gps_data_scheme_recorded', 'scheme_id', 'recorded_at'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     scheme_id = db.Column(db.Integer, db.ForeignKey('irrigation_schemes.scheme_id'), nullable=False)
     latitude = db.Column(db.Numeric(9,6), nullable=False)
@@ -132,130 +434,2573 @@ class Photo(db.Model):
     scheme = db.relationship('IrrigationScheme', backref='photos')
     assessment = db.relationship('Assessment', backref='photos')
 
-# Helper Functions
-def allowed_file(filename):
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+class SchemeLocation(db.Model):
+    """Latest GPS position per scheme, maintained whenever GPSData is recorded"""
+    __tablename__ = 'scheme_locations'
+    __table_args__ = (
+        db.Index('ix_scheme_locations_lat_lon', 'latitude', 'longitude'),
+    )
+    scheme_id = db.Column(db.Integer, db.ForeignKey('irrigation_schemes.scheme_id'), primary_key=True)
+    gps_id = db.Column(db.Integer, db.ForeignKey('gps_data.id'), nullable=False)
+    latitude = db.Column(db.Numeric(9,6), nullable=False)
+    longitude = db.Column(db.Numeric(9,6), nullable=False)
+    recorded_at = db.Column(db.DateTime)
+
+    scheme = db.relationship('IrrigationScheme', backref=db.backref('location', uselist=False))
+
+class SchemeMatchKey(db.Model):
+    """Normalised name and subcounty used to resolve submissions to existing schemes"""
+    __tablename__ = 'scheme_match_keys'
+    __table_args__ = (
+        db.Index('ix_scheme_match_keys_name_subcounty', 'match_name', 'subcounty_id'),
+    )
+    scheme_id = db.Column(db.Integer, db.ForeignKey('irrigation_schemes.scheme_id'), primary_key=True)
+    match_name = db.Column(db.String(100), nullable=False)
+    subcounty_id = db.Column(db.Integer, nullable=False)
+
+class GPSBoundary(db.Model):
+    """Subcounty and ward a GPS point falls in, from the boundaries GeoJSON"""
+    __tablename__ = 'gps_boundaries'
+    gps_id = db.Column(db.Integer, db.ForeignKey('gps_data.id'), primary_key=True)
+    subcounty_name = db.Column(db.String(100), index=True)
+    ward_name = db.Column(db.String(100), index=True)
+    subcounty_match = db.Column(db.Boolean)
+    assigned_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    gps = db.relationship('GPSData', backref=db.backref('boundary', uselist=False))
+
+class AnalyticsCubeCell(db.Model):
+    """Pre-aggregated scheme/assessment measures at the finest dimension grain"""
+    __tablename__ = 'analytics_cube'
+    id = db.Column(db.Integer, primary_key=True)
+    cell_key = db.Column(db.String(1000), nullable=False, unique=True)
+    subcounty = db.Column(db.String(100), index=True)
+    scheme_type = db.Column(db.String(50))
+    current_status = db.Column(db.String(50))
+    infrastructure_status = db.Column(db.String(50))
+    registration_status = db.Column(db.String(50))
+    water_availability = db.Column(db.String(50))
+    application_type = db.Column(db.String(50))
+    main_crop = db.Column(db.String(100))
+    assessment_month = db.Column(db.String(7), index=True)
+    schemes = db.Column(db.Integer, nullable=False, default=0)
+    assessments = db.Column(db.Integer, nullable=False, default=0)
+    farmers_count = db.Column(db.Integer, nullable=False, default=0)
+    scheme_area = db.Column(db.Float, nullable=False, default=0.0)
+    irrigable_area = db.Column(db.Float, nullable=False, default=0.0)
+    cropped_area = db.Column(db.Float, nullable=False, default=0.0)
+
+class SchemeStatusHistory(db.Model):
+    """Append-only record of a scheme's status fields, one row per assessment"""
+    __tablename__ = 'scheme_status_history'
+    __table_args__ = (
+        db.Index('ix_status_history_recorded_on', 'recorded_on', 'id'),
+        db.Index('ix_status_history_scheme_recorded_on', 'scheme_id', 'recorded_on', 'id'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    scheme_id = db.Column(db.Integer, db.ForeignKey('irrigation_schemes.scheme_id'), nullable=False)
+    assessment_id = db.Column(db.Integer, db.ForeignKey('assessments.assessment_id'), unique=True)
+    recorded_on = db.Column(db.Date, nullable=False)
+    current_status = db.Column(db.String(30))
+    infrastructure_status = db.Column(db.String(30))
+    water_availability = db.Column(db.String(30))
+    recorded_at = db.Column(db.DateTime, server_default=db.func.current_timestamp())
+
+class ChangeLog(db.Model):
+    """Append-only feed of row changes; the id doubles as the client cursor"""
+    __tablename__ = 'change_log'
+    __table_args__ = (
+        db.Index('ix_change_log_scheme_id_id', 'scheme_id', 'id'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    table_name = db.Column(db.String(50), nullable=False, index=True)
+    row_id = db.Column(db.Integer, nullable=False)
+    operation = db.Column(db.String(10), nullable=False)
+    scheme_id = db.Column(db.Integer)
+    data = db.Column(db.Text)
+    changed_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+class LiveEvent(db.Model):
+    """Short-lived events fanned out to Server-Sent Events subscribers"""
+    __tablename__ = 'live_events'
+    id = db.Column(db.Integer, primary_key=True)
+    event_type = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+class DataGeneration(db.Model):
+    __tablename__ = 'data_generations'
+    name = db.Column(db.String(50), primary_key=True)
+    generation = db.Column(db.Integer, nullable=False, default=0)
+
+class FileTombstone(db.Model):
+    """An upload whose row was deleted; the file is unlinked later by the sweeper"""
+    __tablename__ = 'file_tombstones'
+    id = db.Column(db.Integer, primary_key=True)
+    file_path = db.Column(db.String(255), nullable=False, index=True)
+    table_name = db.Column(db.String(50), nullable=False)
+    row_id = db.Column(db.Integer, nullable=False)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+class StorageCheckpoint(db.Model):
+    """Directory mtime at the last reconcile that found it consistent with the database"""
+    __tablename__ = 'storage_checkpoints'
+    directory = db.Column(db.String(500), primary_key=True)
+    mtime_ns = db.Column(db.BigInteger, nullable=False)
+    checked_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class ArchivedFile(db.Model):
+    """Where an archived attendance file's bytes sit inside a segment file"""
+    __tablename__ = 'archived_files'
+    record_id = db.Column(db.Integer, db.ForeignKey('attendance_record.id'), primary_key=True)
+    segment = db.Column(db.String(255), nullable=False, index=True)
+    data_offset = db.Column(db.BigInteger, nullable=False)
+    size = db.Column(db.BigInteger, nullable=False)
+    crc32 = db.Column(db.BigInteger, nullable=False)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    record = db.relationship('AttendanceRecord', backref=db.backref(
+        'archive', uselist=False, cascade='all, delete-orphan'
+    ))
+
+# Change feed
+CHANGE_TRACKED_MODELS = (IrrigationScheme, Assessment, Document, Photo, AttendanceRecord)
+CHANGE_FEED_LIMIT = 500
+# Longest a transaction may stay open after writing change_log rows; older id gaps are rollbacks
+CHANGE_FEED_SETTLE = timedelta(seconds=60)
+
+def _json_value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    return value
+
+@event.listens_for(SessionBase, 'after_flush')
+def record_changes(session, flush_context):
+    """Write a change_log row for every tracked insert, update and delete"""
+    changes = []
+    for operation, objects in (('insert', session.new), ('update', session.dirty), ('delete', session.deleted)):
+        for obj in objects:
+            if not isinstance(obj, CHANGE_TRACKED_MODELS):
+                continue
+            if operation == 'update' and not session.is_modified(obj, include_collections=False):
+                continue
+
+            state = db.inspect(obj)
+            values = {attr.key: state.dict.get(attr.key) for attr in state.mapper.column_attrs}
+            changes.append({
+                'table_name': obj.__tablename__,
+                'row_id': state.mapper.primary_key_from_instance(obj)[0],
+                'operation': operation,
+                'scheme_id': values.get('scheme_id'),
+                'data': None if operation == 'delete' else json.dumps(
+                    {k: _json_value(v) for k, v in values.items()}
+                ),
+                'changed_at': datetime.utcnow()
+            })
+
+    if changes:
+        session.connection().execute(ChangeLog.__table__.insert(), changes)
+        if has_request_context():
+            g.wrote_changes = True
+
+# Read replica routing
+class ReplicaMonitor:
+    """Per-worker view of how far the read replica trails the primary.
+
+    Lag is measured through the change feed: the replica is as stale as the
+    oldest primary change_log row it has not replayed yet. This works the
+    same on streaming Postgres replicas and on a copied SQLite file.
+    """
+
+    def __init__(self, url):
+        self.engine = create_engine(url, pool_pre_ping=True) if url else None
+        self.lock = threading.Lock()
+        self.checked_at = 0.0
+        self.healthy = False
+        self.replica_cursor = 0
+        self.lag_seconds = None
+
+    def refresh(self):
+        """Compare the replica's change feed position with the primary's"""
+        try:
+            with self.engine.connect() as conn:
+                replica_cursor = conn.execute(select(func.max(ChangeLog.id))).scalar() or 0
+            oldest_missing = db.session.query(func.min(ChangeLog.changed_at)).filter(
+                ChangeLog.id > replica_cursor
+            ).scalar()
+            lag = (datetime.utcnow() - oldest_missing).total_seconds() if oldest_missing else 0.0
+            healthy = lag <= REPLICA_MAX_LAG_SECONDS
+            if not healthy and self.healthy:
+                app.logger.warning(f"Read replica is {lag:.0f}s behind; serving reads from the primary")
+        except Exception as e:
+            app.logger.warning(f"Read replica check failed: {str(e)}")
+            replica_cursor, lag, healthy = self.replica_cursor, None, False
+
+        self.replica_cursor = replica_cursor
+        self.lag_seconds = lag
+        self.healthy = healthy
+        self.checked_at = time.monotonic()
+
+    def engine_for(self, min_cursor=0):
+        """Return the replica engine if it is healthy and has replayed min_cursor"""
+        if self.engine is None:
+            return None
+        with self.lock:
+            if time.monotonic() - self.checked_at >= REPLICA_CHECK_SECONDS:
+                self.refresh()
+            if self.healthy and self.replica_cursor >= min_cursor:
+                return self.engine
+        return None
+
+replica_monitor = ReplicaMonitor(REPLICA_DATABASE_URL)
+
+def read_replica(f):
+    """Serve a read-only route from the replica when it is safe to do so"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if replica_monitor.engine is not None:
+            min_cursor = request.cookies.get(PRIMARY_CURSOR_COOKIE, 0, type=int)
+            g.replica_engine = replica_monitor.engine_for(min_cursor)
+        return f(*args, **kwargs)
+    return decorated_function
+
+@app.after_request
+def remember_primary_cursor(response):
+    """Pin a client to the primary until the replica has replayed its writes"""
+    if replica_monitor.engine is not None and g.get('wrote_changes'):
+        g.replica_engine = None
+        try:
+            cursor = db.session.query(func.max(ChangeLog.id)).scalar() or 0
+            response.set_cookie(PRIMARY_CURSOR_COOKIE, str(cursor),
+                                max_age=PRIMARY_CURSOR_MAX_AGE, httponly=True, samesite='Lax')
+        except Exception as e:
+            app.logger.warning(f"Could not record primary cursor: {str(e)}")
+    return response
+
+# Admission control
+ADMISSION_LOCK_DIR = os.environ.get('ADMISSION_LOCK_DIR', os.path.join(tempfile.gettempdir(), 'cidu_admission'))
+ADMISSION_POLL_SECONDS = 0.05
+HEAVY_PER_WORKER = int(os.environ.get('HEAVY_PER_WORKER', 2))
+HEAVY_SHARED_SLOTS = int(os.environ.get('HEAVY_SHARED_SLOTS', 3))
+HEAVY_MAX_QUEUE = int(os.environ.get('HEAVY_MAX_QUEUE', 8))
+HEAVY_QUEUE_SECONDS = float(os.environ.get('HEAVY_QUEUE_SECONDS', 10))
+HEAVY_ENDPOINTS = {
+    'dashboard', 'analytics_data', 'analytics_pivot', 'analytics_area_stats', 'api_ward_analytics',
+    'api_status_history_monthly',
+    'get_attendance_stats', 'file_management', 'export_csv', 'export_pdf',
+    'export_assessments', 'export_single_assessment', 'api_assessments', 'api_plan_route',
+    'bulk_ingest_attendance'
+}
+# Live streams stay open for minutes and are capped by SSE_MAX_STREAMS instead
+ADMISSION_EXEMPT_ENDPOINTS = {'static', 'event_stream'}
+
+class AdmissionGate:
+    """Caps concurrent requests of one class, per worker and across workers.
+
+    The per-worker cap is a semaphore; the cross-worker cap is a set of slot
+    files, each held with an exclusive flock for the duration of a request.
+    Requests wait in a bounded queue until a deadline, then get rejected.
+    """
+
+    def __init__(self, name, per_worker=None, shared_slots=None, max_queue=0, queue_seconds=0.0):
+        self.name = name
+        self.per_worker = per_worker
+        self.shared_slots = shared_slots
+        self.max_queue = max_queue
+        self.queue_seconds = queue_seconds
+        self.semaphore = threading.BoundedSemaphore(per_worker) if per_worker else None
+        self.lock = threading.Lock()
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+
+    def _acquire_slot(self, deadline):
+        """Hold one of the shared slot files; returns its descriptor or None"""
+        os.makedirs(ADMISSION_LOCK_DIR, exist_ok=True)
+        while True:
+            for slot in range(self.shared_slots):
+                fd = os.open(os.path.join(ADMISSION_LOCK_DIR, f"{self.name}-{slot}.lock"), os.O_RDWR | os.O_CREAT)
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    return fd
+                except BlockingIOError:
+                    os.close(fd)
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(ADMISSION_POLL_SECONDS)
+
+    def acquire(self):
+        """Admit the current request; returns a token, or None when saturated"""
+        if self.semaphore is None:
+            with self.lock:
+                self.active += 1
+                self.admitted += 1
+            return True
+
+        with self.lock:
+            if self.waiting >= self.max_queue:
+                self.rejected += 1
+                return None
+            self.waiting += 1
+
+        deadline = time.monotonic() + self.queue_seconds
+        token = None
+        try:
+            if self.semaphore.acquire(timeout=self.queue_seconds):
+                token = True
+                if fcntl is not None and self.shared_slots:
+                    try:
+                        token = self._acquire_slot(deadline)
+                    except OSError as e:
+                        app.logger.warning(f"Admission slot files unavailable: {str(e)}")
+                        token = True
+                    if token is None:
+                        self.semaphore.release()
+        finally:
+            with self.lock:
+                self.waiting -= 1
+                if token is None:
+                    self.rejected += 1
+                else:
+                    self.active += 1
+                    self.admitted += 1
+        return token
+
+    def release(self, token):
+        if self.semaphore is not None:
+            if token is not True:
+                fcntl.flock(token, fcntl.LOCK_UN)
+                os.close(token)
+            self.semaphore.release()
+        with self.lock:
+            self.active -= 1
+
+    def stats(self):
+        with self.lock:
+            return {
+                'active': self.active,
+                'waiting': self.waiting,
+                'admitted': self.admitted,
+                'rejected': self.rejected,
+                'per_worker_limit': self.per_worker,
+                'shared_limit': self.shared_slots if fcntl is not None else None,
+                'max_queue': self.max_queue
+            }
+
+admission_gates = {
+    'heavy': AdmissionGate('heavy', HEAVY_PER_WORKER, HEAVY_SHARED_SLOTS, HEAVY_MAX_QUEUE, HEAVY_QUEUE_SECONDS),
+    'light': AdmissionGate('light')
+}
+
+@app.before_request
+def admit_request():
+    """Queue heavy routes behind the admission gate, shedding load when saturated"""
+    if request.endpoint is None or request.endpoint in ADMISSION_EXEMPT_ENDPOINTS:
+        return None
+    gate = admission_gates['heavy' if request.endpoint in HEAVY_ENDPOINTS else 'light']
+    token = gate.acquire()
+    if token is None:
+        retry_after = str(max(1, math.ceil(gate.queue_seconds)))
+        if request.path.startswith('/api/'):
+            response = jsonify({'error': 'Server is busy, please retry shortly'})
+        else:
+            response = make_response('Server is busy, please retry shortly', 503)
+        response.status_code = 503
+        response.headers['Retry-After'] = retry_after
+        return response
+    g.admission = (gate, token)
+    return None
+
+@app.after_request
+def release_admission_on_close(response):
+    """Hold a streamed response's admission until the server closes its body.
+
+    Teardown runs once the view returns, before a generator or file body
+    is sent, so the token moves to the response's close() instead. Werkzeug
+    hands a direct-passthrough body (send_file) to the server as is, never
+    calling the response's close callbacks, so that body is wrapped.
+    """
+    if response.is_streamed or response.direct_passthrough:
+        admission = g.pop('admission', None)
+        if admission is not None:
+            gate, token = admission
+            release = lambda: gate.release(token)
+            if response.direct_passthrough:
+                response.response = ClosingIterator(response.response, release)
+            else:
+                response.call_on_close(release)
+    return response
+
+@app.teardown_request
+def release_admission(exc):
+    admission = g.pop('admission', None)
+    if admission is not None:
+        gate, token = admission
+        gate.release(token)
+
+# Live events (Server-Sent Events)
+SSE_POLL_SECONDS = 1.0
+SSE_HEARTBEAT_SECONDS = 15
+SSE_STREAM_SECONDS = 300
+SSE_EVENT_RETENTION = timedelta(hours=1)
+SSE_QUEUE_SIZE = 100
+SSE_GAP_SETTLE_SECONDS = 60  # an id gap older than this is a rolled-back transaction
+SSE_SENT_IDS = 1000
+# Each open stream pins a worker thread, so cap them below the thread count
+SSE_MAX_STREAMS = int(os.environ.get('SSE_MAX_STREAMS', 4))
+SSE_RETRY_AFTER_SECONDS = 30
+
+def publish_event(event_type, **payload):
+    """Queue a live event; workers see it once the current transaction commits"""
+    db.session.add(LiveEvent(
+        event_type=event_type,
+        payload=json.dumps({k: _json_value(v) for k, v in payload.items()})
+    ))
+
+def _event_dict(event):
+    return {'id': event.id, 'type': event.event_type, 'data': event.payload or '{}'}
+
+class EventBroker:
+    """Per-worker fan-out of live_events rows to SSE subscriber queues.
+
+    The live_events table is the cross-worker channel: each worker runs one
+    polling thread while it has subscribers, instead of one query per
+    open stream.
+    """
+
+    def __init__(self):
+        self.subscribers = set()
+        self.lock = threading.Lock()
+        self.thread = None
+        self.last_pruned = None
+
+    def subscribe(self):
+        """A new subscriber queue, or None when this worker already holds SSE_MAX_STREAMS"""
+        subscriber = queue.Queue(maxsize=SSE_QUEUE_SIZE)
+        with self.lock:
+            if len(self.subscribers) >= SSE_MAX_STREAMS:
+                return None
+            self.subscribers.add(subscriber)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name='sse-broker', daemon=True)
+                self.thread.start()
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            self.subscribers.discard(subscriber)
+
+    def _run(self):
+        with app.app_context():
+            # Earlier events reach new subscribers through Last-Event-ID replay.
+            # Recent ones count as seen so gaps between them are still watched.
+            recent = [event_id for (event_id,) in db.session.query(LiveEvent.id).filter(
+                LiveEvent.created_at >= datetime.utcnow() - timedelta(seconds=SSE_GAP_SETTLE_SECONDS)
+            )]
+            if recent:
+                last_id = min(recent) - 1
+            else:
+                last_id = db.session.query(func.max(LiveEvent.id)).scalar() or 0
+            seen, gaps = set(recent), {}
+            db.session.remove()
+            while True:
+                with self.lock:
+                    if not self.subscribers:
+                        self.thread = None
+                        return
+                    subscribers = list(self.subscribers)
+                try:
+                    events = [_event_dict(e) for e in LiveEvent.query.filter(
+                        LiveEvent.id > last_id
+                    ).order_by(LiveEvent.id).limit(SSE_QUEUE_SIZE + len(seen)).all()]
+                    self._prune()
+                except Exception as e:
+                    app.logger.warning(f"Live event poll failed: {str(e)}")
+                    db.session.rollback()
+                    events = []
+                finally:
+                    db.session.remove()
+
+                for event in events:
+                    if event['id'] in seen:
+                        continue
+                    seen.add(event['id'])
+                    for subscriber in subscribers:
+                        try:
+                            subscriber.put_nowait(event)
+                        except queue.Full:
+                            pass  # slow client; it resyncs from Last-Event-ID on reconnect
+                last_id = self._advance(last_id, seen, gaps)
+                time.sleep(SSE_POLL_SECONDS)
+
+    @staticmethod
+    def _advance(last_id, seen, gaps):
+        """Move the poll cursor over delivered ids and over settled gaps.
+
+        Ids are allocated at insert, not at commit, so an id below one that
+        was already delivered can still appear. Such gaps stay polled until
+        they fill or SSE_GAP_SETTLE_SECONDS pass. gaps maps missing ids to
+        when they were first noticed.
+        """
+        now = time.monotonic()
+        if seen:
+            for missing in set(range(last_id + 1, max(seen))) - seen:
+                gaps.setdefault(missing, now)
+        while seen:
+            next_id = last_id + 1
+            if next_id in seen:
+                seen.discard(next_id)
+                gaps.pop(next_id, None)
+            elif now - gaps[next_id] >= SSE_GAP_SETTLE_SECONDS:
+                del gaps[next_id]
+            else:
+                break
+            last_id = next_id
+        return last_id
+
+    def _prune(self):
+        now = datetime.utcnow()
+        if self.last_pruned and now - self.last_pruned < timedelta(minutes=10):
+            return
+        self.last_pruned = now
+        LiveEvent.query.filter(LiveEvent.created_at < now - SSE_EVENT_RETENTION).delete(synchronize_session=False)
+        db.session.commit()
+
+event_broker = EventBroker()
+
+# Helper Functions
+def allowed_file(filename):
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+
+def parse_date(date_str):
+    """Parse date from string in YYYY-MM-DD format"""
+    try:
+        return datetime.strptime(date_str, '%Y-%m-%d').date()
+    except (ValueError, TypeError):
+        return None
+
+def parse_gps_coordinates(gps_str):
+    """Parse GPS coordinates from string to decimal degrees"""
+    try:
+        if not gps_str:
+            raise ValueError("Empty GPS coordinates")
+            
+        cleaned = gps_str.replace('°', '').strip()
+        parts = re.split(r'[,\s]+', cleaned)
+        parts = [p for p in parts if p]
+        
+        if len(parts) == 2:
+            try:
+                return float(parts[0]), float(parts[1])
+            except ValueError:
+                pass
+        
+        if len(parts) == 4:
+            try:
+                lat = float(parts[0]) * (1 if parts[1].upper() in ['N', ''] else -1)
+                lon = float(parts[2]) * (1 if parts[3].upper() in ['E', ''] else -1)
+                return lat, lon
+            except ValueError:
+                pass
+                
+        raise ValueError("Could not parse GPS coordinates. Use format: '0.6341° N, 35.7364° E' or '-0.6341, 35.7364'")
+    except Exception as e:
+        raise ValueError(f"GPS parsing error: {str(e)}")
+
+def stage_upload(file, staging):
+    """Copy an uploaded file into the staging directory; returns the staged path"""
+    staged_path = os.path.join(staging, uuid.uuid4().hex)
+    with open(staged_path, 'wb') as target:
+        shutil.copyfileobj(file.stream, target, COPY_CHUNK_SIZE)
+    return staged_path
+
+def stage_uploads(files, staging):
+    """Stage several uploads in parallel on the shared upload pool"""
+    futures = [upload_executor.submit(stage_upload, file, staging) for file in files]
+    return [future.result() for future in futures]
+
+def unique_upload_path(subfolder, filename):
+    """Final location for an upload; the prefix keeps same-named files apart"""
+    return os.path.join(app.config['UPLOAD_FOLDER'], subfolder, f"{uuid.uuid4().hex[:12]}_{filename}")
+
+def promote_staged_files(moves):
+    """Move committed uploads from staging into place"""
+    for staged_path, filepath in moves:
+        try:
+            os.makedirs(os.path.dirname(filepath), exist_ok=True)
+            os.replace(staged_path, filepath)
+        except OSError as e:
+            app.logger.error(f"Could not move {staged_path} to {filepath}: {str(e)}")
+
+def validate_file(file):
+    """Validate an uploaded file's type, content and size.
+
+    Parts received through UploadRequest have already been checked as they
+    arrived; this covers files from anywhere else. Browsers rarely send a
+    per-part Content-Length, so the size is measured from the stream itself.
+    """
+    if not allowed_file(file.filename):
+        return False, f"Only {', '.join(sorted(ALLOWED_EXTENSIONS))} files are allowed"
+    stream = file.stream
+    start = stream.tell()
+    head = stream.read(SNIFF_BYTES)
+    size = stream.seek(0, os.SEEK_END) - start
+    stream.seek(start)
+    limit = UPLOAD_SIZE_LIMITS[file_extension(file.filename)]
+    if size > limit:
+        return False, f"File size exceeds {format_size(limit)} limit"
+    if not size:
+        return False, "File is empty"
+    error = check_file_signature(file.filename, head)
+    if error:
+        return False, error
+    return True, ""
+
+def format_date_key(d, time_period):
+    """Format date based on time period"""
+    if time_period == 'monthly':
+        return d.strftime('%b %Y')
+    elif time_period == 'weekly':
+        year, week, _ = d.isocalendar()
+        return f'W{week:02d} {year}'
+    elif time_period == 'yearly':
+        return d.strftime('%Y')
+    else:  # daily
+        return d.strftime('%Y-%m-%d')
+
+def increment_date(d, time_period):
+    """Increment date based on time period"""
+    if time_period == 'monthly':
+        # Get first day of next month
+        if d.month == 12:
+            return date(d.year + 1, 1, 1)
+        return date(d.year, d.month + 1, 1)
+    elif time_period == 'weekly':
+        return d + timedelta(days=7)
+    elif time_period == 'yearly':
+        return date(d.year + 1, 1, 1)
+    else:  # daily
+        return d + timedelta(days=1)
+
+def process_trend_data(results, time_period, start_date=None, end_date=None):
+    """Process data for trend chart"""
+    date_counts = defaultdict(int)
+    
+    for record in results:
+        date_key = format_date_key(record.date, time_period)
+        date_counts[date_key] += record.count
+    
+    # Fill in missing dates if range is provided
+    if start_date and end_date:
+        current_date = start_date
+        while current_date <= end_date:
+            date_key = format_date_key(current_date, time_period)
+            if date_key not in date_counts:
+                date_counts[date_key] = 0
+            current_date = increment_date(current_date, time_period)
+    
+    # Sort by date
+    sorted_dates = sorted(date_counts.items(), key=lambda x: x[0])
+    
+    return {
+        'labels': [x[0] for x in sorted_dates],
+        'values': [x[1] for x in sorted_dates]
+    }
+
+def process_venue_data(results):
+    """Process data for venue comparison chart"""
+    return {
+        'labels': [x[0] for x in results if x[0]],
+        'values': [x[1] for x in results if x[0]]
+    }
+
+def process_event_data(results):
+    """Process data for event distribution chart"""
+    return {
+        'labels': [x[0] if x[0] else 'No Event' for x in results],
+        'values': [x[1] for x in results]
+    }
+
+def normalize_status(status):
+    """Normalize a scheme's current status for map filtering"""
+    if not status:
+        return 'unknown'
+    status = status.lower().strip()
+    if 'active' in status:
+        return 'active'
+    elif 'dormant' in status:
+        return 'dormant'
+    elif 'construct' in status or 'ongoing' in status:
+        return 'under-construction'
+    elif 'proposed' in status or 'planned' in status:
+        return 'proposed'
+    return 'unknown'
+
+def get_data_generation(name='schemes'):
+    """Return the current generation counter used to key cached data"""
+    row = db.session.get(DataGeneration, name)
+    return row.generation if row else 0
+
+def bump_data_generation(name='schemes'):
+    """Increment a generation counter as part of the current transaction"""
+    updated = DataGeneration.query.filter_by(name=name).update(
+        {DataGeneration.generation: DataGeneration.generation + 1},
+        synchronize_session=False
+    )
+    if not updated:
+        db.session.add(DataGeneration(name=name, generation=1))
+
+def record_gps_point(scheme_id, lat, lon, recorded_at=None):
+    """Add a GPSData row and move the scheme's latest location to it"""
+    gps = GPSData(
+        scheme_id=scheme_id,
+        latitude=lat,
+        longitude=lon,
+        recorded_at=recorded_at or datetime.utcnow()
+    )
+    db.session.add(gps)
+    db.session.flush()
+
+    location = db.session.get(SchemeLocation, scheme_id)
+    if location is None:
+        db.session.add(SchemeLocation(
+            scheme_id=scheme_id, gps_id=gps.id, latitude=lat, longitude=lon, recorded_at=gps.recorded_at
+        ))
+    elif location.recorded_at is None or gps.recorded_at >= location.recorded_at:
+        location.gps_id = gps.id
+        location.latitude = lat
+        location.longitude = lon
+        location.recorded_at = gps.recorded_at
+    return gps
+
+def backfill_scheme_locations():
+    """Rebuild scheme_locations from the newest GPSData row of every scheme"""
+    ranked = db.session.query(
+        GPSData.scheme_id,
+        GPSData.id,
+        GPSData.latitude,
+        GPSData.longitude,
+        GPSData.recorded_at,
+        func.row_number().over(
+            partition_by=GPSData.scheme_id,
+            order_by=(GPSData.recorded_at.desc(), GPSData.id.desc())
+        ).label('rank')
+    ).subquery()
+
+    latest = db.select(
+        ranked.c.scheme_id, ranked.c.id, ranked.c.latitude, ranked.c.longitude, ranked.c.recorded_at
+    ).where(ranked.c.rank == 1)
+
+    db.session.execute(db.delete(SchemeLocation))
+    result = db.session.execute(
+        db.insert(SchemeLocation).from_select(
+            ['scheme_id', 'gps_id', 'latitude', 'longitude', 'recorded_at'], latest
+        )
+    )
+    db.session.commit()
+    return result.rowcount
+
+# Status history
+STATUS_HISTORY_FIELDS = ('current_status', 'infrastructure_status', 'water_availability')
+STATUS_HISTORY_MAX_MONTHS = 240
+
+def record_status_history(scheme, assessment):
+    """Append the scheme's status fields as observed by an assessment"""
+    db.session.add(SchemeStatusHistory(
+        scheme_id=scheme.scheme_id,
+        assessment_id=assessment.assessment_id,
+        recorded_on=assessment.assessment_date,
+        **{field: getattr(scheme, field) for field in STATUS_HISTORY_FIELDS}
+    ))
+
+def backfill_status_history():
+    """Add history rows for assessments that have none, from their scheme's current status"""
+    missing = db.select(
+        Assessment.scheme_id,
+        Assessment.assessment_id,
+        Assessment.assessment_date,
+        *[getattr(IrrigationScheme, field) for field in STATUS_HISTORY_FIELDS]
+    ).join(
+        IrrigationScheme, Assessment.scheme_id == IrrigationScheme.scheme_id
+    ).where(
+        ~db.exists().where(SchemeStatusHistory.assessment_id == Assessment.assessment_id)
+    )
+    result = db.session.execute(
+        db.insert(SchemeStatusHistory).from_select(
+            ['scheme_id', 'assessment_id', 'recorded_on', *STATUS_HISTORY_FIELDS], missing
+        )
+    )
+    db.session.commit()
+    return result.rowcount
+
+def month_end(d):
+    return date(d.year, d.month, calendar.monthrange(d.year, d.month)[1])
+
+def parse_month(value, default):
+    """Parse YYYY-MM or YYYY-MM-DD into the end of that month"""
+    if not value:
+        return month_end(default)
+    parsed = parse_date(value) or parse_date(f"{value}-01")
+    if parsed is None:
+        raise ValueError(f"Invalid month: {value}")
+    return month_end(parsed)
+
+def status_time_series(field, start, end):
+    """Status counts at each month end from start to end.
+
+    Seeds each scheme's status as of the first month end with one window
+    query, then walks only the history rows recorded after it, carrying each
+    scheme's latest status forward from month to month.
+    """
+    month_ends = []
+    current = start
+    while current <= end:
+        month_ends.append(current)
+        current = month_end(current + timedelta(days=1))
+
+    latest = dict(latest_statuses_as_of(field, start))
+    counts = defaultdict(int)
+    for status in latest.values():
+        counts[status] += 1
+
+    column = getattr(SchemeStatusHistory, field)
+    rows = db.session.query(
+        SchemeStatusHistory.recorded_on, SchemeStatusHistory.scheme_id, column
+    ).filter(
+        SchemeStatusHistory.recorded_on > start,
+        SchemeStatusHistory.recorded_on <= end
+    ).order_by(
+        SchemeStatusHistory.recorded_on, SchemeStatusHistory.id
+    ).yield_per(5000)
+
+    series = []
+
+    def snapshot(as_of):
+        series.append({
+            'month': as_of.strftime('%Y-%m'),
+            'as_of': as_of,
+            'total': len(latest),
+            'counts': {status: count for status, count in sorted(counts.items()) if count}
+        })
+
+    i = 0
+    for recorded_on, scheme_id, status in rows:
+        while i < len(month_ends) and recorded_on > month_ends[i]:
+            snapshot(month_ends[i])
+            i += 1
+        previous = latest.get(scheme_id)
+        if previous is not None:
+            counts[previous] -= 1
+        status = status or 'Unknown'
+        latest[scheme_id] = status
+        counts[status] += 1
+    while i < len(month_ends):
+        snapshot(month_ends[i])
+        i += 1
+    return series
+
+def latest_status_query(field, as_of):
+    """Each scheme's latest history row on or before as_of, ranked by window"""
+    column = getattr(SchemeStatusHistory, field)
+    ranked = db.session.query(
+        SchemeStatusHistory.scheme_id,
+        column.label('status'),
+        func.row_number().over(
+            partition_by=SchemeStatusHistory.scheme_id,
+            order_by=(SchemeStatusHistory.recorded_on.desc(), SchemeStatusHistory.id.desc())
+        ).label('rank')
+    ).filter(
+        SchemeStatusHistory.recorded_on <= as_of
+    ).subquery()
+    return ranked
+
+def latest_statuses_as_of(field, as_of):
+    """(scheme_id, status) for every scheme with history on or before as_of"""
+    ranked = latest_status_query(field, as_of)
+    rows = db.session.query(ranked.c.scheme_id, ranked.c.status).filter(ranked.c.rank == 1)
+    return [(scheme_id, status or 'Unknown') for scheme_id, status in rows]
+
+def status_counts_as_of(field, as_of):
+    """Status counts from each scheme's latest history row on or before as_of"""
+    ranked = latest_status_query(field, as_of)
+
+    rows = db.session.query(
+        ranked.c.status, func.count()
+    ).filter(ranked.c.rank == 1).group_by(ranked.c.status).all()
+    counts = defaultdict(int)
+    for status, count in rows:
+        counts[status or 'Unknown'] += count
+    return dict(sorted(counts.items()))
+
+def ensure_indexes():
+    """Create indexes declared on models whose tables already existed"""
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=db.engine, checkfirst=True)
+
+# Attendance listing configuration
+ATTENDANCE_SORT_KEYS = {
+    'upload_date': AttendanceRecord.upload_date,
+    'date': AttendanceRecord.date,
+    'venue': AttendanceRecord.venue,
+    'event': AttendanceRecord.event,
+    'filename': AttendanceRecord.filename
+}
+ATTENDANCE_MAX_PER_PAGE = 100
+ATTENDANCE_COUNT_CACHE_SIZE = 128
+_attendance_count_cache = OrderedDict()
+_attendance_count_lock = threading.Lock()
+
+ATTENDANCE_FILTER_ARGS = ('date', 'date_from', 'date_to', 'month', 'venue', 'event', 'q')
+ATTENDANCE_SEARCH_COLUMNS = ('filename', 'venue', 'event')
+ATTENDANCE_FTS_MIN_LENGTH = 3  # trigram tokenizer needs at least one full trigram
+ATTENDANCE_FTS_SCAN_THRESHOLD = 20000  # above this many hits, walking the sort index is cheaper
+attendance_fts_enabled = False
+ATTENDANCE_FACET_CACHE_SIZE = 64
+_attendance_facet_cache = OrderedDict()
+_attendance_facet_lock = threading.Lock()
+
+def attendance_filters(args):
+    """The attendance filters present in a request, in a stable hashable form"""
+    return tuple((name, args.get(name)) for name in ATTENDANCE_FILTER_ARGS if args.get(name))
+
+def apply_attendance_filters(query, filters, use_fts=True):
+    filters = dict(filters)
+    if filters.get('date'):
+        query = query.filter(AttendanceRecord.date == filters['date'])
+    if filters.get('month'):
+        first_day = parse_date(f"{filters['month']}-01")
+        if first_day is not None:
+            query = query.filter(AttendanceRecord.date.between(first_day, month_end(first_day)))
+    if parse_date(filters.get('date_from')):
+        query = query.filter(AttendanceRecord.date >= parse_date(filters['date_from']))
+    if parse_date(filters.get('date_to')):
+        query = query.filter(AttendanceRecord.date <= parse_date(filters['date_to']))
+    if filters.get('venue'):
+        query = query.filter(AttendanceRecord.venue == filters['venue'])
+    if filters.get('event'):
+        query = query.filter(AttendanceRecord.event == filters['event'])
+    if filters.get('q', '').strip():
+        query = query.filter(attendance_search_condition(filters['q'].strip(), use_fts))
+    return query
+
+def attendance_search_condition(term, use_fts=True):
+    """Case-insensitive substring match on filename, venue or event.
+
+    On SQLite, terms long enough to form a trigram go through the
+    attendance_search FTS5 table; everything else is a LIKE on lower(column),
+    which Postgres serves from the pg_trgm GIN indexes.
+    """
+    if use_fts and attendance_fts_enabled and len(term) >= ATTENDANCE_FTS_MIN_LENGTH:
+        phrase = '"' + term.replace('"', '""') + '"'
+        return AttendanceRecord.id.in_(
+            db.select(db.literal_column('rowid')).select_from(db.table('attendance_search')).where(
+                db.literal_column('attendance_search').op('MATCH')(phrase)
+            )
+        )
+    term = term.lower()
+    return or_(*[
+        func.lower(getattr(AttendanceRecord, column)).contains(term, autoescape=True)
+        for column in ATTENDANCE_SEARCH_COLUMNS
+    ])
+
+def ensure_attendance_search_index():
+    """Create the substring search index for the current database.
+
+    Postgres gets pg_trgm GIN indexes on lower(column). SQLite gets an FTS5
+    trigram table over attendance_record kept in step by triggers.
+    """
+    global attendance_fts_enabled
+    dialect = db.engine.dialect.name
+    with db.engine.begin() as conn:
+        if dialect == 'postgresql':
+            conn.exec_driver_sql("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+            for column in ATTENDANCE_SEARCH_COLUMNS:
+                conn.exec_driver_sql(
+                    f"CREATE INDEX IF NOT EXISTS ix_attendance_{column}_trgm "
+                    f"ON attendance_record USING gin (lower({column}) gin_trgm_ops)"
+                )
+        elif dialect == 'sqlite':
+            exists = conn.exec_driver_sql(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'attendance_search'"
+            ).first()
+            conn.exec_driver_sql(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS attendance_search USING fts5("
+                "filename, venue, event, content='attendance_record', content_rowid='id', tokenize='trigram')"
+            )
+            conn.exec_driver_sql(
+                "CREATE TRIGGER IF NOT EXISTS attendance_search_ai AFTER INSERT ON attendance_record BEGIN "
+                "INSERT INTO attendance_search(rowid, filename, venue, event) "
+                "VALUES (new.id, new.filename, new.venue, new.event); END"
+            )
+            conn.exec_driver_sql(
+                "CREATE TRIGGER IF NOT EXISTS attendance_search_ad AFTER DELETE ON attendance_record BEGIN "
+                "INSERT INTO attendance_search(attendance_search, rowid, filename, venue, event) "
+                "VALUES ('delete', old.id, old.filename, old.venue, old.event); END"
+            )
+            conn.exec_driver_sql(
+                "CREATE TRIGGER IF NOT EXISTS attendance_search_au AFTER UPDATE ON attendance_record BEGIN "
+                "INSERT INTO attendance_search(attendance_search, rowid, filename, venue, event) "
+                "VALUES ('delete', old.id, old.filename, old.venue, old.event); "
+                "INSERT INTO attendance_search(rowid, filename, venue, event) "
+                "VALUES (new.id, new.filename, new.venue, new.event); END"
+            )
+            if not exists:
+                conn.exec_driver_sql("INSERT INTO attendance_search(attendance_search) VALUES ('rebuild')")
+            attendance_fts_enabled = True
+
+def attendance_facets(filters):
+    """Venue, event and month counts, each under every active filter except its own.
+
+    A single GROUP BY venue, event, date query (with no facet filters
+    applied) is enough for all three facets; the facet filters are then
+    applied to the grouped rows, skipping the facet being counted.
+    """
+    filters = dict(filters)
+    facet_filters = {'venue', 'event', 'date', 'month'}
+    rows = apply_attendance_filters(
+        db.session.query(
+            AttendanceRecord.venue, AttendanceRecord.event, AttendanceRecord.date, func.count(AttendanceRecord.id)
+        ),
+        tuple((k, v) for k, v in filters.items() if k not in facet_filters)
+    ).group_by(
+        AttendanceRecord.venue, AttendanceRecord.event, AttendanceRecord.date
+    ).all()
+
+    def matches(venue, event, day, skip):
+        if skip != 'venue' and filters.get('venue') and venue != filters['venue']:
+            return False
+        if skip != 'event' and filters.get('event') and event != filters['event']:
+            return False
+        if skip != 'month':
+            if filters.get('date') and (day is None or day.isoformat() != filters['date']):
+                return False
+            if filters.get('month') and (day is None or day.strftime('%Y-%m') != filters['month']):
+                return False
+        return True
+
+    facets = {'venue': defaultdict(int), 'event': defaultdict(int), 'month': defaultdict(int)}
+    total = 0
+    for venue, event, day, count in rows:
+        if matches(venue, event, day, None):
+            total += count
+        if venue and matches(venue, event, day, 'venue'):
+            facets['venue'][venue] += count
+        if event and matches(venue, event, day, 'event'):
+            facets['event'][event] += count
+        if day is not None and matches(venue, event, day, 'month'):
+            facets['month'][day.strftime('%Y-%m')] += count
+
+    def ranked(counts):
+        return [{'value': value, 'count': count}
+                for value, count in sorted(counts.items(), key=lambda item: (-item[1], item[0]))]
+
+    return {
+        'total': total,
+        'venues': ranked(facets['venue']),
+        'events': ranked(facets['event']),
+        'months': [{'value': value, 'count': count} for value, count in sorted(facets['month'].items(), reverse=True)]
+    }
+
+def get_attendance_facets(filters):
+    """Facets for a filter set, cached until the next upload or delete"""
+    key = (get_data_generation('attendance'), filters)
+    with _attendance_facet_lock:
+        if key in _attendance_facet_cache:
+            _attendance_facet_cache.move_to_end(key)
+            return _attendance_facet_cache[key]
+
+    facets = attendance_facets(filters)
+    with _attendance_facet_lock:
+        _attendance_facet_cache[key] = facets
+        while len(_attendance_facet_cache) > ATTENDANCE_FACET_CACHE_SIZE:
+            _attendance_facet_cache.popitem(last=False)
+    return facets
+
+def count_attendance(filters):
+    """Number of records matching a filter set, cached until the next upload or delete"""
+    key = (get_data_generation('attendance'), filters)
+    with _attendance_count_lock:
+        if key in _attendance_count_cache:
+            _attendance_count_cache.move_to_end(key)
+            return _attendance_count_cache[key]
+
+    total = apply_attendance_filters(
+        db.session.query(func.count(AttendanceRecord.id)), filters
+    ).scalar()
+    with _attendance_count_lock:
+        _attendance_count_cache[key] = total
+        while len(_attendance_count_cache) > ATTENDANCE_COUNT_CACHE_SIZE:
+            _attendance_count_cache.popitem(last=False)
+    return total
+
+def encode_cursor(value, row_id):
+    payload = orjson.dumps([value, row_id], default=_orjson_default)
+    return base64.urlsafe_b64encode(payload).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor, sort_field):
+    """Parse a cursor back into (sort value, id); raises ValueError if malformed"""
+    try:
+        value, row_id = orjson.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        if value is not None:
+            if sort_field == 'upload_date':
+                value = datetime.fromisoformat(value)
+            elif sort_field == 'date':
+                value = date.fromisoformat(value)
+            elif not isinstance(value, str):
+                raise ValueError
+        return value, int(row_id)
+    except (ValueError, TypeError, orjson.JSONDecodeError):
+        raise ValueError('Invalid cursor')
+
+def keyset_condition(column, value, row_id, descending, after=True):
+    """Rows strictly after (or before) (value, id) in an ordering with NULLs last"""
+    beyond = (lambda a, b: a < b) if descending == after else (lambda a, b: a > b)
+    id_beyond = beyond(AttendanceRecord.id, row_id)
+    if value is None:
+        if after:
+            return and_(column.is_(None), id_beyond)
+        return or_(column.isnot(None), and_(column.is_(None), id_beyond))
+    in_range = and_(column.isnot(None), or_(beyond(column, value), and_(column == value, id_beyond)))
+    return or_(in_range, column.is_(None)) if after else in_range
+
+def keyset_order(column, descending, backwards=False):
+    """ORDER BY for the NULLs-last ordering, or its exact reverse when paging backwards.
+
+    NULL placement is a leading IS NULL key rather than NULLS FIRST/LAST,
+    which MySQL does not support.
+    """
+    nulls = column.is_(None)
+    if backwards:
+        if descending:
+            return [nulls.desc(), column.asc(), AttendanceRecord.id.asc()]
+        return [nulls.desc(), column.desc(), AttendanceRecord.id.desc()]
+    if descending:
+        return [nulls.asc(), column.desc(), AttendanceRecord.id.desc()]
+    return [nulls.asc(), column.asc(), AttendanceRecord.id.asc()]
+
+# Bulk attendance ingest configuration
+BULK_MAX_FILES = 500
+BULK_MAX_UNCOMPRESSED = 1024 * 1024 * 1024
+BULK_INGEST_WORKERS = 4
+BULK_MANIFEST_NAME = 'manifest.csv'
+
+def make_staging_dir():
+    """A fresh staging directory on the same filesystem as the uploads"""
+    os.makedirs(STAGING_FOLDER, exist_ok=True)
+    return tempfile.mkdtemp(dir=STAGING_FOLDER)
+
+def read_manifest(text):
+    """Parse a filename,venue,date,event manifest into {archive name: row}"""
+    reader = csv.DictReader(io.StringIO(text.lstrip('\ufeff')))
+    columns = {c.strip().lower() for c in (reader.fieldnames or [])}
+    missing = {'filename', 'venue', 'date', 'event'} - columns
+    if missing:
+        raise ValueError(f"Manifest is missing columns: {', '.join(sorted(missing))}")
+
+    entries, errors = {}, []
+    for line, row in enumerate(reader, start=2):
+        # DictReader collects fields beyond the header into a list under None
+        if None in row:
+            errors.append(f"Manifest line {line}: too many columns")
+            continue
+        row = {k.strip().lower(): (v or '').strip() for k, v in row.items()}
+        if not row['filename']:
+            errors.append(f"Manifest line {line}: filename is required")
+        elif not row['venue']:
+            errors.append(f"Manifest line {line}: venue is required")
+        elif not parse_date(row['date']):
+            errors.append(f"Manifest line {line}: date must be YYYY-MM-DD")
+        elif row['filename'] in entries:
+            errors.append(f"Manifest line {line}: {row['filename']} is listed twice")
+        else:
+            entries[row['filename']] = {
+                'venue': row['venue'], 'date': parse_date(row['date']), 'event': row['event']
+            }
+    return entries, errors
+
+def extract_member(archive, info, staging):
+    """Stream one archive member to the staging directory, hashing it on the way"""
+    filename = secure_filename(os.path.basename(info.filename))
+    if not filename or not allowed_file(filename):
+        raise ValueError('file type not allowed')
+    limit = UPLOAD_SIZE_LIMITS[file_extension(filename)]
+    if info.file_size > limit:
+        raise ValueError(f"file exceeds the {format_size(limit)} limit")
+
+    digest = hashlib.sha256()
+    size = 0
+    staged_path = os.path.join(staging, hashlib.sha1(info.filename.encode('utf-8')).hexdigest())
+    with archive.open(info) as source, open(staged_path, 'wb') as target:
+        while True:
+            chunk = source.read(COPY_CHUNK_SIZE)
+            if not chunk:
+                break
+            if not size:
+                error = check_file_signature(filename, chunk)
+                if error:
+                    raise ValueError(error[0].lower() + error[1:])
+            size += len(chunk)
+            # Don't trust the header's size: stop as soon as the real data exceeds the limit
+            if size > limit:
+                raise ValueError(f"file exceeds the {format_size(limit)} limit")
+            digest.update(chunk)
+            target.write(chunk)
+    if size == 0:
+        raise ValueError('file is empty')
+    return {'filename': filename, 'staged_path': staged_path, 'sha256': digest.hexdigest(), 'size': size}
+
+def ingest_attendance_archive(archive_file, manifest_text=None):
+    """Extract, validate and record the files of an attendance ZIP.
+
+    Entries are extracted and hashed in a thread pool into a staging
+    directory; valid entries are inserted in one batch and only moved into
+    the upload folder once the transaction has committed.
+    """
+    staging = make_staging_dir()
+    try:
+        with zipfile.ZipFile(archive_file) as archive:
+            members = {info.filename: info for info in archive.infolist() if not info.is_dir()}
+            if manifest_text is None:
+                manifest_name = next((name for name in members
+                                      if os.path.basename(name).lower() == BULK_MANIFEST_NAME), None)
+                if manifest_name is None:
+                    raise ValueError(f"No manifest supplied and no {BULK_MANIFEST_NAME} in the archive")
+                manifest_text = archive.read(members.pop(manifest_name)).decode('utf-8-sig')
+
+            entries, errors = read_manifest(manifest_text)
+            if len(entries) > BULK_MAX_FILES:
+                raise ValueError(f"Manifest lists {len(entries)} files; the limit is {BULK_MAX_FILES}")
+            if sum(members[name].file_size for name in entries if name in members) > BULK_MAX_UNCOMPRESSED:
+                raise ValueError('Archive expands beyond the allowed size')
+
+            for name in sorted(set(entries) - set(members)):
+                errors.append(f"{name}: listed in the manifest but not in the archive")
+                del entries[name]
+            for name in sorted(set(members) - set(entries)):
+                errors.append(f"{name}: in the archive but not in the manifest")
+
+            with ThreadPoolExecutor(max_workers=BULK_INGEST_WORKERS) as pool:
+                futures = {name: pool.submit(extract_member, archive, members[name], staging) for name in entries}
+                extracted = {}
+                for name, future in futures.items():
+                    try:
+                        extracted[name] = future.result()
+                    except (ValueError, zipfile.BadZipFile, OSError) as e:
+                        errors.append(f"{name}: {str(e)}")
+
+        seen, records, moves = {}, [], []
+        for name, item in extracted.items():
+            if item['sha256'] in seen:
+                errors.append(f"{name}: duplicate of {seen[item['sha256']]}")
+                continue
+            seen[item['sha256']] = name
+            entry = entries[name]
+            filepath = unique_upload_path('', item['filename'])
+            records.append(AttendanceRecord(
+                filename=item['filename'],
+                filepath=filepath,
+                venue=entry['venue'],
+                date=entry['date'],
+                event=entry['event'],
+                page_count=0
+            ))
+            moves.append((item['staged_path'], filepath))
+
+        if records:
+            db.session.add_all(records)
+            db.session.flush()
+            publish_event('attendance.uploaded', record_ids=[r.id for r in records])
+            bump_data_generation('attendance')
+            db.session.commit()
+
+            for staged_path, filepath in moves:
+                try:
+                    os.replace(staged_path, filepath)
+                except OSError as e:
+                    app.logger.error(f"Could not move {staged_path} to {filepath}: {str(e)}")
+        return records, errors
+    except Exception:
+        db.session.rollback()
+        raise
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+
+# Deferred file deletion
+FILE_SWEEP_DELAY = timedelta(seconds=60)  # lets in-flight downloads of a deleted file finish
+FILE_SWEEP_BATCH = 200
+FILE_SWEEP_SECONDS = 30
+FILE_SWEEP_MAX_ATTEMPTS = 5
+BULK_DELETE_MAX = 1000
+FILE_REFERENCE_COLUMNS = (Document.file_path, Photo.file_path, AttendanceRecord.filepath)
+
+def tombstone_file(table_name, row_id, file_path):
+    """Queue a deleted row's file for the sweeper in the current transaction"""
+    if file_path:
+        db.session.add(FileTombstone(file_path=file_path, table_name=table_name, row_id=row_id))
+
+def delete_with_files(model, id_column, path_attr, ids):
+    """ORM-delete the rows with the given ids and tombstone their files.
+
+    Rows go through session.delete() so change_log records each one;
+    returns the ids that existed.
+    """
+    rows = model.query.filter(id_column.in_(ids)).all()
+    for row in rows:
+        tombstone_file(model.__tablename__, getattr(row, id_column.key), getattr(row, path_attr))
+        db.session.delete(row)
+    return [getattr(row, id_column.key) for row in rows]
+
+def live_file_paths(paths):
+    """The subset of paths still referenced by a document, photo or attendance row"""
+    live = set()
+    for column in FILE_REFERENCE_COLUMNS:
+        live.update(path for (path,) in db.session.query(column).filter(column.in_(paths)).distinct())
+    return live
+
+def sweep_file_tombstones(batch_size=FILE_SWEEP_BATCH, delay=FILE_SWEEP_DELAY):
+    """Unlink the files of one batch of due tombstones.
+
+    The batch is read and checked for live references first, and the
+    transaction is closed before touching the filesystem so a slow volume
+    never holds database locks. Returns counts per outcome.
+    """
+    stats = {'removed': 0, 'missing': 0, 'kept': 0, 'failed': 0}
+    tombstones = db.session.query(FileTombstone.id, FileTombstone.file_path).filter(
+        FileTombstone.created_at <= datetime.utcnow() - delay,
+        FileTombstone.attempts < FILE_SWEEP_MAX_ATTEMPTS
+    ).order_by(FileTombstone.id).limit(batch_size).all()
+    if not tombstones:
+        db.session.rollback()
+        return stats
+    live = live_file_paths({path for _, path in tombstones})
+    db.session.rollback()
+
+    done, failed = [], {}
+    for tombstone_id, path in tombstones:
+        if path in live:
+            # Another row still points at the file
+            stats['kept'] += 1
+        else:
+            try:
+                os.remove(path)
+                stats['removed'] += 1
+            except FileNotFoundError:
+                stats['missing'] += 1
+            except OSError as e:
+                failed[tombstone_id] = str(e)
+                stats['failed'] += 1
+                continue
+        done.append(tombstone_id)
+
+    if done:
+        FileTombstone.query.filter(FileTombstone.id.in_(done)).delete(synchronize_session=False)
+    for tombstone_id, error in failed.items():
+        FileTombstone.query.filter_by(id=tombstone_id).update(
+            {FileTombstone.attempts: FileTombstone.attempts + 1, FileTombstone.last_error: error},
+            synchronize_session=False
+        )
+    db.session.commit()
+    return stats
+
+def pending_tombstones():
+    return FileTombstone.query.filter(FileTombstone.attempts < FILE_SWEEP_MAX_ATTEMPTS).count()
+
+class FileSweeper:
+    """Per-worker background thread that drains file_tombstones.
+
+    Woken after a delete commits; it exits once no tombstone is left to
+    retry, so idle workers hold no thread. Several workers sweeping the
+    same batch is harmless: unlinks and tombstone deletes are idempotent.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.thread = None
+        self.woken = False
+
+    def wake(self):
+        with self.lock:
+            self.woken = True
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name='file-sweeper', daemon=True)
+                self.thread.start()
+
+    def _run(self):
+        with app.app_context():
+            while True:
+                with self.lock:
+                    self.woken = False
+                try:
+                    stats = sweep_file_tombstones()
+                    pending = pending_tombstones()
+                except Exception as e:
+                    app.logger.warning(f"File sweep failed: {str(e)}")
+                    db.session.rollback()
+                    stats, pending = None, 1
+                finally:
+                    db.session.remove()
+
+                with self.lock:
+                    # A wake() that raced with the count keeps the thread alive
+                    if not pending and not self.woken:
+                        self.thread = None
+                        return
+                if stats is None or sum(stats.values()) < FILE_SWEEP_BATCH:
+                    time.sleep(FILE_SWEEP_SECONDS)
+
+file_sweeper = FileSweeper()
+
+def bulk_delete_ids():
+    """Unique ids from a JSON {"ids": [...]} request body"""
+    ids = (request.get_json(silent=True) or {}).get('ids')
+    if not isinstance(ids, list) or not ids:
+        raise ValueError('ids must be a non-empty list')
+    if len(ids) > BULK_DELETE_MAX:
+        raise ValueError(f"At most {BULK_DELETE_MAX} ids can be deleted at once")
+    try:
+        return sorted({int(i) for i in ids})
+    except (TypeError, ValueError):
+        raise ValueError('ids must be integers')
+
+# Storage reconciliation
+QUARANTINE_FOLDER = os.path.join(UPLOAD_FOLDER, '.quarantine')
+RECONCILE_WORKERS = 8
+RECONCILE_MIN_AGE = timedelta(hours=1)  # uploads are saved shortly before their row commits
+RECONCILE_SOURCES = (
+    (Document.__tablename__, Document.document_id, Document.file_path),
+    (Photo.__tablename__, Photo.id, Photo.file_path),
+    (AttendanceRecord.__tablename__, AttendanceRecord.id, AttendanceRecord.filepath),
+)
+
+def scan_directory(directory, checkpoint_mtime_ns=None):
+    """List one directory and note whether it changed since its checkpoint.
+
+    Listing uses only scandir's directory entries, so it stays cheap for
+    unchanged directories; their files are still needed to confirm rows'
+    files exist. Hidden directories (staging, quarantine, archive) are not
+    descended into. The mtime is read before listing so a change during
+    the scan is caught on the next run.
+    """
+    mtime_ns = os.stat(directory).st_mtime_ns
+    files, subdirs = [], []
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                if not entry.name.startswith('.'):
+                    subdirs.append(entry.path)
+            elif entry.is_file(follow_symlinks=False):
+                files.append(entry.path)
+    return directory, mtime_ns, mtime_ns != checkpoint_mtime_ns, files, subdirs
+
+def scan_upload_tree(root, checkpoints, workers=RECONCILE_WORKERS):
+    """Walk the upload tree in parallel, one scandir per task.
+
+    Returns {directory: (mtime_ns, changed, files)}; changed is False for
+    directories whose mtime still matches their checkpoint.
+    """
+    scanned = {}
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='reconcile') as pool:
+        pending = {pool.submit(scan_directory, root, checkpoints.get(root))}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                directory, mtime_ns, changed, files, subdirs = future.result()
+                scanned[directory] = (mtime_ns, changed, files)
+                pending |= {pool.submit(scan_directory, d, checkpoints.get(d)) for d in subdirs}
+    return scanned
+
+def referenced_files():
+    """{absolute path: [(table, row id)]} for every document, photo and attendance row"""
+    references = defaultdict(list)
+    for table_name, id_column, path_column in RECONCILE_SOURCES:
+        rows = db.session.query(id_column, path_column)
+        if table_name == AttendanceRecord.__tablename__:
+            # Archived records are served from segments; their loose files are gone on purpose
+            rows = rows.outerjoin(ArchivedFile, ArchivedFile.record_id == AttendanceRecord.id).filter(
+                ArchivedFile.record_id.is_(None)
+            )
+        rows = rows.execution_options(yield_per=5000)
+        for row_id, path in rows:
+            if path:
+                references[os.path.abspath(path)].append((table_name, row_id))
+    return references
+
+def expired_checkpoints(checkpoints):
+    """Checkpointed directories that may hold new orphans despite an unchanged mtime.
+
+    Deleting a row leaves its directory's mtime alone until the file goes.
+    A directory expires when a row pointing into it was deleted after its
+    checkpoint, as recorded in change_log (the path comes from the row's
+    last insert or update there), or when a tombstone under it gave up.
+    Returns None when a deleted row's path is unknown, expiring them all.
+    """
+    if not checkpoints:
+        return set()
+    expired = {os.path.dirname(os.path.abspath(path)) for (path,) in db.session.query(
+        FileTombstone.file_path
+    ).filter(FileTombstone.attempts >= FILE_SWEEP_MAX_ATTEMPTS)}
+
+    oldest = min(checked_at for _, checked_at in checkpoints.values())
+    path_keys = {table_name: path_column.key for table_name, _, path_column in RECONCILE_SOURCES}
+    deletes = defaultdict(dict)
+    for table_name, row_id, changed_at in db.session.query(
+        ChangeLog.table_name, ChangeLog.row_id, ChangeLog.changed_at
+    ).filter(
+        ChangeLog.operation == 'delete',
+        ChangeLog.table_name.in_(list(path_keys)),
+        ChangeLog.changed_at > oldest
+    ):
+        deletes[table_name][row_id] = changed_at
+
+    for table_name, deleted in deletes.items():
+        paths = {}
+        for row_id, data in db.session.query(ChangeLog.row_id, ChangeLog.data).filter(
+            ChangeLog.table_name == table_name,
+            ChangeLog.row_id.in_(list(deleted)),
+            ChangeLog.operation != 'delete'
+        ).order_by(ChangeLog.id):
+            paths[row_id] = json.loads(data).get(path_keys[table_name])
+        for row_id, changed_at in deleted.items():
+            if not paths.get(row_id):
+                return None
+            directory = os.path.dirname(os.path.abspath(paths[row_id]))
+            checkpoint = checkpoints.get(directory)
+            if checkpoint is not None and checkpoint[1] < changed_at:
+                expired.add(directory)
+    return expired
+
+def quarantine_file(path):
+    """Move an orphaned upload under QUARANTINE_FOLDER, keeping its relative path"""
+    target = os.path.join(QUARANTINE_FOLDER, os.path.relpath(path, UPLOAD_FOLDER))
+    if os.path.exists(target):
+        root, ext = os.path.splitext(target)
+        target = f"{root}.{uuid.uuid4().hex[:8]}{ext}"
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    os.replace(path, target)
+    return target
+
+def reconcile_storage(full=False, quarantine=False):
+    """Compare the upload tree with the rows that reference it.
+
+    Orphans are files no row points at; dangling rows point at files that
+    do not exist. Every row is checked on every run. The orphan scan skips
+    directories unchanged since their checkpoint unless full is set or the
+    checkpoint expired, and a directory is only checkpointed once it has no
+    orphans left to report. Files whose tombstone is still pending are left
+    to the sweeper; once it gives up they are reported as orphans.
+    """
+    root = os.path.abspath(UPLOAD_FOLDER)
+    checkpoints = {} if full else {
+        directory: (mtime_ns, checked_at) for directory, mtime_ns, checked_at in db.session.query(
+            StorageCheckpoint.directory, StorageCheckpoint.mtime_ns, StorageCheckpoint.checked_at
+        )
+    }
+    expired = expired_checkpoints(checkpoints)
+    scanned = scan_upload_tree(root, {} if expired is None else {
+        directory: mtime_ns for directory, (mtime_ns, _) in checkpoints.items() if directory not in expired
+    })
+    references = referenced_files()
+    tombstoned = {os.path.abspath(path) for (path,) in db.session.query(
+        FileTombstone.file_path
+    ).filter(FileTombstone.attempts < FILE_SWEEP_MAX_ATTEMPTS)}
+    young = (datetime.utcnow() - RECONCILE_MIN_AGE).timestamp()
+
+    unresolved = set()
+    orphans, quarantined, failed, dangling = [], [], [], []
+    for directory, (_, changed, files) in scanned.items():
+        if not changed:
+            continue
+        for path in files:
+            if path in references or path in tombstoned:
+                continue
+            try:
+                if os.stat(path).st_mtime > young:
+                    unresolved.add(directory)
+                    continue
+            except OSError as e:
+                app.logger.warning(f"Could not check {path}: {str(e)}")
+            else:
+                if quarantine:
+                    try:
+                        quarantined.append((path, quarantine_file(path)))
+                    except OSError as e:
+                        app.logger.warning(f"Could not quarantine {path}: {str(e)}")
+                        failed.append((path, str(e)))
+                        unresolved.add(directory)
+                    continue
+            orphans.append(path)
+            unresolved.add(directory)
+
+    present = {path for _, _, files in scanned.values() for path in files}
+    for path, rows in references.items():
+        if path in present:
+            continue
+        # Files outside the scanned tree are checked individually
+        if os.path.dirname(path) not in scanned and os.path.exists(path):
+            continue
+        dangling.extend((table_name, row_id, path) for table_name, row_id in rows)
+
+    # Archived records dangle together when their segment goes missing
+    for (segment,) in db.session.query(ArchivedFile.segment).distinct():
+        path = os.path.join(ARCHIVE_FOLDER, segment)
+        if not os.path.exists(path):
+            dangling.extend((AttendanceRecord.__tablename__, record_id, path) for (record_id,) in
+                            db.session.query(ArchivedFile.record_id).filter_by(segment=segment))
+
+    db.session.query(StorageCheckpoint).filter(
+        StorageCheckpoint.directory.notin_(list(scanned))
+    ).delete(synchronize_session=False)
+    for directory, (mtime_ns, _, _) in scanned.items():
+        if directory in unresolved:
+            db.session.query(StorageCheckpoint).filter_by(directory=directory).delete(synchronize_session=False)
+        else:
+            db.session.merge(StorageCheckpoint(directory=directory, mtime_ns=mtime_ns, checked_at=datetime.utcnow()))
+    db.session.commit()
+
+    return {
+        'directories': len(scanned),
+        'rescanned': sum(1 for _, changed, _ in scanned.values() if changed),
+        'orphans': orphans,
+        'quarantined': quarantined,
+        'failed': failed,
+        'dangling': dangling,
+    }
+
+# Attendance archive
+ARCHIVE_FOLDER = os.path.join(UPLOAD_FOLDER, '.archive')
+ARCHIVE_AFTER_DAYS = int(os.environ.get('ATTENDANCE_ARCHIVE_AFTER_DAYS', 365))
+ARCHIVE_SEGMENT_MAX_BYTES = int(os.environ.get('ARCHIVE_SEGMENT_MAX_BYTES', 1024 * 1024 * 1024))
+ARCHIVE_BATCH = 1000
+ZIP_LOCAL_HEADER_SIZE = 30
+ARCHIVE_COMMIT_ATTEMPTS = 3
+
+def write_archive_segment(rows):
+    """Pack loose attendance files into a new uncompressed ZIP segment.
+
+    The segment is written under a temporary name, synced and renamed
+    before its offsets are committed, and loose files are only removed
+    after that commit. Segments are never modified once written. Records
+    deleted before the commit are left out of the index, retrying it if
+    one goes between the check and the commit. Returns (archived, missing)
+    counts.
+    """
+    name = f"attendance-{datetime.utcnow():%Y%m%d%H%M%S}-{uuid.uuid4().hex[:8]}.zip"
+    path = os.path.join(ARCHIVE_FOLDER, name)
+    partial = f"{path}.partial"
+    written, missing = [], 0
+    try:
+        with zipfile.ZipFile(partial, 'w', zipfile.ZIP_STORED, allowZip64=True) as archive:
+            for row in rows:
+                arcname = f"{row.id}/{row.filename}"
+                try:
+                    archive.write(row.filepath, arcname)
+                except OSError as e:
+                    app.logger.warning(f"Could not archive {row.filepath}: {str(e)}")
+                    missing += 1
+                    continue
+                written.append((row, archive.getinfo(arcname)))
+
+        index = {}
+        with open(partial, 'rb') as segment:
+            for row, info in written:
+                # Data starts after the local header and its variable-length name and extra fields
+                segment.seek(info.header_offset)
+                header = segment.read(ZIP_LOCAL_HEADER_SIZE)
+                name_length, extra_length = struct.unpack('<HH', header[26:30])
+                index[row.id] = dict(
+                    record_id=row.id,
+                    segment=name,
+                    data_offset=info.header_offset + ZIP_LOCAL_HEADER_SIZE + name_length + extra_length,
+                    size=info.file_size,
+                    crc32=info.CRC
+                )
+            os.fsync(segment.fileno())
+        os.replace(partial, path)
+
+        # Skip records deleted while the segment was being written
+        for attempt in range(1, ARCHIVE_COMMIT_ATTEMPTS + 1):
+            live = {record_id for (record_id,) in db.session.query(AttendanceRecord.id).filter(
+                AttendanceRecord.id.in_(list(index))
+            )}
+            db.session.add_all(ArchivedFile(**index[record_id]) for record_id in live)
+            try:
+                db.session.commit()
+                break
+            except IntegrityError:
+                # A record was deleted after the check; its foreign key fails the insert
+                db.session.rollback()
+                if attempt == ARCHIVE_COMMIT_ATTEMPTS:
+                    raise
+                app.logger.warning(f"Records deleted while indexing {name}, retrying")
+    except Exception:
+        db.session.rollback()
+        for leftover in (partial, path):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+        raise
+
+    for row, _ in written:
+        try:
+            os.remove(row.filepath)
+        except OSError as e:
+            app.logger.warning(f"Could not remove archived file {row.filepath}: {str(e)}")
+    return len(live), missing
+
+def archive_attendance_files(older_than_days=ARCHIVE_AFTER_DAYS):
+    """Move attendance files uploaded before the cutoff into archive segments"""
+    os.makedirs(ARCHIVE_FOLDER, exist_ok=True)
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    stats = {'archived': 0, 'missing': 0, 'segments': 0}
+    pending, pending_bytes, last_id = [], 0, 0
+
+    def flush():
+        archived, missing = write_archive_segment(pending)
+        stats['archived'] += archived
+        stats['missing'] += missing
+        stats['segments'] += 1
+
+    while True:
+        rows = db.session.query(
+            AttendanceRecord.id, AttendanceRecord.filename, AttendanceRecord.filepath
+        ).outerjoin(
+            ArchivedFile, ArchivedFile.record_id == AttendanceRecord.id
+        ).filter(
+            ArchivedFile.record_id.is_(None),
+            AttendanceRecord.upload_date < cutoff,
+            AttendanceRecord.id > last_id
+        ).order_by(AttendanceRecord.id).limit(ARCHIVE_BATCH).all()
+        db.session.rollback()
+        if not rows:
+            break
+        last_id = rows[-1].id
+        for row in rows:
+            try:
+                size = os.path.getsize(row.filepath)
+            except OSError:
+                stats['missing'] += 1
+                continue
+            if pending and pending_bytes + size > ARCHIVE_SEGMENT_MAX_BYTES:
+                flush()
+                pending, pending_bytes = [], 0
+            pending.append(row)
+            pending_bytes += size
+    if pending:
+        flush()
+    return stats
+
+class ArchivedFileReader(io.RawIOBase):
+    """Seekable window onto one archived file inside its segment.
+
+    Reads stop at the file's end, so send_file streams it in chunks and
+    can serve ranges. A read straight through from the start is checked
+    against the CRC stored at archive time and raises IOError on a
+    mismatch; partial reads rely on that CRC through the ETag.
+    """
+
+    def __init__(self, archived):
+        self.archived = archived
+        self.segment = open(os.path.join(ARCHIVE_FOLDER, archived.segment), 'rb')
+        if os.fstat(self.segment.fileno()).st_size < archived.data_offset + archived.size:
+            self.segment.close()
+            raise IOError(f"Archived file for record {archived.record_id} is truncated in {archived.segment}")
+        self.position = 0
+        self.crc = 0
+        self.checking = True
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.archived.size
+        position = max(0, min(offset, self.archived.size))
+        if position != self.position:
+            # Only a contiguous read from the start can be checked
+            self.checking = position == 0
+            self.crc = 0
+        self.position = position
+        return position
+
+    def readinto(self, buffer):
+        remaining = self.archived.size - self.position
+        if remaining <= 0:
+            return 0
+        view = memoryview(buffer)[:remaining]
+        self.segment.seek(self.archived.data_offset + self.position)
+        count = self.segment.readinto(view)
+        if not count:
+            raise IOError(f"Archived file for record {self.archived.record_id} is truncated in {self.archived.segment}")
+        self.position += count
+        if self.checking:
+            self.crc = zlib.crc32(view[:count], self.crc)
+            if self.position == self.archived.size and self.crc != self.archived.crc32:
+                raise IOError(f"Archived file for record {self.archived.record_id} is corrupt in {self.archived.segment}")
+        return count
+
+    def close(self):
+        self.segment.close()
+        super().close()
+
+def send_attendance_file(record, as_attachment=False):
+    """Serve an attendance file from the upload folder or its archive segment"""
+    archived = record.archive
+    if archived is None:
+        if not os.path.exists(record.filepath):
+            abort(404, description="File not found")
+        return send_from_directory(
+            directory=os.path.dirname(record.filepath),
+            path=os.path.basename(record.filepath),
+            as_attachment=as_attachment,
+            download_name=record.filename if as_attachment else None
+        )
+
+    try:
+        reader = ArchivedFileReader(archived)
+    except OSError as e:
+        app.logger.error(f"Error reading archived file: {str(e)}")
+        abort(404, description="File not found")
+    response = send_file(
+        reader,
+        mimetype=mimetypes.guess_type(record.filename)[0] or 'application/octet-stream',
+        as_attachment=as_attachment,
+        download_name=record.filename,
+        conditional=False,
+        etag=f"{archived.crc32:08x}-{archived.size}",
+        last_modified=archived.archived_at
+    )
+    # send_file cannot size an arbitrary reader, so ranges are enabled here
+    response.content_length = archived.size
+    return response.make_conditional(request, accept_ranges=True, complete_length=archived.size)
+
+# Map clustering configuration
+MAP_MAX_ZOOM = 18
+MAP_CLUSTER_RADIUS = 64  # cluster cell size in screen pixels
+MAP_TILE_SIZE = 256
+MAP_CLUSTER_CACHE_SIZE = 16
+
+_map_cluster_cache = {}
+_map_cluster_lock = threading.Lock()
+
+def lonlat_to_pixel(lon, lat, zoom):
+    """Project a WGS84 coordinate to Web Mercator world pixels at a zoom level"""
+    scale = MAP_TILE_SIZE * (2 ** zoom)
+    lat = max(min(lat, 85.05112878), -85.05112878)
+    x = (lon + 180.0) / 360.0 * scale
+    sin_lat = math.sin(math.radians(lat))
+    y = (0.5 - math.log((1 + sin_lat) / (1 - sin_lat)) / (4 * math.pi)) * scale
+    return x, y
+
+def scheme_map_points(statuses=None, scheme_types=None, bounds=None):
+    """Load mappable scheme points, applying status, type and bounding box filters"""
+    query = db.session.query(
+        IrrigationScheme.scheme_id,
+        IrrigationScheme.scheme_name,
+        IrrigationScheme.scheme_type,
+        IrrigationScheme.scheme_area,
+        IrrigationScheme.current_status,
+        Subcounty.subcounty_name,
+        SchemeLocation.latitude,
+        SchemeLocation.longitude
+    ).join(
+        Subcounty, IrrigationScheme.subcounty_id == Subcounty.subcounty_id
+    ).join(
+        SchemeLocation, IrrigationScheme.scheme_id == SchemeLocation.scheme_id
+    )
+
+    if scheme_types:
+        query = query.filter(IrrigationScheme.scheme_type.in_(scheme_types))
+    if bounds:
+        west, south, east, north = bounds
+        query = query.filter(
+            SchemeLocation.longitude >= west, SchemeLocation.longitude <= east,
+            SchemeLocation.latitude >= south, SchemeLocation.latitude <= north
+        )
+
+    points = []
+    for row in query.all():
+        normalized_status = normalize_status(row.current_status)
+        if statuses and normalized_status not in statuses:
+            continue
+        points.append({
+            'scheme_id': row.scheme_id,
+            'scheme_name': row.scheme_name,
+            'scheme_type': row.scheme_type,
+            'subcounty_name': row.subcounty_name,
+            'area_size': row.scheme_area,
+            'current_status': normalized_status,
+            'original_status': row.current_status or 'Unknown',
+            'latitude': float(row.latitude),
+            'longitude': float(row.longitude)
+        })
+    return points
+
+def cluster_points(points, zoom):
+    """Bucket points into MAP_CLUSTER_RADIUS pixel cells at a single zoom level"""
+    shift = MAP_MAX_ZOOM - zoom
+    level = {}
+    for point in points:
+        x, y = lonlat_to_pixel(point['longitude'], point['latitude'], MAP_MAX_ZOOM)
+        key = (int(x // MAP_CLUSTER_RADIUS) >> shift, int(y // MAP_CLUSTER_RADIUS) >> shift)
+        cluster = level.get(key)
+        if cluster is None:
+            cluster = level[key] = {
+                'count': 0, 'lat_sum': 0.0, 'lon_sum': 0.0,
+                'bbox': [point['longitude'], point['latitude'], point['longitude'], point['latitude']],
+                'statuses': defaultdict(int), 'point': point
+            }
+        _merge_cluster(cluster, 1, point['latitude'], point['longitude'],
+                       [point['longitude'], point['latitude'], point['longitude'], point['latitude']],
+                       {point['current_status']: 1})
+    return level
+
+def build_cluster_index(points):
+    """Build a grid cluster hierarchy for every zoom level.
+
+    Points are bucketed into MAP_CLUSTER_RADIUS pixel cells at MAP_MAX_ZOOM and
+    each lower zoom merges four child cells into their parent, so the whole
+    hierarchy is built in one pass per level.
+    """
+    level = cluster_points(points, MAP_MAX_ZOOM)
+
+    index = {MAP_MAX_ZOOM: level}
+    for zoom in range(MAP_MAX_ZOOM - 1, -1, -1):
+        parent_level = {}
+        for (cx, cy), child in level.items():
+            key = (cx >> 1, cy >> 1)
+            cluster = parent_level.get(key)
+            if cluster is None:
+                cluster = parent_level[key] = {
+                    'count': 0, 'lat_sum': 0.0, 'lon_sum': 0.0,
+                    'bbox': list(child['bbox']), 'statuses': defaultdict(int), 'point': child['point']
+                }
+            _merge_cluster(cluster, child['count'], child['lat_sum'], child['lon_sum'],
+                           child['bbox'], child['statuses'])
+        index[zoom] = parent_level
+        level = parent_level
+    return index
+
+def _merge_cluster(cluster, count, lat_sum, lon_sum, bbox, statuses):
+    cluster['count'] += count
+    cluster['lat_sum'] += lat_sum
+    cluster['lon_sum'] += lon_sum
+    cluster['bbox'] = [
+        min(cluster['bbox'][0], bbox[0]), min(cluster['bbox'][1], bbox[1]),
+        max(cluster['bbox'][2], bbox[2]), max(cluster['bbox'][3], bbox[3])
+    ]
+    for status, status_count in statuses.items():
+        cluster['statuses'][status] += status_count
+
+def get_cluster_index(statuses=None, scheme_types=None):
+    """Return the cached cluster hierarchy for a filter set, rebuilding after /submit"""
+    generation = get_data_generation('schemes')
+    key = (generation, tuple(sorted(statuses or ())), tuple(sorted(scheme_types or ())))
+
+    with _map_cluster_lock:
+        index = _map_cluster_cache.get(key)
+    if index is not None:
+        return index
+
+    index = build_cluster_index(scheme_map_points(statuses, scheme_types))
+    with _map_cluster_lock:
+        for stale_key in [k for k in _map_cluster_cache if k[0] != generation]:
+            del _map_cluster_cache[stale_key]
+        if len(_map_cluster_cache) >= MAP_CLUSTER_CACHE_SIZE:
+            _map_cluster_cache.pop(next(iter(_map_cluster_cache)))
+        _map_cluster_cache[key] = index
+    return index
+
+def cluster_to_feature(zoom, cell, cluster):
+    """Convert a cluster cell into a GeoJSON feature"""
+    if cluster['count'] == 1:
+        point = cluster['point']
+        properties = {k: v for k, v in point.items() if k not in ('latitude', 'longitude')}
+        properties['cluster'] = False
+        coordinates = [point['longitude'], point['latitude']]
+    else:
+        properties = {
+            'cluster': True,
+            'cluster_id': f"{zoom}/{cell[0]}/{cell[1]}",
+            'point_count': cluster['count'],
+            'statuses': dict(cluster['statuses']),
+            'bbox': [round(v, 6) for v in cluster['bbox']]
+        }
+        coordinates = [
+            round(cluster['lon_sum'] / cluster['count'], 6),
+            round(cluster['lat_sum'] / cluster['count'], 6)
+        ]
+    return {
+        'type': 'Feature',
+        'geometry': {'type': 'Point', 'coordinates': coordinates},
+        'properties': properties
+    }
+
+# Tile cache configuration
+TILE_CACHE_FOLDER = os.path.join(os.getcwd(), os.environ.get('TILE_CACHE_FOLDER', 'tile_cache'))
+BARINGO_BOUNDS = (35.55, 0.25, 36.45, 1.75)  # west, south, east, north
+
+def tile_bounds(z, x, y):
+    """Return the west, south, east, north bounds of a z/x/y map tile"""
+    n = 2 ** z
+    west = x / n * 360.0 - 180.0
+    east = (x + 1) / n * 360.0 - 180.0
+    north = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+    south = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * (y + 1) / n))))
+    return west, south, east, north
+
+def point_to_tile(lat, lon, z):
+    """Return the x/y of the tile containing a coordinate at zoom z"""
+    x, y = lonlat_to_pixel(lon, lat, z)
+    n = 2 ** z
+    return min(max(int(x // MAP_TILE_SIZE), 0), n - 1), min(max(int(y // MAP_TILE_SIZE), 0), n - 1)
+
+def tile_path(z, x, y):
+    return os.path.join(TILE_CACHE_FOLDER, str(z), str(x), f"{y}.json")
+
+def render_tile(z, x, y, points):
+    """Encode the clustered points of one tile as compact GeoJSON"""
+    features = [cluster_to_feature(z, cell, cluster)
+                for cell, cluster in cluster_points(points, z).items()]
+    return json.dumps({'type': 'FeatureCollection', 'features': features},
+                      separators=(',', ':'))
+
+def write_tile(z, x, y, body):
+    """Atomically write a tile into the on-disk cache"""
+    path = tile_path(z, x, y)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'w') as f:
+        f.write(body)
+    os.replace(tmp_path, path)
+    return path
+
+def invalidate_tiles_for_point(lat, lon):
+    """Remove the cached tiles containing a point at every zoom level"""
+    for z in range(MAP_MAX_ZOOM + 1):
+        x, y = point_to_tile(float(lat), float(lon), z)
+        try:
+            os.remove(tile_path(z, x, y))
+        except FileNotFoundError:
+            pass
+
+def parse_csv_arg(name):
+    """Split a comma separated query string argument into a list"""
+    value = request.args.get(name, '')
+    return [v.strip() for v in value.split(',') if v.strip()]
+
+# Boundaries configuration
+BOUNDARIES_FILE = os.path.join(os.getcwd(), os.environ.get('BOUNDARIES_FILE', 'data/boundaries.geojson'))
+BOUNDARY_BATCH_SIZE = 4096
+
+_boundary_index = None
+_boundary_lock = threading.Lock()
+
+class BoundaryIndex:
+    """Vectorised point-in-polygon lookup over subcounty/ward polygons.
+
+    Each GeoJSON feature should carry ``subcounty`` and optionally ``ward``
+    properties. Polygon and MultiPolygon rings are flattened into one edge
+    array per feature and tested with the even-odd rule, so holes and
+    multi-part wards need no special handling.
+    """
+
+    def __init__(self, features, mtime=None):
+        self.mtime = mtime
+        self.subcounties = []
+        self.wards = []
+        self.edges = []
+        bboxes = []
+
+        for feature in features:
+            geometry = feature.get('geometry') or {}
+            if geometry.get('type') == 'Polygon':
+                polygons = [geometry['coordinates']]
+            elif geometry.get('type') == 'MultiPolygon':
+                polygons = geometry['coordinates']
+            else:
+                continue
+
+            segments = []
+            for polygon in polygons:
+                for ring in polygon:
+                    ring = np.asarray(ring, dtype=float)[:, :2]
+                    segments.append(np.hstack([ring, np.roll(ring, -1, axis=0)]))
+            if not segments:
+                continue
+
+            edges = np.vstack(segments)
+            properties = feature.get('properties') or {}
+            self.subcounties.append(properties.get('subcounty') or properties.get('subcounty_name'))
+            self.wards.append(properties.get('ward') or properties.get('ward_name'))
+            self.edges.append(edges)
+            bboxes.append([edges[:, 0].min(), edges[:, 1].min(), edges[:, 0].max(), edges[:, 1].max()])
+
+        self.bboxes = np.asarray(bboxes, dtype=float).reshape(-1, 4)
+
+    @classmethod
+    def from_file(cls, path):
+        with open(path) as f:
+            data = json.load(f)
+        return cls(data.get('features', []), mtime=os.path.getmtime(path))
+
+    def locate(self, lats, lons):
+        """Return the index of the polygon containing each point, or -1"""
+        lats = np.asarray(lats, dtype=float)
+        lons = np.asarray(lons, dtype=float)
+        result = np.full(len(lats), -1, dtype=int)
+
+        for start in range(0, len(lats), BOUNDARY_BATCH_SIZE):
+            px = lons[start:start + BOUNDARY_BATCH_SIZE]
+            py = lats[start:start + BOUNDARY_BATCH_SIZE]
+            found = result[start:start + BOUNDARY_BATCH_SIZE]
+
+            # Bounding-box pre-filter: points x polygons candidate matrix
+            candidates = (
+                (px[:, None] >= self.bboxes[None, :, 0]) & (px[:, None] <= self.bboxes[None, :, 2]) &
+                (py[:, None] >= self.bboxes[None, :, 1]) & (py[:, None] <= self.bboxes[None, :, 3])
+            )
+
+            for polygon in np.flatnonzero(candidates.any(axis=0)):
+                rows = np.flatnonzero(candidates[:, polygon] & (found < 0))
+                if not len(rows):
+                    continue
+                x, y = px[rows, None], py[rows, None]
+                x1, y1, x2, y2 = self.edges[polygon].T
+                straddles = (y1 > y) != (y2 > y)
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    crossing_x = (x2 - x1) * (y - y1) / (y2 - y1) + x1
+                inside = np.count_nonzero(straddles & (x < crossing_x), axis=1) % 2 == 1
+                found[rows[inside]] = polygon
+        return result
+
+    def assign(self, lats, lons):
+        """Return (subcounty, ward) for each point, None where no polygon matches"""
+        return [
+            (self.subcounties[i], self.wards[i]) if i >= 0 else (None, None)
+            for i in self.locate(lats, lons)
+        ]
+
+def get_boundary_index():
+    """Return the boundary index, reloading it when the GeoJSON file changes"""
+    global _boundary_index
+    if not os.path.exists(BOUNDARIES_FILE):
+        return None
+    mtime = os.path.getmtime(BOUNDARIES_FILE)
+    with _boundary_lock:
+        if _boundary_index is None or _boundary_index.mtime != mtime:
+            _boundary_index = BoundaryIndex.from_file(BOUNDARIES_FILE)
+        return _boundary_index
+
+def normalize_area_name(name):
+    """Normalize a subcounty or ward name for comparison"""
+    if not name:
+        return ''
+    name = re.sub(r'[^a-z0-9 ]', ' ', name.lower())
+    name = re.sub(r'\b(sub ?county|ward)\b', ' ', name)
+    return ' '.join(name.split())
+
+def boundary_row(gps_id, entered_subcounty, subcounty_name, ward_name):
+    """Build a gps_boundaries row, flagging points outside the entered subcounty"""
+    return {
+        'gps_id': gps_id,
+        'subcounty_name': subcounty_name,
+        'ward_name': ward_name,
+        'subcounty_match': (normalize_area_name(subcounty_name) == normalize_area_name(entered_subcounty))
+        if subcounty_name else None,
+        'assigned_at': datetime.utcnow()
+    }
+
+# Analytics cube configuration
+CUBE_DIMENSIONS = [
+    'subcounty', 'scheme_type', 'current_status', 'infrastructure_status',
+    'registration_status', 'water_availability', 'application_type',
+    'main_crop', 'assessment_month'
+]
+CUBE_MEASURES = ['schemes', 'assessments', 'farmers_count', 'scheme_area', 'irrigable_area', 'cropped_area']
+
+def cube_contributions(scheme, subcounty_name, assessments):
+    """Cube cells and measures contributed by one scheme and its assessments.
+
+    Scheme-level measures (count and areas) are attributed to the month of
+    the scheme's first assessment so that summing over months never counts
+    a scheme twice.
+    """
+    base = (
+        subcounty_name, scheme.scheme_type, scheme.current_status, scheme.infrastructure_status,
+        scheme.registration_status, scheme.water_availability, scheme.application_type, scheme.main_crop
+    )
+    cells = defaultdict(lambda: dict.fromkeys(CUBE_MEASURES, 0))
+
+    assessments = sorted(assessments, key=lambda a: (a.assessment_date, a.assessment_id or 0))
+    first_month = assessments[0].assessment_date.strftime('%Y-%m') if assessments else None
+    scheme_cell = cells[base + (first_month,)]
+    scheme_cell['schemes'] += 1
+    scheme_cell['scheme_area'] += scheme.scheme_area or 0.0
+    scheme_cell['irrigable_area'] += scheme.irrigable_area or 0.0
+    scheme_cell['cropped_area'] += scheme.cropped_area or 0.0
+
+    for assessment in assessments:
+        cell = cells[base + (assessment.assessment_date.strftime('%Y-%m'),)]
+        cell['assessments'] += 1
+        cell['farmers_count'] += assessment.farmers_count or 0
+    return cells
+
+def cube_cell_key(dims):
+    return '\x1f'.join('' if d is None else str(d) for d in dims)
+
+CUBE_UPSERTS = {'postgresql': postgresql_insert, 'sqlite': sqlite_insert}
+
+def apply_cube_delta(cells, sign=1):
+    """Add (or with sign=-1 remove) cube contributions inside the current transaction.
+
+    Additions are a single upsert per cell so concurrent submissions that
+    create the same cell don't collide on cell_key.
+    """
+    upsert = CUBE_UPSERTS.get(db.engine.dialect.name)
+    for dims, measures in cells.items():
+        key = cube_cell_key(dims)
+        if sign > 0 and upsert is not None:
+            stmt = upsert(AnalyticsCubeCell).values(cell_key=key, **dict(zip(CUBE_DIMENSIONS, dims)), **measures)
+            db.session.execute(stmt.on_conflict_do_update(
+                index_elements=['cell_key'],
+                set_={m: getattr(AnalyticsCubeCell, m) + stmt.excluded[m] for m in measures}
+            ))
+            continue
+
+        updated = AnalyticsCubeCell.query.filter_by(cell_key=key).update(
+            {getattr(AnalyticsCubeCell, m): getattr(AnalyticsCubeCell, m) + sign * v for m, v in measures.items()},
+            synchronize_session=False
+        )
+        if updated:
+            continue
+        if sign > 0:
+            db.session.add(AnalyticsCubeCell(cell_key=key, **dict(zip(CUBE_DIMENSIONS, dims)), **measures))
+            db.session.flush()
+        else:
+            app.logger.warning(f"Analytics cube cell {key!r} was missing while removing a contribution; "
+                               f"run 'flask rebuild-analytics-cube'")
+    if sign < 0:
+        AnalyticsCubeCell.query.filter(
+            AnalyticsCubeCell.schemes <= 0, AnalyticsCubeCell.assessments <= 0
+        ).delete(synchronize_session=False)
+
+def rebuild_analytics_cube():
+    """Recompute the whole analytics cube from schemes and assessments"""
+    cells = defaultdict(lambda: dict.fromkeys(CUBE_MEASURES, 0))
+    schemes = IrrigationScheme.query.options(
+        db.joinedload(IrrigationScheme.subcounty),
+        db.selectinload(IrrigationScheme.assessments)
+    ).all()
+    for scheme in schemes:
+        subcounty_name = scheme.subcounty.subcounty_name if scheme.subcounty else None
+        for dims, measures in cube_contributions(scheme, subcounty_name, scheme.assessments).items():
+            for measure, value in measures.items():
+                cells[dims][measure] += value
+
+    db.session.execute(db.delete(AnalyticsCubeCell))
+    if cells:
+        db.session.execute(db.insert(AnalyticsCubeCell), [
+            dict(cell_key=cube_cell_key(dims), **dict(zip(CUBE_DIMENSIONS, dims)), **measures)
+            for dims, measures in cells.items()
+        ])
+    db.session.commit()
+    return len(cells)
+
+def parse_cube_filter(value):
+    """Parse 'dim:value,dim:value' into a dict of cube dimension filters"""
+    filters = defaultdict(list)
+    for part in (value or '').split(','):
+        if ':' not in part:
+            continue
+        dim, val = part.split(':', 1)
+        dim = dim.strip()
+        if dim not in CUBE_DIMENSIONS:
+            raise ValueError(f"Unknown dimension: {dim}")
+        filters[dim].append(val.strip())
+    return filters
+
+# Route planning configuration
+EARTH_RADIUS_KM = 6371.0088
+MAX_ROUTE_STOPS = 500
+ROUTE_OPTIMIZE_SECONDS = 0.5
+
+def haversine_matrix(lats, lons):
+    """Pairwise great-circle distances in km between all points"""
+    lat = np.radians(np.asarray(lats, dtype=float))
+    lon = np.radians(np.asarray(lons, dtype=float))
+    dlat = lat[:, None] - lat[None, :]
+    dlon = lon[:, None] - lon[None, :]
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat)[:, None] * np.cos(lat)[None, :] * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+def plan_route(dist, return_to_start=False):
+    """Order stops 1..n of a distance matrix starting from node 0.
+
+    A nearest-neighbour tour is improved with 2-opt moves. The route end is
+    modelled as an extra node (a copy of the start for round trips, a
+    zero-distance sink for open routes) so both ends stay fixed while the
+    interior is reversed. Each move evaluates every candidate segment end
+    for a given start in one vectorised step.
+    """
+    n = len(dist)
+    if n <= 2:
+        return list(range(1, n))
+
+    end_row = dist[0] if return_to_start else np.zeros(n)
+    d = np.zeros((n + 1, n + 1))
+    d[:n, :n] = dist
+    d[n, :n] = end_row
+    d[:n, n] = end_row
+
+    # Nearest neighbour construction
+    path = [0]
+    unvisited = np.ones(n + 1, dtype=bool)
+    unvisited[[0, n]] = False
+    for _ in range(n - 1):
+        row = np.where(unvisited, d[path[-1]], np.inf)
+        nxt = int(np.argmin(row))
+        path.append(nxt)
+        unvisited[nxt] = False
+    path.append(n)
+    path = np.array(path)
+
+    # 2-opt improvement over the interior of the path
+    deadline = datetime.now() + timedelta(seconds=ROUTE_OPTIMIZE_SECONDS)
+    improved = True
+    while improved and datetime.now() < deadline:
+        improved = False
+        for i in range(1, len(path) - 2):
+            a, b = path[i - 1], path[i]
+            js = np.arange(i + 1, len(path) - 1)
+            c, e = path[js], path[js + 1]
+            delta = d[a, c] + d[b, e] - d[a, b] - d[c, e]
+            best = int(np.argmin(delta))
+            if delta[best] < -1e-9:
+                j = js[best]
+                path[i:j + 1] = path[i:j + 1][::-1]
+                improved = True
+    return [int(p) for p in path[1:-1]]
+
+def parse_route_point(value):
+    """Parse a start point given as a GPS string or a latitude/longitude object"""
+    if isinstance(value, dict):
+        return float(value['latitude']), float(value['longitude'])
+    if isinstance(value, (list, tuple)) and len(value) == 2:
+        return float(value[0]), float(value[1])
+    return parse_gps_coordinates(value)
+
+ROUTE_FILTER_FIELDS = {
+    'current_status': str, 'scheme_type': str, 'subcounty': str,
+    'subcounty_id': int, 'no_assessment_months': int
+}
+
+def parse_route_filters(raw):
+    """Validate the route planner's filter object; raises ValueError with a client message"""
+    if raw is None:
+        return {}
+    if not isinstance(raw, dict):
+        raise ValueError('filter must be an object')
+    filters = {}
+    for field, value in raw.items():
+        kind = ROUTE_FILTER_FIELDS.get(field)
+        if kind is None:
+            raise ValueError(f"Unknown filter: {field}")
+        if value in (None, ''):
+            continue
+        if kind is int:
+            if isinstance(value, bool) or not re.fullmatch(r'\d+', str(value).strip()):
+                raise ValueError(f"{field} must be a non-negative integer")
+            value = int(value)
+        elif not isinstance(value, str):
+            raise ValueError(f"{field} must be a string")
+        filters[field] = value
+    return filters
+
+def parse_route_scheme_ids(raw):
+    """Validate the optional scheme_ids list; raises ValueError with a client message"""
+    if raw is None:
+        return []
+    if not isinstance(raw, list):
+        raise ValueError('scheme_ids must be a list')
+    if any(isinstance(i, bool) or not re.fullmatch(r'\d+', str(i).strip()) for i in raw):
+        raise ValueError('scheme_ids must be integers')
+    return [int(i) for i in raw]
+
+def route_candidate_query(filters):
+    """Schemes with a known location matching the route planner filters"""
+    query = db.session.query(
+        IrrigationScheme.scheme_id,
+        IrrigationScheme.scheme_name,
+        IrrigationScheme.current_status,
+        Subcounty.subcounty_name,
+        SchemeLocation.latitude,
+        SchemeLocation.longitude
+    ).join(
+        Subcounty, IrrigationScheme.subcounty_id == Subcounty.subcounty_id
+    ).join(
+        SchemeLocation, IrrigationScheme.scheme_id == SchemeLocation.scheme_id
+    )
+
+    if filters.get('current_status'):
+        query = query.filter(IrrigationScheme.current_status == filters['current_status'])
+    if filters.get('scheme_type'):
+        query = query.filter(IrrigationScheme.scheme_type == filters['scheme_type'])
+    if filters.get('subcounty_id'):
+        query = query.filter(IrrigationScheme.subcounty_id == filters['subcounty_id'])
+    if filters.get('subcounty'):
+        query = query.filter(Subcounty.subcounty_name == filters['subcounty'])
+    if filters.get('no_assessment_months'):
+        cutoff = date.today() - timedelta(days=filters['no_assessment_months'] * 30)
+        recent = db.session.query(Assessment.scheme_id).filter(Assessment.assessment_date >= cutoff)
+        query = query.filter(IrrigationScheme.scheme_id.notin_(recent))
+    return query
+
+# Scheme matching configuration
+SCHEME_MATCH_RADIUS_KM = float(os.environ.get('SCHEME_MATCH_RADIUS_KM', 2.0))
+SCHEME_NAME_STOPWORDS = {'irrigation', 'scheme', 'project', 'the'}
+SCHEME_VISIT_FIELDS = (
+    'registration_status', 'current_status', 'infrastructure_status', 'water_source',
+    'water_availability', 'intake_works_type', 'conveyance_works_type', 'application_type',
+    'main_crop', 'scheme_area', 'irrigable_area', 'cropped_area', 'implementing_agency'
+)
+
+def normalize_scheme_name(name):
+    """Lower-case a scheme name and drop punctuation and generic words"""
+    words = re.sub(r'[^a-z0-9]+', ' ', (name or '').lower()).split()
+    return ' '.join(w for w in words if w not in SCHEME_NAME_STOPWORDS) or ' '.join(words)
+
+def haversine_km(lat, lon, lats, lons):
+    """Great-circle distances in km from one point to many"""
+    lat1, lon1 = math.radians(lat), math.radians(lon)
+    lat2 = np.radians(np.asarray(lats, dtype=float))
+    lon2 = np.radians(np.asarray(lons, dtype=float))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+def add_scheme_match_key(scheme):
+    db.session.add(SchemeMatchKey(
+        scheme_id=scheme.scheme_id,
+        match_name=normalize_scheme_name(scheme.scheme_name),
+        subcounty_id=scheme.subcounty_id
+    ))
+
+def backfill_scheme_match_keys():
+    """Add match keys for schemes that have none"""
+    rows = db.session.query(
+        IrrigationScheme.scheme_id, IrrigationScheme.scheme_name, IrrigationScheme.subcounty_id
+    ).outerjoin(
+        SchemeMatchKey, SchemeMatchKey.scheme_id == IrrigationScheme.scheme_id
+    ).filter(SchemeMatchKey.scheme_id.is_(None)).all()
+    if rows:
+        db.session.execute(db.insert(SchemeMatchKey), [{
+            'scheme_id': scheme_id,
+            'match_name': normalize_scheme_name(scheme_name),
+            'subcounty_id': subcounty_id
+        } for scheme_id, scheme_name, subcounty_id in rows])
+    db.session.commit()
+    return len(rows)
+
+def find_matching_scheme(scheme_name, subcounty_id, lat, lon):
+    """Existing scheme a submission refers to, or None.
+
+    Candidates share the normalised name and subcounty. When any candidate
+    has a recorded position, the nearest one within SCHEME_MATCH_RADIUS_KM
+    wins and a submission farther than that from all of them is a new
+    scheme. Only when no candidate has a position does the newest one match.
+    """
+    candidates = db.session.query(
+        SchemeMatchKey.scheme_id, SchemeLocation.latitude, SchemeLocation.longitude
+    ).outerjoin(
+        SchemeLocation, SchemeLocation.scheme_id == SchemeMatchKey.scheme_id
+    ).filter(
+        SchemeMatchKey.match_name == normalize_scheme_name(scheme_name),
+        SchemeMatchKey.subcounty_id == subcounty_id
+    ).all()
 
-def parse_date(date_str):
-    """Parse date from string in YYYY-MM-DD format"""
-    try:
-        return datetime.strptime(date_str, '%Y-%m-%d').date()
-    except (ValueError, TypeError):
+    located = [c for c in candidates if c.latitude is not None]
+    if located:
+        distances = haversine_km(lat, lon, [c.latitude for c in located], [c.longitude for c in located])
+        nearest = int(np.argmin(distances))
+        if distances[nearest] <= SCHEME_MATCH_RADIUS_KM:
+            return db.session.get(IrrigationScheme, located[nearest].scheme_id)
         return None
 
-def parse_gps_coordinates(gps_str):
-    """Parse GPS coordinates from string to decimal degrees"""
-    try:
-        if not gps_str:
-            raise ValueError("Empty GPS coordinates")
-            
-        cleaned = gps_str.replace('°', '').strip()
-        parts = re.split(r'[,\s]+', cleaned)
-        parts = [p for p in parts if p]
-        
-        if len(parts) == 2:
-            try:
-                return float(parts[0]), float(parts[1])
-            except ValueError:
-                pass
-        
-        if len(parts) == 4:
-            try:
-                lat = float(parts[0]) * (1 if parts[1].upper() in ['N', ''] else -1)
-                lon = float(parts[2]) * (1 if parts[3].upper() in ['E', ''] else -1)
-                return lat, lon
-            except ValueError:
-                pass
-                
-        raise ValueError("Could not parse GPS coordinates. Use format: '0.6341° N, 35.7364° E' or '-0.6341, 35.7364'")
-    except Exception as e:
-        raise ValueError(f"GPS parsing error: {str(e)}")
+    return db.session.get(IrrigationScheme, max(c.scheme_id for c in candidates)) if candidates else None
 
-def save_uploaded_file(file, subfolder):
-    """Save uploaded file to the specified subfolder"""
-    if file and file.filename:
-        if not allowed_file(file.filename):
-            raise ValueError(f"File type not allowed: {file.filename}")
-            
-        os.makedirs(os.path.join(app.config['UPLOAD_FOLDER'], subfolder), exist_ok=True)
-        filename = secure_filename(file.filename)
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], subfolder, filename)
-        file.save(filepath)
-        return filename, filepath
-    return None, None
+def duplicate_scheme_groups():
+    """Map each surviving scheme id to the ids of the duplicates it absorbs.
 
-def validate_file(file):
-    """Validate file before upload"""
-    if not allowed_file(file.filename):
-        return False, "Only PDF files are allowed"
-    if file.content_length > MAX_CONTENT_LENGTH:
-        return False, "File size exceeds 10MB limit"
-    return True, ""
+    Within a name and subcounty, schemes are taken oldest first; each joins
+    the first earlier survivor within SCHEME_MATCH_RADIUS_KM, or any earlier
+    survivor when either has no recorded position.
+    """
+    rows = db.session.query(
+        SchemeMatchKey.match_name, SchemeMatchKey.subcounty_id, SchemeMatchKey.scheme_id,
+        SchemeLocation.latitude, SchemeLocation.longitude
+    ).outerjoin(
+        SchemeLocation, SchemeLocation.scheme_id == SchemeMatchKey.scheme_id
+    ).order_by(
+        SchemeMatchKey.match_name, SchemeMatchKey.subcounty_id, SchemeMatchKey.scheme_id
+    ).all()
 
-def format_date_key(d, time_period):
-    """Format date based on time period"""
-    if time_period == 'monthly':
-        return d.strftime('%b %Y')
-    elif time_period == 'weekly':
-        year, week, _ = d.isocalendar()
-        return f'W{week:02d} {year}'
-    elif time_period == 'yearly':
-        return d.strftime('%Y')
-    else:  # daily
-        return d.strftime('%Y-%m-%d')
+    groups = {}
+    for _, members in groupby(rows, key=lambda r: (r.match_name, r.subcounty_id)):
+        survivors = []
+        for member in members:
+            target = None
+            for survivor in survivors:
+                if member.latitude is None or survivor.latitude is None or haversine_km(
+                        float(member.latitude), float(member.longitude),
+                        [survivor.latitude], [survivor.longitude])[0] <= SCHEME_MATCH_RADIUS_KM:
+                    target = survivor
+                    break
+            if target is None:
+                survivors.append(member)
+            else:
+                groups.setdefault(target.scheme_id, []).append(member.scheme_id)
+    return groups
 
-def increment_date(d, time_period):
-    """Increment date based on time period"""
-    if time_period == 'monthly':
-        # Get first day of next month
-        if d.month == 12:
-            return date(d.year + 1, 1, 1)
-        return date(d.year, d.month + 1, 1)
-    elif time_period == 'weekly':
-        return d + timedelta(days=7)
-    elif time_period == 'yearly':
-        return date(d.year + 1, 1, 1)
-    else:  # daily
-        return d + timedelta(days=1)
+def merge_schemes(survivor_id, duplicate_ids):
+    """Move every visit of the duplicates onto the survivor and delete them"""
+    survivor = db.session.get(IrrigationScheme, survivor_id)
+    duplicates = IrrigationScheme.query.filter(IrrigationScheme.scheme_id.in_(duplicate_ids)).all()
 
-def process_trend_data(results, time_period, start_date=None, end_date=None):
-    """Process data for trend chart"""
-    date_counts = defaultdict(int)
-    
-    for record in results:
-        date_key = format_date_key(record.date, time_period)
-        date_counts[date_key] += record.count
-    
-    # Fill in missing dates if range is provided
-    if start_date and end_date:
-        current_date = start_date
-        while current_date <= end_date:
-            date_key = format_date_key(current_date, time_period)
-            if date_key not in date_counts:
-                date_counts[date_key] = 0
-            current_date = increment_date(current_date, time_period)
-    
-    # Sort by date
-    sorted_dates = sorted(date_counts.items(), key=lambda x: x[0])
-    
-    return {
-        'labels': [x[0] for x in sorted_dates],
-        'values': [x[1] for x in sorted_dates]
-    }
+    # The most recently assessed member describes the scheme as it is now
+    latest = max([survivor] + duplicates, key=lambda scheme: (
+        max((a.assessment_date for a in scheme.assessments), default=date.min), scheme.scheme_id
+    ))
+    if latest is not survivor:
+        for field in SCHEME_VISIT_FIELDS:
+            setattr(survivor, field, getattr(latest, field))
 
-def process_venue_data(results):
-    """Process data for venue comparison chart"""
-    return {
-        'labels': [x[0] for x in results if x[0]],
-        'values': [x[1] for x in results if x[0]]
-    }
+    for duplicate in duplicates:
+        for child in list(duplicate.assessments) + list(duplicate.documents) + \
+                list(duplicate.photos) + list(duplicate.gps_data):
+            child.scheme = survivor
 
-def process_event_data(results):
-    """Process data for event distribution chart"""
-    return {
-        'labels': [x[0] if x[0] else 'No Event' for x in results],
-        'values': [x[1] for x in results]
-    }
+    # Locations are rebuilt from the merged GPS tracks afterwards
+    SchemeLocation.query.filter(SchemeLocation.scheme_id.in_(duplicate_ids)).delete(synchronize_session=False)
+    SchemeStatusHistory.query.filter(SchemeStatusHistory.scheme_id.in_(duplicate_ids)).update(
+        {SchemeStatusHistory.scheme_id: survivor_id}, synchronize_session=False
+    )
+    SchemeMatchKey.query.filter(SchemeMatchKey.scheme_id.in_(duplicate_ids)).delete(synchronize_session=False)
+    db.session.flush()
+    for duplicate in duplicates:
+        db.session.delete(duplicate)
+    db.session.flush()
 
 # Authentication Routes
 @app.route('/')
@@ -337,6 +3082,7 @@ def upload_files():
         return jsonify({'success': False, 'message': 'Valid date is required'}), 400
     
     uploaded_files = []
+    uploaded_records = []
     errors = []
     
     for file in files:
@@ -347,10 +3093,8 @@ def upload_files():
             
         try:
             filename = secure_filename(file.filename)
-            # Add timestamp to filename to avoid collisions
-            timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-            unique_filename = f"{timestamp}_{filename}"
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
+            # A timestamp alone collides when the same name is uploaded twice in a second
+            filepath = unique_upload_path('', filename)
             
             # Save file
             file.save(filepath)
@@ -366,12 +3110,16 @@ def upload_files():
             )
             db.session.add(record)
             uploaded_files.append(filename)
+            uploaded_records.append(record)
         except Exception as e:
             errors.append(f"Error processing {file.filename}: {str(e)}")
     
     if errors and not uploaded_files:
         return jsonify({'success': False, 'message': 'All files failed to upload', 'errors': errors}), 400
     
+    db.session.flush()
+    publish_event('attendance.uploaded', record_ids=[r.id for r in uploaded_records], venue=venue, event=event)
+    bump_data_generation('attendance')
     db.session.commit()
     
     response = {
@@ -386,6 +3134,39 @@ def upload_files():
     
     return jsonify(response)
 
+@app.route('/api/attendance/bulk', methods=['POST'])
+def bulk_ingest_attendance():
+    """Import a ZIP of attendance sheets described by a CSV manifest"""
+    archive = request.files.get('archive')
+    if not archive or not archive.filename:
+        return jsonify({'success': False, 'message': 'No archive selected'}), 400
+    if not archive.filename.lower().endswith('.zip'):
+        return jsonify({'success': False, 'message': 'Archive must be a ZIP file'}), 400
+
+    manifest = request.files.get('manifest')
+    manifest_text = manifest.read().decode('utf-8-sig') if manifest and manifest.filename else None
+
+    try:
+        records, errors = ingest_attendance_archive(archive.stream, manifest_text)
+    except (ValueError, zipfile.BadZipFile, UnicodeDecodeError) as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except Exception as e:
+        app.logger.error(f"Bulk attendance ingest failed: {str(e)}")
+        return jsonify({'success': False, 'message': 'Bulk import failed'}), 500
+
+    if not records:
+        return jsonify({'success': False, 'message': 'No files were imported', 'errors': errors}), 400
+
+    response = {
+        'success': True,
+        'message': f'Successfully imported {len(records)} files',
+        'files': [r.filename for r in records]
+    }
+    if errors:
+        response['errors'] = errors
+        response['message'] += f', with {len(errors)} errors'
+    return jsonify(response)
+
 @app.route('/api/venues')
 def get_venues():
     venues = db.session.query(AttendanceRecord.venue).distinct().filter(
@@ -402,67 +3183,80 @@ def get_events():
 
 @app.route('/api/attendance')
 def get_attendance():
-    # Pagination parameters
-    page = request.args.get('page', 1, type=int)
-    per_page = request.args.get('per_page', 25, type=int)
-    
-    # Filter parameters
-    date_filter = request.args.get('date')
-    venue_filter = request.args.get('venue')
-    event_filter = request.args.get('event')
-    
-    # Sorting parameters
+    """Attendance records one page at a time, by cursor or page number.
+
+    Sequential browsing passes the next_cursor/prev_cursor of the previous
+    response (with direction=prev for the latter), which seeks through the
+    (sort key, id) index instead of counting past OFFSET rows.
+    """
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = min(max(request.args.get('per_page', 25, type=int), 1), ATTENDANCE_MAX_PER_PAGE)
+    cursor = request.args.get('cursor')
+    backwards = request.args.get('direction') == 'prev'
+
     sort_field = request.args.get('sort_field', 'upload_date')
-    sort_order = request.args.get('sort_order', 'desc')
-    
-    query = AttendanceRecord.query
-    
-    # Apply filters
-    if date_filter:
-        query = query.filter(AttendanceRecord.date == date_filter)
-    if venue_filter:
-        query = query.filter(AttendanceRecord.venue == venue_filter)
-    if event_filter:
-        query = query.filter(AttendanceRecord.event == event_filter)
-    
-    # Apply sorting
-    if sort_field and sort_order:
-        sort_column = getattr(AttendanceRecord, sort_field, None)
-        if sort_column is not None:
-            if sort_order == 'asc':
-                query = query.order_by(sort_column.asc())
-            else:
-                query = query.order_by(sort_column.desc())
-    
-    # Get paginated results
-    pagination = query.paginate(
-        page=page, 
-        per_page=per_page,
-        error_out=False
-    )
-    
-    records = pagination.items
-    
-    result = []
-    for record in records:
-        result.append({
-            'id': record.id,
-            'filename': record.filename,
-            'venue': record.venue,
-            'date': record.date.strftime('%Y-%m-%d') if record.date else None,
-            'event': record.event,
-            'upload_date': record.upload_date.isoformat(),
-            'page_count': record.page_count
-        })
-    
+    if sort_field not in ATTENDANCE_SORT_KEYS:
+        sort_field = 'upload_date'
+    descending = request.args.get('sort_order', 'desc') != 'asc'
+    sort_column = ATTENDANCE_SORT_KEYS[sort_field]
+
+    filters = attendance_filters(request.args)
+    total = count_attendance(filters)
+
+    # A common search term is found faster by walking the sort index and
+    # testing each row than by materialising every full-text hit first
+    query = apply_attendance_filters(AttendanceRecord.query.with_entities(
+        AttendanceRecord.id,
+        AttendanceRecord.filename,
+        AttendanceRecord.venue,
+        AttendanceRecord.date,
+        AttendanceRecord.event,
+        AttendanceRecord.upload_date,
+        AttendanceRecord.page_count
+    ), filters, use_fts=total <= ATTENDANCE_FTS_SCAN_THRESHOLD)
+
+    if cursor:
+        try:
+            value, row_id = decode_cursor(cursor, sort_field)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        query = query.filter(keyset_condition(sort_column, value, row_id, descending, after=not backwards))
+        query = query.order_by(*keyset_order(sort_column, descending, backwards))
+    else:
+        backwards = False
+        query = query.order_by(*keyset_order(sort_column, descending)).offset((page - 1) * per_page)
+
+    rows = query.limit(per_page + 1).all()
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if backwards:
+        rows.reverse()
+    columns, records = row_table(query, rows)
+    has_next = has_more if not backwards else True
+    has_prev = has_more if backwards else bool(cursor) or page > 1
+
     return jsonify({
-        'records': result,
-        'total_records': pagination.total,
-        'total_pages': pagination.pages,
-        'current_page': pagination.page
+        'columns': columns,
+        'records': records,
+        'next_cursor': encode_cursor(getattr(rows[-1], sort_field), rows[-1].id) if rows and has_next else None,
+        'prev_cursor': encode_cursor(getattr(rows[0], sort_field), rows[0].id) if rows and has_prev else None,
+        'total_records': total,
+        'total_pages': math.ceil(total / per_page),
+        'current_page': page
     })
 
+@app.route('/api/attendance/facets')
+def api_attendance_facets():
+    """Venue, event and month filter options with record counts"""
+    try:
+        facets = get_attendance_facets(attendance_filters(request.args))
+        return jsonify({'success': True, **facets})
+    except Exception as e:
+        app.logger.error(f"Error fetching attendance facets: {str(e)}")
+        return jsonify({'error': 'Failed to fetch attendance facets'}), 500
+
 @app.route('/api/attendance/stats')
+@read_replica
 def get_attendance_stats():
     venue_filter = request.args.get('venue')
     event_filter = request.args.get('event')
@@ -573,39 +3367,25 @@ def get_attendance_stats():
 @app.route('/download/<int:record_id>')
 def download_file(record_id):
     record = AttendanceRecord.query.get_or_404(record_id)
-    if not os.path.exists(record.filepath):
-        abort(404, description="File not found")
-    
-    return send_from_directory(
-        directory=os.path.dirname(record.filepath),
-        path=os.path.basename(record.filepath),
-        as_attachment=True,
-        download_name=record.filename
-    )
+    return send_attendance_file(record, as_attachment=True)
 
 @app.route('/preview/<int:record_id>')
 def preview_file(record_id):
     record = AttendanceRecord.query.get_or_404(record_id)
-    if not os.path.exists(record.filepath):
-        abort(404, description="File not found")
-    
-    return send_from_directory(
-        directory=os.path.dirname(record.filepath),
-        path=os.path.basename(record.filepath)
-    )
+    return send_attendance_file(record)
 
 @app.route('/api/attendance/<int:record_id>', methods=['DELETE'])
 def delete_record(record_id):
     record = AttendanceRecord.query.get_or_404(record_id)
     
     try:
-        # Delete file from filesystem
-        if os.path.exists(record.filepath):
-            os.remove(record.filepath)
-        
-        # Delete record from database
+        # The file is removed by the sweeper once the delete has committed
+        tombstone_file(AttendanceRecord.__tablename__, record.id, record.filepath)
         db.session.delete(record)
+        publish_event('attendance.deleted', record_ids=[record_id])
+        bump_data_generation('attendance')
         db.session.commit()
+        file_sweeper.wake()
         
         return jsonify({
             'success': True,
@@ -618,22 +3398,37 @@ def delete_record(record_id):
             'message': f'Error deleting record: {str(e)}'
         }), 500
 
+@app.route('/api/attendance/bulk', methods=['DELETE'])
+def bulk_delete_attendance():
+    """Delete many attendance records in one transaction"""
+    try:
+        ids = bulk_delete_ids()
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+
+    try:
+        deleted = delete_with_files(AttendanceRecord, AttendanceRecord.id, 'filepath', ids)
+        if deleted:
+            publish_event('attendance.deleted', record_ids=deleted)
+            bump_data_generation('attendance')
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error(f"Error bulk deleting attendance records: {str(e)}")
+        return jsonify({'success': False, 'message': f'Error deleting records: {str(e)}'}), 500
+
+    file_sweeper.wake()
+    return jsonify({
+        'success': True,
+        'message': f'Deleted {len(deleted)} records',
+        'deleted': deleted,
+        'not_found': sorted(set(ids) - set(deleted))
+    })
+
 @app.route('/api/attendance/export/csv')
+@read_replica
 def export_csv():
-    # Get filter parameters
-    date_filter = request.args.get('date')
-    venue_filter = request.args.get('venue')
-    event_filter = request.args.get('event')
-    
-    query = AttendanceRecord.query
-    
-    # Apply filters
-    if date_filter:
-        query = query.filter(AttendanceRecord.date == date_filter)
-    if venue_filter:
-        query = query.filter(AttendanceRecord.venue == venue_filter)
-    if event_filter:
-        query = query.filter(AttendanceRecord.event == event_filter)
+    query = apply_attendance_filters(AttendanceRecord.query, attendance_filters(request.args))
     
     records = query.order_by(AttendanceRecord.date.desc()).all()
     
@@ -667,6 +3462,7 @@ def export_pdf():
 @app.route('/submit', methods=['POST'])
 @role_required('agent')
 def submit():
+    staging = None
     try:
         # Validate required fields
         required_fields = {
@@ -686,6 +3482,31 @@ def submit():
             flash(f"Missing required fields: {', '.join(missing_fields)}", 'error')
             return redirect(url_for('index'))
 
+        # Stage uploads in parallel before any database work, so the
+        # transaction below is held only while rows are written
+        doc_types = {
+            'officeBearersPdf': 'office_bearers',
+            'schemeMembersPdf': 'members_list',
+            'bylawsPdf': 'bylaws',
+            'schemeMapPdf': 'scheme_map',
+            'intakeDesignsPdf': 'intake_designs',
+            'feasibilityReport': 'feasibility_report',
+            'esiaReport': 'esia_report',
+            'wraLicensing': 'wra_licensing'
+        }
+        uploads = [(doc_type, request.files.get(field)) for field, doc_type in doc_types.items()]
+        uploads = [(doc_type, file) for doc_type, file in uploads if file and file.filename]
+        uploads += [(None, photo) for photo in request.files.getlist('photos') if photo and photo.filename]
+
+        for doc_type, file in uploads:
+            if not allowed_file(file.filename):
+                label = f"Error with {doc_type.replace('_', ' ')}" if doc_type else "Error with photo upload"
+                flash(f"{label}: File type not allowed: {file.filename}", 'error')
+                return redirect(url_for('index'))
+
+        staging = make_staging_dir()
+        staged_paths = stage_uploads([file for _, file in uploads], staging)
+
         # Process form data
         subcounty_name = request.form.get('subcounty')
         subcounty = Subcounty.query.filter_by(subcounty_name=subcounty_name).first()
@@ -696,7 +3517,7 @@ def submit():
 
         scheme_name_with_type = request.form.get('scheme')
         scheme_name = scheme_name_with_type
-        scheme_type = 'Community'
+        scheme_type = None
 
         if '(' in scheme_name_with_type and ')' in scheme_name_with_type:
             try:
@@ -705,11 +3526,15 @@ def submit():
             except:
                 pass
 
-        # Create new scheme
-        scheme = IrrigationScheme(
-            scheme_name=scheme_name,
-            subcounty_id=subcounty.subcounty_id,
-            scheme_type=scheme_type,
+        # Parse GPS coordinates
+        try:
+            lat, lon = parse_gps_coordinates(request.form.get('gpsCoordinates'))
+        except ValueError as e:
+            db.session.rollback()
+            flash(f"Error processing GPS coordinates: {str(e)}", 'error')
+            return redirect(url_for('index'))
+
+        scheme_fields = dict(
             registration_status=request.form.get('registrationStatus'),
             current_status=request.form.get('currentStatus'),
             infrastructure_status=request.form.get('infrastructureStatus'),
@@ -724,22 +3549,44 @@ def submit():
             cropped_area=float(request.form.get('croppedArea', 0)) if request.form.get('croppedArea') else None,
             implementing_agency=request.form.get('implementingAgency')
         )
-        db.session.add(scheme)
-        db.session.flush()
 
-        # Save GPS data
-        try:
-            lat, lon = parse_gps_coordinates(request.form.get('gpsCoordinates'))
-            gps = GPSData(
-                scheme_id=scheme.scheme_id,
-                latitude=lat,
-                longitude=lon
+        # Attach repeat visits to the existing scheme instead of creating a new one
+        scheme = find_matching_scheme(scheme_name, subcounty.subcounty_id, lat, lon)
+        previous_location = None
+        if scheme is None:
+            scheme = IrrigationScheme(
+                scheme_name=scheme_name,
+                subcounty_id=subcounty.subcounty_id,
+                scheme_type=scheme_type or 'Community',
+                **scheme_fields
             )
-            db.session.add(gps)
-        except ValueError as e:
-            db.session.rollback()
-            flash(f"Error processing GPS coordinates: {str(e)}", 'error')
-            return redirect(url_for('index'))
+            db.session.add(scheme)
+            db.session.flush()
+            add_scheme_match_key(scheme)
+            prior_assessments = []
+        else:
+            # Swap the scheme's cube contribution for the updated one below
+            prior_assessments = list(scheme.assessments)
+            apply_cube_delta(cube_contributions(scheme, subcounty.subcounty_name, prior_assessments), sign=-1)
+            if scheme.location is not None:
+                previous_location = (scheme.location.latitude, scheme.location.longitude)
+            if scheme_type:
+                scheme.scheme_type = scheme_type
+            for field, value in scheme_fields.items():
+                if value:
+                    setattr(scheme, field, value)
+
+        gps = record_gps_point(scheme.scheme_id, lat, lon)
+
+        # Check the point against the subcounty/ward boundaries
+        boundaries = get_boundary_index()
+        if boundaries is not None:
+            (located_subcounty, located_ward), = boundaries.assign([lat], [lon])
+            boundary = boundary_row(gps.id, subcounty_name, located_subcounty, located_ward)
+            db.session.add(GPSBoundary(**boundary))
+            if boundary['subcounty_match'] is False:
+                flash(f"GPS coordinates fall in {located_subcounty}, not {subcounty_name}. "
+                      f"The submission was saved and flagged for review.", 'warning')
 
         # Save assessment
         assessment = Assessment(
@@ -753,68 +3600,236 @@ def submit():
         )
         db.session.add(assessment)
         db.session.flush()
+        record_status_history(scheme, assessment)
 
-        # Save documents
-        doc_types = {
-            'officeBearersPdf': 'office_bearers',
-            'schemeMembersPdf': 'members_list',
-            'bylawsPdf': 'bylaws',
-            'schemeMapPdf': 'scheme_map',
-            'intakeDesignsPdf': 'intake_designs',
-            'feasibilityReport': 'feasibility_report',
-            'esiaReport': 'esia_report',
-            'wraLicensing': 'wra_licensing'
-        }
-
-        for field, doc_type in doc_types.items():
-            file = request.files.get(field)
-            if file and file.filename:
-                try:
-                    filename, filepath = save_uploaded_file(file, 'documents')
-                    if filename:
-                        doc = Document(
-                            scheme_id=scheme.scheme_id,
-                            assessment_id=assessment.assessment_id,
-                            document_type=doc_type,
-                            file_name=filename,
-                            file_path=filepath
-                        )
-                        db.session.add(doc)
-                except ValueError as e:
-                    db.session.rollback()
-                    flash(f"Error with {doc_type.replace('_', ' ')}: {str(e)}", 'error')
-                    return redirect(url_for('index'))
-
-        # Save photos
-        photos = request.files.getlist('photos')
-        for photo in photos:
-            if photo and photo.filename:
-                try:
-                    filename, filepath = save_uploaded_file(photo, 'photos')
-                    if filename:
-                        photo_record = Photo(
-                            scheme_id=scheme.scheme_id,
-                            assessment_id=assessment.assessment_id,
-                            filename=filename,
-                            file_path=filepath
-                        )
-                        db.session.add(photo_record)
-                except ValueError as e:
-                    db.session.rollback()
-                    flash(f"Error with photo upload: {str(e)}", 'error')
-                    return redirect(url_for('index'))
+        # Record documents and photos at their final paths; the files move there after commit
+        moves = []
+        for (doc_type, file), staged_path in zip(uploads, staged_paths):
+            filename = secure_filename(file.filename)
+            if doc_type:
+                filepath = unique_upload_path('documents', filename)
+                db.session.add(Document(
+                    scheme_id=scheme.scheme_id,
+                    assessment_id=assessment.assessment_id,
+                    document_type=doc_type,
+                    file_name=filename,
+                    file_path=filepath
+                ))
+            else:
+                filepath = unique_upload_path('photos', filename)
+                db.session.add(Photo(
+                    scheme_id=scheme.scheme_id,
+                    assessment_id=assessment.assessment_id,
+                    filename=filename,
+                    file_path=filepath
+                ))
+            moves.append((staged_path, filepath))
 
+        apply_cube_delta(cube_contributions(scheme, subcounty.subcounty_name, prior_assessments + [assessment]))
+        bump_data_generation('schemes')
+        publish_event('assessment.created', assessment_id=assessment.assessment_id, scheme_id=scheme.scheme_id,
+                      scheme_name=scheme.scheme_name, subcounty=subcounty.subcounty_name)
         db.session.commit()
+        promote_staged_files(moves)
+        invalidate_tiles_for_point(lat, lon)
+        if previous_location is not None:
+            invalidate_tiles_for_point(*previous_location)
         flash('✅ Data submitted successfully!', 'success')
         return redirect(url_for('index'))
 
-    except Exception as e:
-        db.session.rollback()
-        flash(f"An unexpected error occurred: {str(e)}", 'error')
-        return redirect(url_for('index'))
+    except UploadRejected as e:
+        db.session.rollback()
+        flash(f"Error with upload: {e.description}", 'error')
+        return redirect(url_for('index'))
+    except RequestEntityTooLarge:
+        db.session.rollback()
+        flash(f"Error with upload: the submission exceeds the {format_size(MAX_CONTENT_LENGTH)} limit", 'error')
+        return redirect(url_for('index'))
+    except Exception as e:
+        db.session.rollback()
+        flash(f"An unexpected error occurred: {str(e)}", 'error')
+        return redirect(url_for('index'))
+    finally:
+        # Anything still staged belongs to a submission that did not commit
+        if staging is not None:
+            shutil.rmtree(staging, ignore_errors=True)
+
+# Change Feed Route
+def change_feed_horizon(after_id=0):
+    """Highest change_log id up to which every change is known to be committed.
+
+    Ids are allocated when a row is inserted, not when its transaction
+    commits, so on Postgres a missing id below a recently written one may
+    belong to a transaction that is still open. The horizon stops just
+    before such a gap; gaps whose next row is older than CHANGE_FEED_SETTLE
+    are treated as rolled back.
+    """
+    oldest, latest = db.session.query(func.min(ChangeLog.id), func.max(ChangeLog.id)).one()
+    if latest is None:
+        return after_id
+    floor = max(after_id, oldest - 1)
+    recent = [row_id for (row_id,) in db.session.query(ChangeLog.id).filter(
+        ChangeLog.id > floor,
+        ChangeLog.changed_at >= datetime.utcnow() - CHANGE_FEED_SETTLE
+    ).order_by(ChangeLog.id)]
+    if not recent:
+        return max(after_id, latest)
+
+    present = set(recent) | {row_id for (row_id,) in db.session.query(ChangeLog.id).filter(
+        ChangeLog.id.in_([row_id - 1 for row_id in recent])
+    )}
+    for row_id in recent:
+        if row_id - 1 > floor and row_id - 1 not in present:
+            below = db.session.query(func.max(ChangeLog.id)).filter(ChangeLog.id < row_id).scalar()
+            return max(after_id, below or 0)
+    return max(after_id, latest)
+
+@app.route('/api/changes')
+def api_changes():
+    """Compact row deltas since a cursor so clients can patch local state.
+
+    Cursors only advance to the change_feed_horizon, so every committed
+    change is delivered exactly once and in id order as long as no
+    transaction stays open longer than CHANGE_FEED_SETTLE. Changes written
+    after a still-open transaction wait until it commits or settles.
+    """
+    try:
+        since = request.args.get('since', type=int)
+        tables = parse_csv_arg('tables')
+        limit = min(max(request.args.get('limit', CHANGE_FEED_LIMIT, type=int), 1), CHANGE_FEED_LIMIT)
+
+        if since is None:
+            return jsonify({'cursor': change_feed_horizon(), 'changes': [], 'has_more': False})
+
+        # Tell clients to reload when their cursor predates pruned history
+        oldest = db.session.query(func.min(ChangeLog.id)).scalar()
+        if oldest is not None and since < oldest - 1:
+            return jsonify({'cursor': change_feed_horizon(), 'changes': [], 'has_more': False, 'reset': True})
+
+        horizon = change_feed_horizon(since)
+        query = ChangeLog.query.filter(ChangeLog.id > since, ChangeLog.id <= horizon)
+        if tables:
+            query = query.filter(ChangeLog.table_name.in_(tables))
+        entries = query.order_by(ChangeLog.id).limit(limit + 1).all()
+        has_more = len(entries) > limit
+        entries = entries[:limit]
+
+        # Collapse repeated changes to the same row into one delta
+        compacted = {}
+        for entry in entries:
+            key = (entry.table_name, entry.row_id)
+            previous = compacted.get(key)
+            operation = entry.operation
+            if previous and previous['op'] == 'insert':
+                if operation == 'delete':
+                    del compacted[key]
+                    continue
+                operation = 'insert'
+            compacted.pop(key, None)
+            compacted[key] = {
+                'table': entry.table_name,
+                'id': entry.row_id,
+                'op': operation,
+                'data': json.loads(entry.data) if entry.data else None
+            }
+
+        cursor = entries[-1].id if has_more else horizon
+        return jsonify({
+            'cursor': cursor,
+            'changes': list(compacted.values()),
+            'has_more': has_more
+        })
+    except Exception as e:
+        app.logger.error(f"Error fetching changes: {str(e)}")
+        return jsonify({'error': 'Failed to fetch changes'}), 500
+
+@app.cli.command('prune-change-log')
+@click.option('--days', default=30, show_default=True, help='Keep changes newer than this many days')
+def prune_change_log(days):
+    """Delete change feed entries older than the retention window"""
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    deleted = ChangeLog.query.filter(ChangeLog.changed_at < cutoff).delete(synchronize_session=False)
+    db.session.commit()
+    click.echo(f"Deleted {deleted} change log entries")
+
+@app.route('/api/events/stream')
+def event_stream():
+    """Server-Sent Events stream of submissions, uploads and deletions"""
+    last_event_id = request.headers.get('Last-Event-ID', type=int) or request.args.get('last_event_id', type=int)
+
+    # Subscribe before replaying so nothing falls between the two
+    subscriber = event_broker.subscribe()
+    if subscriber is None:
+        response = jsonify({'error': 'Too many live streams, please retry shortly'})
+        response.status_code = 503
+        response.headers['Retry-After'] = str(SSE_RETRY_AFTER_SECONDS)
+        return response
+    try:
+        missed = []
+        if last_event_id:
+            # Ids below Last-Event-ID can still commit within the settle window,
+            # so replay that window too; clients ignore ids they already have
+            missed = [_event_dict(e) for e in LiveEvent.query.filter(or_(
+                LiveEvent.id > last_event_id,
+                LiveEvent.created_at >= datetime.utcnow() - timedelta(seconds=SSE_GAP_SETTLE_SECONDS)
+            )).order_by(LiveEvent.id).limit(SSE_QUEUE_SIZE).all()]
+    except Exception:
+        event_broker.unsubscribe(subscriber)
+        raise
+
+    def format_event(event):
+        return f"id: {event['id']}\nevent: {event['type']}\ndata: {event['data']}\n\n"
+
+    def generate():
+        # The broker may deliver an id below one already sent, so skip only
+        # ids this stream has actually sent
+        sent = OrderedDict()
+
+        def unsent(event):
+            if event['id'] in sent:
+                return False
+            sent[event['id']] = None
+            if len(sent) > SSE_SENT_IDS:
+                sent.popitem(last=False)
+            return True
+
+        try:
+            yield f"retry: {int(SSE_POLL_SECONDS * 5000)}\n\n"
+            for event in missed:
+                if unsent(event):
+                    yield format_event(event)
+
+            # Streams end periodically; EventSource reconnects with Last-Event-ID
+            deadline = time.monotonic() + SSE_STREAM_SECONDS
+            while time.monotonic() < deadline:
+                try:
+                    event = subscriber.get(timeout=SSE_HEARTBEAT_SECONDS)
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+                    continue
+                if unsent(event):
+                    yield format_event(event)
+        finally:
+            event_broker.unsubscribe(subscriber)
+
+    return app.response_class(
+        generate(),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+# Admission Stats Route
+@app.route('/api/admission/stats')
+def api_admission_stats():
+    """Per-class concurrency and queue depth for this worker"""
+    return jsonify({
+        'pid': os.getpid(),
+        'classes': {name: gate.stats() for name, gate in admission_gates.items()}
+    })
 
 # Dashboard Route
 @app.route('/dashboard')
+@read_replica
 def dashboard():
     try:
         # Basic statistics
@@ -869,41 +3884,22 @@ def dashboard():
         entries = db.session.query(
             IrrigationScheme, 
             Subcounty.subcounty_name,
-            GPSData.latitude,
-            GPSData.longitude
+            SchemeLocation.latitude,
+            SchemeLocation.longitude
         ).join(
             Subcounty, IrrigationScheme.subcounty_id == Subcounty.subcounty_id
         ).outerjoin(
-            GPSData, IrrigationScheme.scheme_id == GPSData.scheme_id
+            SchemeLocation, IrrigationScheme.scheme_id == SchemeLocation.scheme_id
         ).all()
         
-        # Status normalization mapping
-        def normalize_status(status):
-            if not status:
-                return 'unknown'
-            status = status.lower().strip()
-            if 'active' in status:
-                return 'active'
-            elif 'dormant' in status:
-                return 'dormant'
-            elif 'construct' in status or 'ongoing' in status:
-                return 'under-construction'
-            elif 'proposed' in status or 'planned' in status:
-                return 'proposed'
-            return 'unknown'
-
         # Format entries for template
         formatted_entries = []
-        scheme_coordinates = []
         
         for scheme, subcounty_name, lat, lon in entries:
             # Get document status
             scheme_docs = Document.query.filter_by(scheme_id=scheme.scheme_id).all()
             doc_types = [doc.document_type for doc in scheme_docs]
             
-            # Normalize status for map filtering
-            normalized_status = normalize_status(scheme.current_status)
-            
             entry = {
                 'id': scheme.scheme_id,
                 'scheme_name': scheme.scheme_name or 'N/A',
@@ -916,23 +3912,11 @@ def dashboard():
                 'feasibility_study': 'Yes' if 'feasibility_report' in doc_types else 'No',
                 'wra_license': 'Yes' if 'wra_licensing' in doc_types else 'No',
                 'main_crop': scheme.main_crop or 'N/A',
-                'water_source': scheme.water_source or 'N/A'
+                'water_source': scheme.water_source or 'N/A',
+                'latitude': float(lat) if lat is not None else None,
+                'longitude': float(lon) if lon is not None else None
             }
             formatted_entries.append(entry)
-            
-            # Prepare coordinates data for map
-            if lat is not None and lon is not None:
-                scheme_coordinates.append({
-                    'scheme_id': scheme.scheme_id,
-                    'scheme_name': scheme.scheme_name,
-                    'latitude': float(lat),
-                    'longitude': float(lon),
-                    'scheme_type': scheme.scheme_type,
-                    'subcounty_name': subcounty_name,
-                    'area_size': scheme.scheme_area,
-                    'current_status': normalized_status,  # Normalized status for filtering
-                    'original_status': scheme.current_status or 'Unknown'  # Original for display
-                })
         
         return render_template('dashboard.html',
             total_schemes=total_schemes,
@@ -948,7 +3932,6 @@ def dashboard():
             cbo=cbo,
             shg=shg,
             entries=formatted_entries,
-            scheme_coordinates=scheme_coordinates,
             status_colors={
                 'active': '#16a34a',
                 'dormant': '#dc2626',
@@ -962,30 +3945,569 @@ def dashboard():
         app.logger.error(f"Dashboard error: {str(e)}", exc_info=True)
         return render_template('error.html', message="Could not load dashboard data"), 500
 
+# Map API Route
+@app.route('/api/map/schemes')
+def api_map_schemes():
+    """GeoJSON of scheme points clustered server-side for a viewport and zoom"""
+    try:
+        zoom = max(0, min(request.args.get('zoom', 9, type=int), MAP_MAX_ZOOM))
+        bbox = request.args.get('bbox')
+        if bbox:
+            try:
+                west, south, east, north = [float(v) for v in bbox.split(',')]
+            except ValueError:
+                return jsonify({'error': 'bbox must be west,south,east,north'}), 400
+        else:
+            west, south, east, north = -180.0, -85.0, 180.0, 85.0
+
+        statuses = [s for s in parse_csv_arg('status') if s != 'all']
+        scheme_types = parse_csv_arg('type')
+        clusters = get_cluster_index(statuses, scheme_types)[zoom]
+
+        # Convert the viewport to a range of cluster cells at this zoom
+        shift = MAP_MAX_ZOOM - zoom
+        x0, y0 = lonlat_to_pixel(west, north, MAP_MAX_ZOOM)
+        x1, y1 = lonlat_to_pixel(east, south, MAP_MAX_ZOOM)
+        cx0, cy0 = int(x0 // MAP_CLUSTER_RADIUS) >> shift, int(y0 // MAP_CLUSTER_RADIUS) >> shift
+        cx1, cy1 = int(x1 // MAP_CLUSTER_RADIUS) >> shift, int(y1 // MAP_CLUSTER_RADIUS) >> shift
+
+        features = [
+            cluster_to_feature(zoom, cell, cluster)
+            for cell, cluster in clusters.items()
+            if cx0 <= cell[0] <= cx1 and cy0 <= cell[1] <= cy1
+        ]
+
+        return jsonify({
+            'type': 'FeatureCollection',
+            'zoom': zoom,
+            'total_points': sum(c['count'] for c in clusters.values()),
+            'features': features
+        })
+    except Exception as e:
+        app.logger.error(f"Error building scheme map: {str(e)}")
+        return jsonify({'error': 'Failed to load scheme map'}), 500
+
+@app.route('/api/map/tiles/<int:z>/<int:x>/<int:y>.json')
+def api_map_tile(z, x, y):
+    """Serve a clustered scheme tile, generating it into the tile cache on a miss"""
+    if z > MAP_MAX_ZOOM or x >= 2 ** z or y >= 2 ** z:
+        abort(404)
+
+    path = tile_path(z, x, y)
+    if not os.path.exists(path):
+        try:
+            west, south, east, north = tile_bounds(z, x, y)
+            points = [
+                p for p in scheme_map_points(bounds=(west, south, east, north))
+                if point_to_tile(p['latitude'], p['longitude'], z) == (x, y)
+            ]
+            write_tile(z, x, y, render_tile(z, x, y, points))
+        except Exception as e:
+            app.logger.error(f"Error generating tile {z}/{x}/{y}: {str(e)}")
+            return jsonify({'error': 'Failed to generate tile'}), 500
+
+    return send_from_directory(
+        os.path.dirname(path),
+        os.path.basename(path),
+        mimetype='application/geo+json',
+        max_age=60
+    )
+
+@app.cli.command('seed-tiles')
+@click.option('--min-zoom', default=6, show_default=True)
+@click.option('--max-zoom', default=14, show_default=True)
+@click.option('--bounds', default=','.join(str(v) for v in BARINGO_BOUNDS), show_default=True,
+              help='west,south,east,north')
+def seed_tiles(min_zoom, max_zoom, bounds):
+    """Pre-generate scheme map tiles over Baringo"""
+    west, south, east, north = [float(v) for v in bounds.split(',')]
+    points = scheme_map_points(bounds=(west, south, east, north))
+
+    total = 0
+    for z in range(min_zoom, max_zoom + 1):
+        x0, y0 = point_to_tile(north, west, z)
+        x1, y1 = point_to_tile(south, east, z)
+
+        tile_points = defaultdict(list)
+        for point in points:
+            tile_points[point_to_tile(point['latitude'], point['longitude'], z)].append(point)
+
+        for x in range(x0, x1 + 1):
+            for y in range(y0, y1 + 1):
+                write_tile(z, x, y, render_tile(z, x, y, tile_points.get((x, y), [])))
+                total += 1
+        click.echo(f"Zoom {z}: {(x1 - x0 + 1) * (y1 - y0 + 1)} tiles")
+
+    click.echo(f"Seeded {total} tiles for {len(points)} schemes")
+
+@app.cli.command('assign-boundaries')
+@click.option('--all', 'reassign', is_flag=True, help='Reassign points that already have a boundary')
+def assign_boundaries(reassign):
+    """Assign every GPS point to its subcounty and ward in bulk"""
+    boundaries = get_boundary_index()
+    if boundaries is None:
+        click.echo(f"Boundaries file not found: {BOUNDARIES_FILE}")
+        return
+
+    if reassign:
+        db.session.execute(db.delete(GPSBoundary))
+
+    rows = db.session.query(
+        GPSData.id, GPSData.latitude, GPSData.longitude, Subcounty.subcounty_name
+    ).join(
+        IrrigationScheme, GPSData.scheme_id == IrrigationScheme.scheme_id
+    ).join(
+        Subcounty, IrrigationScheme.subcounty_id == Subcounty.subcounty_id
+    ).outerjoin(
+        GPSBoundary, GPSData.id == GPSBoundary.gps_id
+    ).filter(
+        GPSBoundary.gps_id.is_(None)
+    ).all()
+
+    if not rows:
+        db.session.commit()
+        click.echo("No GPS points to assign")
+        return
+
+    assigned = boundaries.assign([float(r.latitude) for r in rows], [float(r.longitude) for r in rows])
+    mappings = [
+        boundary_row(row.id, row.subcounty_name, subcounty_name, ward_name)
+        for row, (subcounty_name, ward_name) in zip(rows, assigned)
+    ]
+    db.session.execute(db.insert(GPSBoundary), mappings)
+    db.session.commit()
+
+    mismatches = sum(1 for m in mappings if m['subcounty_match'] is False)
+    outside = sum(1 for m in mappings if m['subcounty_name'] is None)
+    click.echo(f"Assigned {len(mappings)} GPS points ({mismatches} subcounty mismatches, {outside} outside all boundaries)")
+
+@app.route('/api/status-history/monthly')
+def api_status_history_monthly():
+    """Scheme status counts at the end of every month in a range"""
+    field = request.args.get('field', 'current_status')
+    if field not in STATUS_HISTORY_FIELDS:
+        return jsonify({'error': f"field must be one of {', '.join(STATUS_HISTORY_FIELDS)}"}), 400
+    try:
+        end = parse_month(request.args.get('end'), date.today())
+        start = parse_month(request.args.get('start'), date(end.year - 1, end.month, 1) + timedelta(days=31))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if start > end:
+        return jsonify({'error': 'start must not be after end'}), 400
+    if (end.year - start.year) * 12 + end.month - start.month >= STATUS_HISTORY_MAX_MONTHS:
+        return jsonify({'error': f"Range is limited to {STATUS_HISTORY_MAX_MONTHS} months"}), 400
+
+    try:
+        return jsonify({
+            'success': True,
+            'field': field,
+            'series': status_time_series(field, start, end)
+        })
+    except Exception as e:
+        app.logger.error(f"Error building status time series: {str(e)}")
+        return jsonify({'error': 'Failed to build status time series'}), 500
+
+@app.route('/api/status-history/as-of')
+def api_status_history_as_of():
+    """Scheme status counts as they stood on a given date"""
+    field = request.args.get('field', 'current_status')
+    if field not in STATUS_HISTORY_FIELDS:
+        return jsonify({'error': f"field must be one of {', '.join(STATUS_HISTORY_FIELDS)}"}), 400
+    as_of = parse_date(request.args.get('date')) if request.args.get('date') else date.today()
+    if as_of is None:
+        return jsonify({'error': 'date must be YYYY-MM-DD'}), 400
+
+    try:
+        counts = status_counts_as_of(field, as_of)
+        return jsonify({
+            'success': True,
+            'field': field,
+            'as_of': as_of,
+            'total': sum(counts.values()),
+            'counts': counts
+        })
+    except Exception as e:
+        app.logger.error(f"Error fetching status counts: {str(e)}")
+        return jsonify({'error': 'Failed to fetch status counts'}), 500
+
+@app.cli.command('merge-duplicate-schemes')
+@click.option('--dry-run', is_flag=True, help='Report the duplicates without merging them')
+def merge_duplicate_schemes(dry_run):
+    """Collapse schemes created by repeat visits into one scheme each"""
+    backfill_scheme_match_keys()
+    groups = duplicate_scheme_groups()
+    duplicates = sum(len(ids) for ids in groups.values())
+    if dry_run:
+        for survivor_id, duplicate_ids in sorted(groups.items()):
+            click.echo(f"{survivor_id} <- {', '.join(str(i) for i in duplicate_ids)}")
+        click.echo(f"{duplicates} duplicates of {len(groups)} schemes")
+        return
+
+    for survivor_id, duplicate_ids in groups.items():
+        merge_schemes(survivor_id, duplicate_ids)
+    bump_data_generation('schemes')
+    db.session.commit()
+
+    backfill_scheme_locations()
+    rebuild_analytics_cube()
+    shutil.rmtree(TILE_CACHE_FOLDER, ignore_errors=True)
+    click.echo(f"Merged {duplicates} duplicates into {len(groups)} schemes")
+
+@app.cli.command('backfill-status-history')
+def backfill_status_history_command():
+    """Create status history rows for assessments recorded before the history existed"""
+    added = backfill_status_history()
+    click.echo(f"Added {added} status history rows")
+
+@app.route('/api/analytics/wards')
+def api_ward_analytics():
+    """Per-ward scheme aggregates based on each scheme's latest GPS position"""
+    try:
+        rows = db.session.query(
+            GPSBoundary.subcounty_name,
+            GPSBoundary.ward_name,
+            IrrigationScheme.current_status,
+            func.count(IrrigationScheme.scheme_id).label('schemes'),
+            func.sum(IrrigationScheme.scheme_area).label('scheme_area'),
+            func.sum(IrrigationScheme.irrigable_area).label('irrigable_area'),
+            func.sum(db.case((GPSBoundary.subcounty_match.is_(False), 1), else_=0)).label('mismatches')
+        ).select_from(SchemeLocation).join(
+            GPSBoundary, SchemeLocation.gps_id == GPSBoundary.gps_id
+        ).join(
+            IrrigationScheme, SchemeLocation.scheme_id == IrrigationScheme.scheme_id
+        ).group_by(
+            GPSBoundary.subcounty_name, GPSBoundary.ward_name, IrrigationScheme.current_status
+        ).all()
+
+        wards = {}
+        for subcounty_name, ward_name, status, schemes, scheme_area, irrigable_area, mismatches in rows:
+            key = (subcounty_name, ward_name)
+            ward = wards.setdefault(key, {
+                'subcounty_name': subcounty_name or 'Outside boundaries',
+                'ward_name': ward_name,
+                'total_schemes': 0,
+                'scheme_area': 0.0,
+                'irrigable_area': 0.0,
+                'subcounty_mismatches': 0,
+                'current_status': {}
+            })
+            ward['total_schemes'] += schemes
+            ward['scheme_area'] += float(scheme_area or 0)
+            ward['irrigable_area'] += float(irrigable_area or 0)
+            ward['subcounty_mismatches'] += int(mismatches or 0)
+            ward['current_status'][status or 'Unknown'] = schemes
+
+        return jsonify({
+            'success': True,
+            'wards': sorted(wards.values(), key=lambda w: (w['subcounty_name'], w['ward_name'] or ''))
+        })
+    except Exception as e:
+        app.logger.error(f"Ward analytics error: {str(e)}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/boundaries/mismatches')
+def api_boundary_mismatches():
+    """Schemes whose GPS point lies outside the subcounty entered by the agent"""
+    try:
+        rows = db.session.query(
+            IrrigationScheme.scheme_id,
+            IrrigationScheme.scheme_name,
+            Subcounty.subcounty_name.label('entered_subcounty'),
+            GPSBoundary.subcounty_name.label('located_subcounty'),
+            GPSBoundary.ward_name,
+            GPSData.latitude,
+            GPSData.longitude,
+            GPSData.recorded_at
+        ).select_from(GPSBoundary).join(
+            GPSData, GPSBoundary.gps_id == GPSData.id
+        ).join(
+            IrrigationScheme, GPSData.scheme_id == IrrigationScheme.scheme_id
+        ).join(
+            Subcounty, IrrigationScheme.subcounty_id == Subcounty.subcounty_id
+        ).filter(
+            GPSBoundary.subcounty_match.is_(False)
+        ).order_by(GPSData.recorded_at.desc()).all()
+
+        return jsonify({'mismatches': [{
+            'scheme_id': r.scheme_id,
+            'scheme_name': r.scheme_name,
+            'entered_subcounty': r.entered_subcounty,
+            'located_subcounty': r.located_subcounty,
+            'ward_name': r.ward_name,
+            'latitude': float(r.latitude),
+            'longitude': float(r.longitude),
+            'recorded_at': r.recorded_at.isoformat() if r.recorded_at else None
+        } for r in rows]})
+    except Exception as e:
+        app.logger.error(f"Error fetching boundary mismatches: {str(e)}")
+        return jsonify({'error': 'Failed to fetch boundary mismatches'}), 500
+
+# Analytics breakdowns
+ANALYTICS_FUNCTIONAL_STATUSES = ['Fully functional', 'Partially functional']
+ANALYTICS_SINGLE_BREAKDOWNS = ['infrastructure_status', 'application_type', 'current_status', 'registration_status']
+
+def analytics_breakdowns():
+    """All analytics_data() aggregates computed in a single pass over irrigation_schemes"""
+    if db.engine.dialect.name == 'postgresql':
+        return _analytics_breakdowns_grouping_sets()
+    return _analytics_breakdowns_single_scan()
+
+def _empty_breakdowns():
+    breakdowns = {name: {} for name in ANALYTICS_SINGLE_BREAKDOWNS}
+    breakdowns.update({'water_availability': {}, 'total_schemes': 0, 'functional_count': 0})
+    return breakdowns
+
+def _analytics_breakdowns_grouping_sets():
+    """Postgres: one GROUPING SETS statement, told apart with GROUPING()"""
+    columns = [
+        Subcounty.subcounty_name,
+        IrrigationScheme.water_availability,
+        *[getattr(IrrigationScheme, name) for name in ANALYTICS_SINGLE_BREAKDOWNS]
+    ]
+    grouping_sets = [(0, 1)] + [(i,) for i in range(2, len(columns))] + [()]
+
+    def grouping_mask(grouped):
+        # GROUPING() sets a bit, most significant first, for each column not in the set
+        return sum(1 << (len(columns) - 1 - i) for i in range(len(columns)) if i not in grouped)
+
+    functional = func.sum(db.case(
+        (IrrigationScheme.infrastructure_status.in_(ANALYTICS_FUNCTIONAL_STATUSES), 1), else_=0
+    ))
+    rows = db.session.query(
+        *columns,
+        func.grouping(*columns).label('grouping_id'),
+        func.count(IrrigationScheme.scheme_id),
+        functional
+    ).select_from(IrrigationScheme).outerjoin(
+        Subcounty, Subcounty.subcounty_id == IrrigationScheme.subcounty_id
+    ).group_by(
+        func.grouping_sets(*[tuple_(*[columns[i] for i in s]) for s in grouping_sets])
+    ).all()
+
+    masks = {grouping_mask(s): s for s in grouping_sets}
+    breakdowns = _empty_breakdowns()
+    for row in rows:
+        grouped = masks.get(row[len(columns)])
+        count = row[len(columns) + 1]
+        if grouped == (0, 1):
+            if row[0] is not None and row[1] is not None:
+                breakdowns['water_availability'][(row[0], row[1])] = count
+        elif grouped == ():
+            breakdowns['total_schemes'] = count
+            breakdowns['functional_count'] = int(row[len(columns) + 2] or 0)
+        elif grouped is not None:
+            value = row[grouped[0]]
+            if value is not None:
+                breakdowns[ANALYTICS_SINGLE_BREAKDOWNS[grouped[0] - 2]][value] = count
+    return breakdowns
+
+def _analytics_breakdowns_single_scan():
+    """Other databases: one grouped scan at the finest grain, rolled up in Python"""
+    rows = db.session.query(
+        Subcounty.subcounty_name,
+        IrrigationScheme.water_availability,
+        *[getattr(IrrigationScheme, name) for name in ANALYTICS_SINGLE_BREAKDOWNS],
+        func.count(IrrigationScheme.scheme_id)
+    ).select_from(IrrigationScheme).outerjoin(
+        Subcounty, Subcounty.subcounty_id == IrrigationScheme.subcounty_id
+    ).group_by(
+        Subcounty.subcounty_name,
+        IrrigationScheme.water_availability,
+        *[getattr(IrrigationScheme, name) for name in ANALYTICS_SINGLE_BREAKDOWNS]
+    ).all()
+
+    breakdowns = _empty_breakdowns()
+    for subcounty, availability, *values, count in rows:
+        if subcounty is not None and availability is not None:
+            key = (subcounty, availability)
+            breakdowns['water_availability'][key] = breakdowns['water_availability'].get(key, 0) + count
+        for name, value in zip(ANALYTICS_SINGLE_BREAKDOWNS, values):
+            if value is not None:
+                breakdowns[name][value] = breakdowns[name].get(value, 0) + count
+        breakdowns['total_schemes'] += count
+        if values[0] in ANALYTICS_FUNCTIONAL_STATUSES:
+            breakdowns['functional_count'] += count
+    return breakdowns
+
+# Area and utilisation statistics
+AREA_STATS_GROUPS = {'subcounty': 'subcounty_name', 'main_crop': 'main_crop'}
+AREA_STATS_PERCENTILES = [10, 25, 50, 75, 90]
+AREA_STATS_MEASURES = ['scheme_area', 'irrigable_area', 'cropped_area', 'farmers_count']
+
+_area_stats_cache = {}
+_area_stats_lock = threading.Lock()
+
+def load_area_columns():
+    """Pull area and farmer columns into NumPy arrays with a single query"""
+    latest_farmers = db.session.query(Assessment.farmers_count).filter(
+        Assessment.scheme_id == IrrigationScheme.scheme_id
+    ).order_by(
+        Assessment.assessment_date.desc(), Assessment.assessment_id.desc()
+    ).limit(1).correlate(IrrigationScheme).scalar_subquery()
+
+    rows = db.session.query(
+        IrrigationScheme.scheme_id,
+        IrrigationScheme.scheme_name,
+        Subcounty.subcounty_name,
+        IrrigationScheme.main_crop,
+        IrrigationScheme.scheme_area,
+        IrrigationScheme.irrigable_area,
+        IrrigationScheme.cropped_area,
+        latest_farmers.label('farmers_count')
+    ).outerjoin(
+        Subcounty, IrrigationScheme.subcounty_id == Subcounty.subcounty_id
+    ).all()
+
+    ids, names, subcounties, crops, *measures = zip(*rows) if rows else ([],) * 8
+    columns = {
+        'scheme_id': np.asarray(ids, dtype=int),
+        'scheme_name': np.asarray(names, dtype=object),
+        'subcounty_name': np.asarray([v or 'Unknown' for v in subcounties], dtype=object),
+        'main_crop': np.asarray([v or 'Unknown' for v in crops], dtype=object),
+    }
+    for name, values in zip(AREA_STATS_MEASURES, measures):
+        columns[name] = np.asarray([np.nan if v is None else float(v) for v in values], dtype=float)
+    return columns
+
+def _safe_ratio(numerator, denominator):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(denominator > 0, numerator / denominator, np.nan)
+
+def _grouped_percentiles(codes, values, group_count):
+    """Percentiles per group from one padded matrix instead of a loop over groups"""
+    valid = ~np.isnan(values)
+    codes, values = codes[valid], values[valid]
+    if not len(values):
+        return np.full((group_count, len(AREA_STATS_PERCENTILES)), np.nan)
+
+    order = np.lexsort((values, codes))
+    codes, values = codes[order], values[order]
+    sizes = np.bincount(codes, minlength=group_count)
+    starts = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+    positions = np.arange(len(values)) - starts[codes]
+
+    matrix = np.full((group_count, max(sizes.max(), 1)), np.nan)
+    matrix[codes, positions] = values
+    with warnings.catch_warnings():
+        # Groups without any valid ratio produce all-NaN rows
+        warnings.simplefilter('ignore', RuntimeWarning)
+        return np.nanpercentile(matrix, AREA_STATS_PERCENTILES, axis=1).T
+
+def _finite(value, digits=4):
+    return None if value is None or not np.isfinite(value) else round(float(value), digits)
+
+def compute_area_stats(columns, group_by='subcounty', bins=10):
+    """Grouped sums, means, percentiles, histograms and outlier flags for area ratios"""
+    ratios = {
+        'cropped_irrigable': _safe_ratio(columns['cropped_area'], columns['irrigable_area']),
+        'irrigable_scheme': _safe_ratio(columns['irrigable_area'], columns['scheme_area'])
+    }
+
+    labels, codes = np.unique(columns[AREA_STATS_GROUPS[group_by]], return_inverse=True)
+    group_count = len(labels)
+    schemes = np.bincount(codes, minlength=group_count)
+
+    sums, means = {}, {}
+    for measure in AREA_STATS_MEASURES:
+        values = columns[measure]
+        present = ~np.isnan(values)
+        sums[measure] = np.bincount(codes, weights=np.where(present, values, 0.0), minlength=group_count)
+        counts = np.bincount(codes, weights=present, minlength=group_count)
+        means[measure] = _safe_ratio(sums[measure], counts)
+
+    percentiles = {name: _grouped_percentiles(codes, values, group_count) for name, values in ratios.items()}
+
+    groups = []
+    for i, label in enumerate(labels):
+        groups.append({
+            'name': label,
+            'schemes': int(schemes[i]),
+            'sums': {m: _finite(sums[m][i], 2) for m in AREA_STATS_MEASURES},
+            'means': {m: _finite(means[m][i], 2) for m in AREA_STATS_MEASURES},
+            'ratios': {
+                'cropped_irrigable': _finite(_safe_ratio(sums['cropped_area'][i:i + 1], sums['irrigable_area'][i:i + 1])[0]),
+                'irrigable_scheme': _finite(_safe_ratio(sums['irrigable_area'][i:i + 1], sums['scheme_area'][i:i + 1])[0])
+            },
+            'ratio_percentiles': {
+                name: {f"p{p}": _finite(v) for p, v in zip(AREA_STATS_PERCENTILES, percentiles[name][i])}
+                for name in ratios
+            }
+        })
+
+    # Histograms over [0, 1] with values above 1 counted separately
+    edges = np.linspace(0.0, 1.0, bins + 1)
+    histograms = {}
+    for name, values in ratios.items():
+        finite = values[np.isfinite(values)]
+        counts, _ = np.histogram(finite[finite <= 1.0], bins=edges)
+        histograms[name] = {
+            'edges': [round(float(e), 4) for e in edges],
+            'counts': counts.tolist(),
+            'above_one': int(np.count_nonzero(finite > 1.0))
+        }
+
+    # Outliers: impossible ratios plus Tukey fences on each ratio
+    flags = defaultdict(list)
+    for name, values in ratios.items():
+        finite = np.isfinite(values)
+        if np.count_nonzero(finite) >= 4:
+            q1, q3 = np.percentile(values[finite], [25, 75])
+            low, high = q1 - 1.5 * (q3 - q1), q3 + 1.5 * (q3 - q1)
+            for i in np.flatnonzero(finite & ((values < low) | (values > high))):
+                flags[i].append(f"{name}_ratio_outlier")
+        for i in np.flatnonzero(finite & (values > 1.0)):
+            flags[i].append(f"{name}_ratio_above_one")
+
+    outliers = [{
+        'scheme_id': int(columns['scheme_id'][i]),
+        'scheme_name': columns['scheme_name'][i],
+        'cropped_irrigable': _finite(ratios['cropped_irrigable'][i]),
+        'irrigable_scheme': _finite(ratios['irrigable_scheme'][i]),
+        'reasons': reasons
+    } for i, reasons in sorted(flags.items())]
+
+    totals = {m: _finite(np.nansum(columns[m]), 2) for m in AREA_STATS_MEASURES}
+    totals['schemes'] = int(len(columns['scheme_id']))
+    totals['cropped_irrigable'] = _finite(_safe_ratio(np.nansum(columns['cropped_area']), np.nansum(columns['irrigable_area'])))
+    totals['irrigable_scheme'] = _finite(_safe_ratio(np.nansum(columns['irrigable_area']), np.nansum(columns['scheme_area'])))
+
+    return {
+        'group_by': group_by,
+        'totals': totals,
+        'groups': groups,
+        'histograms': histograms,
+        'outliers': outliers
+    }
+
+def get_area_stats(group_by='subcounty', bins=10):
+    """Area statistics cached per data generation"""
+    generation = get_data_generation('schemes')
+    key = (generation, group_by, bins)
+    with _area_stats_lock:
+        if key in _area_stats_cache:
+            return _area_stats_cache[key]
+
+    stats = compute_area_stats(load_area_columns(), group_by, bins)
+    stats['generation'] = generation
+    with _area_stats_lock:
+        for stale_key in [k for k in _area_stats_cache if k[0] != generation]:
+            del _area_stats_cache[stale_key]
+        _area_stats_cache[key] = stats
+    return stats
+
 # Analytics API Route
 @app.route('/api/analytics-data')
+@read_replica
 def analytics_data():
     """API endpoint to provide analytics data for the dashboard"""
     try:
-        # Water Availability by Subcounty
-        water_availability_query = db.session.query(
-            Subcounty.subcounty_name,
-            IrrigationScheme.water_availability,
-            func.count(IrrigationScheme.scheme_id).label('count')
-        ).join(
-            IrrigationScheme, Subcounty.subcounty_id == IrrigationScheme.subcounty_id
-        ).filter(
-            IrrigationScheme.water_availability.isnot(None)
-        ).group_by(
-            Subcounty.subcounty_name, 
-            IrrigationScheme.water_availability
-        ).all()
+        breakdowns = analytics_breakdowns()
 
         # Process water availability data
         water_availability_data = {}
         subcounties = set()
         
-        for subcounty, availability, count in water_availability_query:
+        for (subcounty, availability), count in breakdowns['water_availability'].items():
             subcounties.add(subcounty)
             if availability not in water_availability_data:
                 water_availability_data[availability] = {}
@@ -1002,72 +4524,16 @@ def analytics_data():
                 if subcounty not in water_availability_data[category]:
                     water_availability_data[category][subcounty] = 0
 
-        # Infrastructure Status Distribution
-        infrastructure_query = db.session.query(
-            IrrigationScheme.infrastructure_status,
-            func.count(IrrigationScheme.scheme_id).label('count')
-        ).filter(
-            IrrigationScheme.infrastructure_status.isnot(None)
-        ).group_by(
-            IrrigationScheme.infrastructure_status
-        ).all()
-
-        infrastructure_data = {}
-        for status, count in infrastructure_query:
-            infrastructure_data[status] = count
-
-        # Irrigation Application Methods
-        application_query = db.session.query(
-            IrrigationScheme.application_type,
-            func.count(IrrigationScheme.scheme_id).label('count')
-        ).filter(
-            IrrigationScheme.application_type.isnot(None)
-        ).group_by(
-            IrrigationScheme.application_type
-        ).all()
-
-        application_data = {}
-        for method, count in application_query:
-            application_data[method] = count
+        infrastructure_data = breakdowns['infrastructure_status']
+        application_data = breakdowns['application_type']
+        current_status_data = breakdowns['current_status']
+        registration_data = breakdowns['registration_status']
 
         # Calculate statistics
-        total_schemes = IrrigationScheme.query.count()
-        
-        functional_statuses = ['Fully functional', 'Partially functional']
-        functional_count = IrrigationScheme.query.filter(
-            IrrigationScheme.infrastructure_status.in_(functional_statuses)
-        ).count()
-        
+        total_schemes = breakdowns['total_schemes']
+        functional_count = breakdowns['functional_count']
         functional_rate = round((functional_count / total_schemes * 100)) if total_schemes > 0 else 0
 
-        # Current Status Distribution for additional insights
-        current_status_query = db.session.query(
-            IrrigationScheme.current_status,
-            func.count(IrrigationScheme.scheme_id).label('count')
-        ).filter(
-            IrrigationScheme.current_status.isnot(None)
-        ).group_by(
-            IrrigationScheme.current_status
-        ).all()
-
-        current_status_data = {}
-        for status, count in current_status_query:
-            current_status_data[status] = count
-
-        # Registration Status Distribution
-        registration_query = db.session.query(
-            IrrigationScheme.registration_status,
-            func.count(IrrigationScheme.scheme_id).label('count')
-        ).filter(
-            IrrigationScheme.registration_status.isnot(None)
-        ).group_by(
-            IrrigationScheme.registration_status
-        ).all()
-
-        registration_data = {}
-        for status, count in registration_query:
-            registration_data[status] = count
-
         # Add unregistered schemes
         registered_count = sum(registration_data.values())
         unregistered_count = total_schemes - registered_count
@@ -1100,6 +4566,84 @@ def analytics_data():
             'error': str(e)
         }, 500
 
+@app.route('/api/analytics/pivot')
+def analytics_pivot():
+    """Pivot table over the analytics cube: rows x cols of one measure"""
+    try:
+        rows = parse_csv_arg('rows')
+        cols = parse_csv_arg('cols')
+        measure = request.args.get('measure', 'schemes')
+        filters = parse_cube_filter(request.args.get('filter'))
+
+        unknown = [d for d in rows + cols if d not in CUBE_DIMENSIONS]
+        if unknown:
+            return jsonify({'success': False, 'error': f"Unknown dimension: {', '.join(unknown)}"}), 400
+        if measure not in CUBE_MEASURES:
+            return jsonify({'success': False, 'error': f"Unknown measure: {measure}"}), 400
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+    try:
+        group_columns = [getattr(AnalyticsCubeCell, d) for d in rows + cols]
+        query = db.session.query(*group_columns, func.sum(getattr(AnalyticsCubeCell, measure)))
+        for dim, values in filters.items():
+            column = getattr(AnalyticsCubeCell, dim)
+            query = query.filter(column.in_([v for v in values if v]) | (column.is_(None) if '' in values else False))
+        if group_columns:
+            query = query.group_by(*group_columns)
+
+        values = defaultdict(dict)
+        row_keys, col_keys = set(), set()
+        for result in query.all():
+            row_key = tuple(result[:len(rows)])
+            col_key = tuple(result[len(rows):len(rows) + len(cols)])
+            total = result[-1] or 0
+            row_keys.add(row_key)
+            col_keys.add(col_key)
+            values[row_key][col_key] = total
+
+        sort_key = lambda key: tuple('' if k is None else str(k) for k in key)
+        row_keys = sorted(row_keys, key=sort_key)
+        col_keys = sorted(col_keys, key=sort_key)
+        matrix = [[values[r].get(c, 0) for c in col_keys] for r in row_keys]
+
+        return jsonify({
+            'success': True,
+            'rows': rows,
+            'cols': cols,
+            'measure': measure,
+            'row_keys': [list(r) for r in row_keys],
+            'col_keys': [list(c) for c in col_keys],
+            'values': matrix,
+            'row_totals': [sum(r) for r in matrix],
+            'col_totals': [sum(col) for col in zip(*matrix)] if matrix else [],
+            'grand_total': sum(sum(r) for r in matrix)
+        })
+    except Exception as e:
+        app.logger.error(f"Analytics pivot error: {str(e)}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/analytics/area-stats')
+def analytics_area_stats():
+    """Irrigation efficiency ratios and area distributions by subcounty or crop"""
+    group_by = request.args.get('group_by', 'subcounty')
+    bins = request.args.get('bins', 10, type=int)
+    if group_by not in AREA_STATS_GROUPS:
+        return jsonify({'success': False, 'error': f"group_by must be one of: {', '.join(AREA_STATS_GROUPS)}"}), 400
+    if not bins or not 1 <= bins <= 100:
+        return jsonify({'success': False, 'error': 'bins must be between 1 and 100'}), 400
+
+    try:
+        return jsonify({'success': True, 'data': get_area_stats(group_by, bins)})
+    except Exception as e:
+        app.logger.error(f"Area statistics error: {str(e)}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.cli.command('rebuild-analytics-cube')
+def rebuild_analytics_cube_command():
+    """Recompute the analytics rollup cube"""
+    click.echo(f"Rebuilt analytics cube with {rebuild_analytics_cube()} cells")
+
 @app.route('/analytics')
 def analytics_dashboard():
     """Route to serve the analytics dashboard"""
@@ -1107,6 +4651,7 @@ def analytics_dashboard():
 
 # File Management Route
 @app.route('/file')
+@read_replica
 def file_management():
     try:
         # Get all subcounties for the filter dropdown
@@ -1199,6 +4744,87 @@ def file_management():
                                 'total_schemes': 0
                             })
 
+# Bulk delete routes
+def bulk_delete_files(model, id_column, path_attr, event_type, label):
+    """Shared body of the document and photo bulk delete endpoints"""
+    try:
+        ids = bulk_delete_ids()
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+
+    try:
+        deleted = delete_with_files(model, id_column, path_attr, ids)
+        if deleted:
+            publish_event(event_type, ids=deleted)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error(f"Error bulk deleting {label}: {str(e)}")
+        return jsonify({'success': False, 'message': f'Error deleting {label}: {str(e)}'}), 500
+
+    file_sweeper.wake()
+    return jsonify({
+        'success': True,
+        'message': f'Deleted {len(deleted)} {label}',
+        'deleted': deleted,
+        'not_found': sorted(set(ids) - set(deleted))
+    })
+
+@app.route('/api/documents', methods=['DELETE'])
+def bulk_delete_documents():
+    return bulk_delete_files(Document, Document.document_id, 'file_path', 'documents.deleted', 'documents')
+
+@app.route('/api/photos', methods=['DELETE'])
+def bulk_delete_photos():
+    return bulk_delete_files(Photo, Photo.id, 'file_path', 'photos.deleted', 'photos')
+
+@app.cli.command('sweep-files')
+@click.option('--now', is_flag=True, help='Ignore the grace period and sweep every tombstone')
+@click.option('--retry-failed', is_flag=True, help='Retry tombstones that have used up their attempts')
+def sweep_files(now, retry_failed):
+    """Unlink the files of deleted documents, photos and attendance records"""
+    if retry_failed:
+        FileTombstone.query.update({FileTombstone.attempts: 0}, synchronize_session=False)
+        db.session.commit()
+    totals = defaultdict(int)
+    while True:
+        stats = sweep_file_tombstones(delay=timedelta(0) if now else FILE_SWEEP_DELAY)
+        for outcome, count in stats.items():
+            totals[outcome] += count
+        if sum(stats.values()) < FILE_SWEEP_BATCH:
+            break
+    stuck = FileTombstone.query.filter(FileTombstone.attempts >= FILE_SWEEP_MAX_ATTEMPTS).count()
+    click.echo(f"Removed {totals['removed']} files, {totals['missing']} already gone, "
+               f"{totals['kept']} still referenced, {totals['failed']} failed; "
+               f"{pending_tombstones()} pending, {stuck} gave up")
+
+@app.cli.command('reconcile-storage')
+@click.option('--full', is_flag=True, help='Rescan every directory, ignoring checkpoints')
+@click.option('--quarantine', is_flag=True, help=f'Move orphaned files under {QUARANTINE_FOLDER}')
+def reconcile_storage_command(full, quarantine):
+    """Report upload files without rows and rows without files"""
+    result = reconcile_storage(full=full, quarantine=quarantine)
+    for path in result['orphans']:
+        click.echo(f"orphan    {path}")
+    for path, target in result['quarantined']:
+        click.echo(f"moved     {path} -> {target}")
+    for path, error in result['failed']:
+        click.echo(f"failed    {path}: {error}")
+    for table_name, row_id, path in result['dangling']:
+        click.echo(f"dangling  {table_name} {row_id} {path}")
+    click.echo(f"Scanned {result['rescanned']} of {result['directories']} directories: "
+               f"{len(result['orphans'])} orphans, {len(result['quarantined'])} quarantined, "
+               f"{len(result['failed'])} failed to move, {len(result['dangling'])} dangling rows")
+
+@app.cli.command('archive-attendance')
+@click.option('--older-than-days', default=ARCHIVE_AFTER_DAYS, show_default=True,
+              help='Archive files uploaded more than this many days ago')
+def archive_attendance_command(older_than_days):
+    """Pack old attendance files into indexed archive segments"""
+    stats = archive_attendance_files(older_than_days)
+    click.echo(f"Archived {stats['archived']} files into {stats['segments']} segments; "
+               f"{stats['missing']} files were missing")
+
 # Download routes
 @app.route('/download/documents/<int:doc_id>')
 def download_document(doc_id):
@@ -1307,11 +4933,207 @@ def api_schemes():
         app.logger.error(f"Error fetching schemes: {str(e)}")
         return jsonify({'error': 'Failed to fetch schemes'}), 500
 
+@app.route('/api/schemes/<int:scheme_id>/gps-track')
+def api_scheme_gps_track(scheme_id):
+    """API endpoint to get the full GPS history of a scheme"""
+    try:
+        scheme = IrrigationScheme.query.get_or_404(scheme_id)
+        points = GPSData.query.filter_by(scheme_id=scheme_id).order_by(
+            GPSData.recorded_at, GPSData.id
+        ).all()
+        return jsonify({
+            'scheme_id': scheme.scheme_id,
+            'scheme_name': scheme.scheme_name,
+            'points': [{
+                'id': p.id,
+                'latitude': float(p.latitude),
+                'longitude': float(p.longitude),
+                'recorded_at': p.recorded_at.isoformat() if p.recorded_at else None
+            } for p in points]
+        })
+    except HTTPException:
+        raise
+    except Exception as e:
+        app.logger.error(f"Error fetching GPS track: {str(e)}")
+        return jsonify({'error': 'Failed to fetch GPS track'}), 500
+
+# Scheme profiles are cached until the scheme's next change_log entry
+SCHEME_PROFILE_CACHE_SIZE = 256
+_scheme_profile_cache = OrderedDict()
+_scheme_profile_lock = threading.Lock()
+
+def column_values(obj):
+    """Column attributes of a model instance as a dict"""
+    return {attr.key: getattr(obj, attr.key) for attr in db.inspect(obj).mapper.column_attrs}
+
+def build_scheme_profile(scheme_id):
+    """Load a scheme with its full history in five queries"""
+    scheme = IrrigationScheme.query.options(
+        db.joinedload(IrrigationScheme.subcounty),
+        db.joinedload(IrrigationScheme.location),
+        db.selectinload(IrrigationScheme.assessments),
+        db.selectinload(IrrigationScheme.documents),
+        db.selectinload(IrrigationScheme.photos),
+        db.selectinload(IrrigationScheme.gps_data)
+    ).filter(IrrigationScheme.scheme_id == scheme_id).first()
+    if scheme is None:
+        return None
+
+    # Documents and photos hang off the scheme; group them under their assessment here
+    documents = defaultdict(list)
+    for d in sorted(scheme.documents, key=lambda d: d.document_id):
+        documents[d.assessment_id].append({
+            'document_id': d.document_id,
+            'document_type': d.document_type,
+            'file_name': d.file_name,
+            'file_path': d.file_path,
+            'uploaded_at': d.uploaded_at
+        })
+    photos = defaultdict(list)
+    for p in sorted(scheme.photos, key=lambda p: p.id):
+        photos[p.assessment_id].append({
+            'id': p.id,
+            'filename': p.filename,
+            'file_path': p.file_path,
+            'uploaded_at': p.uploaded_at
+        })
+
+    timeline = []
+    for a in sorted(scheme.assessments, key=lambda a: (a.assessment_date, a.assessment_id)):
+        entry = column_values(a)
+        entry['documents'] = documents.pop(a.assessment_id, [])
+        entry['photos'] = photos.pop(a.assessment_id, [])
+        timeline.append(entry)
+
+    profile = column_values(scheme)
+    profile['subcounty_name'] = scheme.subcounty.subcounty_name if scheme.subcounty else None
+    profile['location'] = {
+        'latitude': scheme.location.latitude,
+        'longitude': scheme.location.longitude,
+        'recorded_at': scheme.location.recorded_at
+    } if scheme.location else None
+    profile['assessments'] = timeline
+    profile['documents'] = [d for items in documents.values() for d in items]
+    profile['photos'] = [p for items in photos.values() for p in items]
+    profile['gps_track'] = [{
+        'id': point.id,
+        'latitude': point.latitude,
+        'longitude': point.longitude,
+        'recorded_at': point.recorded_at
+    } for point in sorted(scheme.gps_data, key=lambda point: (point.recorded_at or datetime.min, point.id))]
+    return profile
+
+@app.route('/api/schemes/<int:scheme_id>/profile')
+def api_scheme_profile(scheme_id):
+    """API endpoint to get a scheme with its assessments, files and GPS track"""
+    try:
+        # GPS points are written alongside an assessment, so the scheme's
+        # latest change_log id moves whenever any part of the profile does
+        cursor = db.session.query(func.max(ChangeLog.id)).filter(
+            ChangeLog.scheme_id == scheme_id
+        ).scalar() or 0
+
+        with _scheme_profile_lock:
+            cached = _scheme_profile_cache.get(scheme_id)
+            if cached is not None and cached[0] == cursor:
+                _scheme_profile_cache.move_to_end(scheme_id)
+                return jsonify(cached[1])
+
+        profile = build_scheme_profile(scheme_id)
+        if profile is None:
+            return jsonify({'error': 'Scheme not found'}), 404
+
+        with _scheme_profile_lock:
+            _scheme_profile_cache[scheme_id] = (cursor, profile)
+            _scheme_profile_cache.move_to_end(scheme_id)
+            while len(_scheme_profile_cache) > SCHEME_PROFILE_CACHE_SIZE:
+                _scheme_profile_cache.popitem(last=False)
+        return jsonify(profile)
+    except Exception as e:
+        app.logger.error(f"Error fetching scheme profile: {str(e)}")
+        return jsonify({'error': 'Failed to fetch scheme profile'}), 500
+
+@app.cli.command('rebuild-scheme-locations')
+def rebuild_scheme_locations():
+    """Recompute the latest GPS position of every scheme"""
+    count = backfill_scheme_locations()
+    click.echo(f"Stored latest locations for {count} schemes")
+
+@app.route('/api/routes/plan', methods=['POST'])
+def api_plan_route():
+    """Plan a field-visit order over schemes from a start point"""
+    payload = request.get_json(silent=True) or {}
+    if not isinstance(payload, dict):
+        return jsonify({'error': 'Request body must be a JSON object'}), 400
+    try:
+        start_lat, start_lon = parse_route_point(payload.get('start'))
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'error': "A valid start point is required, e.g. '0.6341, 35.7364'"}), 400
+    try:
+        scheme_ids = parse_route_scheme_ids(payload.get('scheme_ids'))
+        filters = parse_route_filters(payload.get('filter'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        query = route_candidate_query(filters)
+        if scheme_ids:
+            query = query.filter(IrrigationScheme.scheme_id.in_(scheme_ids))
+        elif not filters:
+            return jsonify({'error': 'Provide scheme_ids or a filter'}), 400
+
+        stops = query.order_by(IrrigationScheme.scheme_id).limit(MAX_ROUTE_STOPS + 1).all()
+        if len(stops) > MAX_ROUTE_STOPS:
+            return jsonify({'error': f'Routes are limited to {MAX_ROUTE_STOPS} stops'}), 400
+
+        lats = [start_lat] + [float(s.latitude) for s in stops]
+        lons = [start_lon] + [float(s.longitude) for s in stops]
+        dist = haversine_matrix(lats, lons)
+        order = plan_route(dist, return_to_start=bool(payload.get('return_to_start')))
+
+        route = []
+        previous = 0
+        total = 0.0
+        for position, node in enumerate(order, start=1):
+            stop = stops[node - 1]
+            leg = float(dist[previous, node])
+            total += leg
+            route.append({
+                'order': position,
+                'scheme_id': stop.scheme_id,
+                'scheme_name': stop.scheme_name,
+                'subcounty_name': stop.subcounty_name,
+                'current_status': stop.current_status,
+                'latitude': float(stop.latitude),
+                'longitude': float(stop.longitude),
+                'leg_km': round(leg, 3),
+                'cumulative_km': round(total, 3)
+            })
+            previous = node
+
+        if payload.get('return_to_start') and order:
+            total += float(dist[previous, 0])
+
+        missing = []
+        if scheme_ids:
+            found = {s.scheme_id for s in stops}
+            missing = [i for i in scheme_ids if i not in found]
+
+        return jsonify({
+            'start': {'latitude': start_lat, 'longitude': start_lon},
+            'stops': route,
+            'total_km': round(total, 3),
+            'unroutable_scheme_ids': missing
+        })
+    except Exception as e:
+        app.logger.error(f"Error planning route: {str(e)}")
+        return jsonify({'error': 'Failed to plan route'}), 500
+
 @app.route('/api/assessments')
 def api_assessments():
     """API endpoint to get all assessments with scheme and subcounty data"""
     try:
-        assessments = db.session.query(
+        query = db.session.query(
             Assessment.assessment_id,
             Assessment.scheme_id,
             Assessment.agent_name,
@@ -1326,7 +5148,7 @@ def api_assessments():
             IrrigationScheme.water_availability,
             IrrigationScheme.infrastructure_status,
             IrrigationScheme.main_crop,
-            IrrigationScheme.scheme_area,
+            func.nullif(IrrigationScheme.scheme_area, 0).label('scheme_area'),
             Subcounty.subcounty_name,
             Subcounty.subcounty_id
         ).join(
@@ -1335,29 +5157,10 @@ def api_assessments():
             Subcounty, IrrigationScheme.subcounty_id == Subcounty.subcounty_id
         ).order_by(
             Assessment.assessment_date.desc()
-        ).all()
+        )
+        columns, assessments = row_table(query, query.all())
 
-        return jsonify({
-            'assessments': [{
-                'assessment_id': a.assessment_id,
-                'scheme_id': a.scheme_id,
-                'agent_name': a.agent_name,
-                'assessment_date': a.assessment_date.isoformat() if a.assessment_date else None,
-                'farmers_count': a.farmers_count,
-                'future_plans': a.future_plans,
-                'challenges': a.challenges,
-                'additional_notes': a.additional_notes,
-                'created_at': a.created_at.isoformat() if a.created_at else None,
-                'scheme_name': a.scheme_name,
-                'current_status': a.current_status,
-                'water_availability': a.water_availability,
-                'infrastructure_status': a.infrastructure_status,
-                'main_crop': a.main_crop,
-                'scheme_area': float(a.scheme_area) if a.scheme_area else None,
-                'subcounty_name': a.subcounty_name,
-                'subcounty_id': a.subcounty_id
-            } for a in assessments]
-        })
+        return jsonify({'columns': columns, 'assessments': assessments})
     except Exception as e:
         app.logger.error(f"Error fetching assessments: {str(e)}")
         return jsonify({'error': 'Failed to fetch assessments'}), 500
@@ -1448,6 +5251,7 @@ def api_assessment_details(assessment_id):
         return jsonify({'error': 'Failed to fetch assessment details'}), 500
 
 @app.route('/api/assessments/export')
+@read_replica
 def export_assessments():
     """Export assessments data as CSV"""
     try:
@@ -1626,7 +5430,46 @@ def home():
 try:
     with app.app_context():
         db.create_all()
+        ensure_indexes()
         app.logger.info("Database tables created successfully")
+
+        # One-off population of scheme_locations for databases created before it existed
+        try:
+            if db.session.query(SchemeLocation.scheme_id).first() is None and \
+                    db.session.query(GPSData.id).first() is not None:
+                backfill_scheme_locations()
+        except Exception as e:
+            db.session.rollback()
+            app.logger.warning(f"Could not backfill scheme locations: {str(e)}")
+
+        try:
+            ensure_attendance_search_index()
+        except Exception as e:
+            app.logger.warning(f"Could not create attendance search index: {str(e)}")
+
+        try:
+            if db.session.query(SchemeMatchKey.scheme_id).first() is None and \
+                    db.session.query(IrrigationScheme.scheme_id).first() is not None:
+                backfill_scheme_match_keys()
+        except Exception as e:
+            db.session.rollback()
+            app.logger.warning(f"Could not backfill scheme match keys: {str(e)}")
+
+        try:
+            if db.session.query(SchemeStatusHistory.id).first() is None and \
+                    db.session.query(Assessment.assessment_id).first() is not None:
+                backfill_status_history()
+        except Exception as e:
+            db.session.rollback()
+            app.logger.warning(f"Could not backfill status history: {str(e)}")
+
+        try:
+            if db.session.query(AnalyticsCubeCell.id).first() is None and \
+                    db.session.query(IrrigationScheme.scheme_id).first() is not None:
+                rebuild_analytics_cube()
+        except Exception as e:
+            db.session.rollback()
+            app.logger.warning(f"Could not build analytics cube: {str(e)}")
 except Exception as e:
     app.logger.error(f"Failed to initialize database: {str(e)}")
     raise
@@ -0,0 +1,24 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# app.py configures itself from the environment at import time
+_tmp = tempfile.mkdtemp(prefix='cidu-tests-')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(_tmp, 'test.db')}"
+os.environ['UPLOAD_FOLDER'] = os.path.join(_tmp, 'uploads')
+os.environ['TILE_CACHE_FOLDER'] = os.path.join(_tmp, 'tiles')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as app_module  # noqa: E402
+
+
+@pytest.fixture
+def app():
+    return app_module.app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
@@ -0,0 +1,32 @@
+import app as app_module
+from app import AttendanceRecord, db
+
+
+def test_streamed_body_holds_admission_until_closed(app, client):
+    gate = app_module.admission_gates['light']
+    with app.app_context():
+        path = app_module.unique_upload_path('', 'streamed.pdf')
+        with open(path, 'wb') as f:
+            f.write(b'%PDF-1.4' * 1000)
+        record = AttendanceRecord(filename='streamed.pdf', filepath=path, venue='Admission')
+        db.session.add(record)
+        db.session.commit()
+        record_id = record.id
+    try:
+        active = gate.stats()['active']
+        response = client.get(f'/preview/{record_id}', buffered=False)
+        assert gate.stats()['active'] == active + 1
+        response.close()
+        assert gate.stats()['active'] == active
+    finally:
+        with app.app_context():
+            db.session.delete(db.session.get(AttendanceRecord, record_id))
+            db.session.commit()
+
+
+def test_event_stream_is_exempt(client):
+    gate = app_module.admission_gates['light']
+    admitted = gate.stats()['admitted']
+    response = client.get('/api/events/stream', buffered=False)
+    assert gate.stats()['admitted'] == admitted
+    response.close()
@@ -0,0 +1,33 @@
+import logging
+
+import app as app_module
+from app import AnalyticsCubeCell, apply_cube_delta, cube_cell_key, db
+
+DIMS = ('Cube Test', 'Community', 'Active', None, None, None, None, None, '2024-01')
+
+
+def cell_measures(**values):
+    measures = dict.fromkeys(app_module.CUBE_MEASURES, 0)
+    measures.update(values)
+    return measures
+
+
+def test_additions_upsert_into_one_cell(app):
+    with app.app_context():
+        apply_cube_delta({DIMS: cell_measures(schemes=1, assessments=1, farmers_count=10)})
+        apply_cube_delta({DIMS: cell_measures(assessments=1, farmers_count=5)})
+        db.session.commit()
+        cell = AnalyticsCubeCell.query.filter_by(cell_key=cube_cell_key(DIMS)).one()
+        assert (cell.schemes, cell.assessments, cell.farmers_count) == (1, 2, 15)
+
+        apply_cube_delta({DIMS: cell_measures(schemes=1, assessments=2, farmers_count=15)}, sign=-1)
+        db.session.commit()
+        assert AnalyticsCubeCell.query.filter_by(cell_key=cube_cell_key(DIMS)).count() == 0
+
+
+def test_removing_from_a_missing_cell_is_logged(app, caplog):
+    missing = DIMS[:-1] + ('1999-01',)
+    with app.app_context(), caplog.at_level(logging.WARNING):
+        apply_cube_delta({missing: cell_measures(assessments=1)}, sign=-1)
+        db.session.rollback()
+    assert 'was missing' in caplog.text
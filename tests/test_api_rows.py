@@ -0,0 +1,24 @@
+from app import AttendanceRecord, db
+
+
+def test_attendance_records_are_row_arrays(app, client):
+    with app.app_context():
+        record = AttendanceRecord(filename='rows.pdf', filepath='rows.pdf', venue='Row Arrays')
+        db.session.add(record)
+        db.session.commit()
+        record_id = record.id
+    try:
+        body = client.get('/api/attendance?venue=Row%20Arrays').get_json()
+        assert body['columns'][:3] == ['id', 'filename', 'venue']
+        assert body['records'] == [[record_id, 'rows.pdf', 'Row Arrays', None, None,
+                                    body['records'][0][5], 0]]
+    finally:
+        with app.app_context():
+            db.session.delete(db.session.get(AttendanceRecord, record_id))
+            db.session.commit()
+
+
+def test_assessments_come_with_a_columns_header(client):
+    body = client.get('/api/assessments').get_json()
+    assert 'scheme_area' in body['columns']
+    assert all(len(row) == len(body['columns']) for row in body['assessments'])
@@ -0,0 +1,52 @@
+import os
+
+import pytest
+
+import app as app_module
+from app import AttendanceRecord, db
+
+
+@pytest.fixture
+def archived_record(app):
+    with app.app_context():
+        os.makedirs(app_module.ARCHIVE_FOLDER, exist_ok=True)
+        data = bytes(range(256)) * 300
+        path = app_module.unique_upload_path('', 'register.pdf')
+        with open(path, 'wb') as f:
+            f.write(data)
+        record = AttendanceRecord(filename='register.pdf', filepath=path, venue='Archive')
+        db.session.add(record)
+        db.session.commit()
+        assert app_module.write_archive_segment([record]) == (1, 0)
+        record_id = record.id
+    yield record_id, data
+    with app.app_context():
+        db.session.delete(db.session.get(AttendanceRecord, record_id))
+        db.session.commit()
+
+
+def test_archived_file_streams_whole_and_in_ranges(client, archived_record):
+    record_id, data = archived_record
+    response = client.get(f'/download/{record_id}')
+    assert response.status_code == 200
+    assert response.content_length == len(data)
+    assert response.data == data
+
+    response = client.get(f'/download/{record_id}', headers={'Range': 'bytes=1000-1999'})
+    assert response.status_code == 206
+    assert response.data == data[1000:2000]
+
+
+def test_corrupt_archived_file_fails_the_crc(app, archived_record):
+    record_id, data = archived_record
+    with app.app_context():
+        archived = db.session.get(AttendanceRecord, record_id).archive
+        segment = os.path.join(app_module.ARCHIVE_FOLDER, archived.segment)
+        with open(segment, 'r+b') as f:
+            f.seek(archived.data_offset + 10)
+            f.write(b'\xff')
+        reader = app_module.ArchivedFileReader(archived)
+        with pytest.raises(IOError):
+            while reader.read(4096):
+                pass
+        reader.close()
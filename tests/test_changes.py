@@ -0,0 +1,39 @@
+from datetime import datetime, timedelta
+
+import app as app_module
+from app import ChangeLog, db
+
+
+def add_changes(ids, changed_at):
+    for row_id in ids:
+        db.session.add(ChangeLog(id=row_id, table_name='assessments', row_id=row_id,
+                                 operation='insert', data='{}', changed_at=changed_at))
+    db.session.commit()
+
+
+def test_cursor_stops_before_a_recent_gap(app, client):
+    with app.app_context():
+        base = (db.session.query(db.func.max(ChangeLog.id)).scalar() or 0) + 100
+        add_changes([base + 1, base + 2], datetime.utcnow() - timedelta(hours=1))
+        # base + 3 stands for a transaction that has not committed yet
+        add_changes([base + 4], datetime.utcnow())
+
+    body = client.get(f'/api/changes?since={base}').get_json()
+    assert [c['id'] for c in body['changes']] == [base + 1, base + 2]
+    assert body['cursor'] == base + 2
+
+    with app.app_context():
+        add_changes([base + 3], datetime.utcnow())
+    body = client.get(f"/api/changes?since={body['cursor']}").get_json()
+    assert [c['id'] for c in body['changes']] == [base + 3, base + 4]
+    assert body['cursor'] == base + 4
+
+
+def test_old_gaps_are_treated_as_rolled_back(app, client):
+    with app.app_context():
+        base = (db.session.query(db.func.max(ChangeLog.id)).scalar() or 0) + 100
+        add_changes([base + 1, base + 3], datetime.utcnow() - app_module.CHANGE_FEED_SETTLE * 2)
+
+    body = client.get(f'/api/changes?since={base}').get_json()
+    assert [c['id'] for c in body['changes']] == [base + 1, base + 3]
+    assert body['cursor'] == base + 3
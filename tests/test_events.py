@@ -0,0 +1,52 @@
+import app as app_module
+from app import EventBroker
+
+
+def test_cursor_waits_for_gaps_until_they_fill():
+    seen, gaps = {11, 12, 14}, {}
+    assert EventBroker._advance(10, seen, gaps) == 12
+    assert seen == {14} and set(gaps) == {13}
+
+    # 13 commits after 14 was delivered
+    seen.add(13)
+    assert EventBroker._advance(12, seen, gaps) == 14
+    assert not seen and not gaps
+
+
+def test_settled_gaps_are_skipped(monkeypatch):
+    monkeypatch.setattr(app_module, 'SSE_GAP_SETTLE_SECONDS', 0)
+    seen, gaps = {11, 14}, {}
+    assert EventBroker._advance(10, seen, gaps) == 14
+    assert not seen and not gaps
+
+
+def test_stream_sends_late_lower_ids_and_replays_the_settle_window(app, client):
+    from app import LiveEvent, db, event_broker
+    with app.app_context():
+        events = [LiveEvent(event_type='test.event', payload='{}') for _ in range(3)]
+        db.session.add_all(events)
+        db.session.commit()
+        ids = [e.id for e in events]
+
+    # Reconnecting after the highest id still replays the lower recent ones
+    response = client.get('/api/events/stream', headers={'Last-Event-ID': str(ids[-1])}, buffered=False)
+    chunks = (chunk.decode('utf-8') for chunk in response.response)
+    next(chunks)
+    replayed = [next(chunks) for _ in ids]
+    assert [int(chunk.split('\n')[0][4:]) for chunk in replayed] == ids
+
+    # A lower id delivered by the broker after a higher one is still sent once
+    subscriber = next(iter(event_broker.subscribers))
+    subscriber.put_nowait({'id': ids[0] - 1, 'type': 'test.event', 'data': '{}'})
+    subscriber.put_nowait({'id': ids[1], 'type': 'test.event', 'data': '{}'})
+    subscriber.put_nowait({'id': ids[-1] + 1, 'type': 'test.event', 'data': '{}'})
+    assert next(chunks).startswith(f"id: {ids[0] - 1}\n")
+    assert next(chunks).startswith(f"id: {ids[-1] + 1}\n")
+    response.close()
+
+
+def test_streams_over_the_worker_cap_get_503(client, monkeypatch):
+    monkeypatch.setattr(app_module, 'SSE_MAX_STREAMS', 0)
+    response = client.get('/api/events/stream')
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == str(app_module.SSE_RETRY_AFTER_SECONDS)
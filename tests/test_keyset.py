@@ -0,0 +1,57 @@
+from datetime import date
+
+import pytest
+from sqlalchemy.dialects import mysql
+
+import app as app_module
+from app import AttendanceRecord, db
+
+
+def test_order_avoids_nulls_first_last():
+    for descending in (False, True):
+        for backwards in (False, True):
+            order = app_module.keyset_order(AttendanceRecord.date, descending, backwards)
+            sql = ', '.join(str(clause.compile(dialect=mysql.dialect())) for clause in order)
+            assert 'NULLS' not in sql
+
+
+@pytest.mark.parametrize('descending', [False, True])
+def test_pages_walk_nulls_last_both_ways(app, descending):
+    with app.app_context():
+        records = [AttendanceRecord(filename=f'k{i}.pdf', filepath=f'k{i}.pdf', venue='Keyset', date=d)
+                   for i, d in enumerate([date(2024, 1, 2), None, date(2024, 1, 1), None, date(2024, 1, 2)])]
+        db.session.add_all(records)
+        db.session.commit()
+        try:
+            base = AttendanceRecord.query.filter_by(venue='Keyset')
+            column = AttendanceRecord.date
+            expected = [(r.date, r.id) for r in base.order_by(
+                *app_module.keyset_order(column, descending))]
+            assert [d for d, _ in expected][-2:] == [None, None]
+
+            forward, cursor = [], None
+            while True:
+                query = base
+                if cursor:
+                    query = query.filter(app_module.keyset_condition(column, *cursor, descending))
+                page = query.order_by(*app_module.keyset_order(column, descending)).limit(2).all()
+                if not page:
+                    break
+                forward.extend((r.date, r.id) for r in page)
+                cursor = (page[-1].date, page[-1].id)
+            assert forward == expected
+
+            backward, cursor = [], expected[-1]
+            while True:
+                page = base.filter(
+                    app_module.keyset_condition(column, *cursor, descending, after=False)
+                ).order_by(*app_module.keyset_order(column, descending, backwards=True)).limit(2).all()
+                if not page:
+                    break
+                backward.extend((r.date, r.id) for r in page)
+                cursor = (page[-1].date, page[-1].id)
+            assert backward == expected[-2::-1]
+        finally:
+            for record in records:
+                db.session.delete(record)
+            db.session.commit()
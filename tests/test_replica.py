@@ -0,0 +1,45 @@
+import pytest
+from flask import g
+from sqlalchemy import create_engine, update
+
+from app import AttendanceRecord, db
+
+
+@pytest.fixture
+def replica(app, tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'replica.db'}")
+    with app.app_context():
+        db.metadata.create_all(engine)
+    yield engine
+    engine.dispose()
+
+
+def add_record(venue):
+    record = AttendanceRecord(filename='replica.pdf', filepath='/nonexistent/replica.pdf', venue=venue)
+    db.session.add(record)
+    db.session.commit()
+    return record.id
+
+
+def test_reads_use_the_replica(app, replica):
+    with app.test_request_context():
+        record_id = add_record('Replica read')
+        g.replica_engine = replica
+        assert db.session.get(AttendanceRecord, record_id) is None
+        db.session.rollback()
+
+
+def test_bulk_writes_go_to_the_primary(app, replica):
+    with app.test_request_context():
+        updated_id = add_record('Replica update')
+        deleted_id = add_record('Replica delete')
+
+        g.replica_engine = replica
+        db.session.execute(update(AttendanceRecord).where(AttendanceRecord.id == updated_id).values(venue='Updated'))
+        AttendanceRecord.query.filter_by(id=deleted_id).delete(synchronize_session=False)
+        db.session.commit()
+
+        # The request stays on the primary after writing
+        assert g.replica_engine is None
+        assert db.session.get(AttendanceRecord, updated_id).venue == 'Updated'
+        assert db.session.get(AttendanceRecord, deleted_id) is None
@@ -0,0 +1,27 @@
+import pytest
+
+START = '0.6341, 35.7364'
+
+
+@pytest.mark.parametrize('payload, message', [
+    ([1, 2], 'Request body must be a JSON object'),
+    ({'start': START, 'filter': 'Active'}, 'filter must be an object'),
+    ({'start': START, 'filter': {'subcounty_id': 'abc'}}, 'subcounty_id must be a non-negative integer'),
+    ({'start': START, 'filter': {'no_assessment_months': [3]}}, 'no_assessment_months must be a non-negative integer'),
+    ({'start': START, 'filter': {'colour': 'red'}}, 'Unknown filter: colour'),
+    ({'start': START, 'scheme_ids': 'all'}, 'scheme_ids must be a list'),
+    ({'start': START, 'scheme_ids': [1, 'x']}, 'scheme_ids must be integers'),
+    ({'start': {'latitude': 'north'}}, "A valid start point is required, e.g. '0.6341, 35.7364'"),
+])
+def test_malformed_plan_requests_are_rejected(client, payload, message):
+    response = client.post('/api/routes/plan', json=payload)
+    assert response.status_code == 400
+    assert response.get_json() == {'error': message}
+
+
+def test_plan_with_valid_filter(client):
+    response = client.post('/api/routes/plan', json={
+        'start': START, 'filter': {'subcounty_id': '1', 'no_assessment_months': 6}
+    })
+    assert response.status_code == 200
+    assert response.get_json()['stops'] == []
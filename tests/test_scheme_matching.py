@@ -0,0 +1,36 @@
+import app as app_module
+from app import IrrigationScheme, SchemeLocation, Subcounty, db
+
+
+def test_unlocated_fallback_only_when_no_candidate_has_a_position(app):
+    with app.app_context():
+        subcounty = Subcounty(subcounty_name='Matching Test')
+        db.session.add(subcounty)
+        db.session.flush()
+        located = IrrigationScheme(scheme_name='Kibwezi Canal', subcounty_id=subcounty.subcounty_id)
+        unlocated = IrrigationScheme(scheme_name='Kibwezi canal', subcounty_id=subcounty.subcounty_id)
+        db.session.add_all([located, unlocated])
+        db.session.flush()
+        app_module.add_scheme_match_key(located)
+        app_module.add_scheme_match_key(unlocated)
+        location = SchemeLocation(scheme_id=located.scheme_id, gps_id=0, latitude=-2.2, longitude=37.9)
+        db.session.add(location)
+        db.session.commit()
+        try:
+            match = app_module.find_matching_scheme('KIBWEZI CANAL', subcounty.subcounty_id, -2.2001, 37.9001)
+            assert match.scheme_id == located.scheme_id
+            # Far from the only located candidate: a new scheme, not the unlocated one
+            assert app_module.find_matching_scheme('Kibwezi Canal', subcounty.subcounty_id, -1.0, 36.8) is None
+
+            db.session.delete(location)
+            db.session.commit()
+            match = app_module.find_matching_scheme('Kibwezi Canal', subcounty.subcounty_id, -1.0, 36.8)
+            assert match.scheme_id == unlocated.scheme_id
+        finally:
+            db.session.rollback()
+            for model in (app_module.SchemeMatchKey, SchemeLocation):
+                model.query.filter(model.scheme_id.in_([located.scheme_id, unlocated.scheme_id])).delete()
+            db.session.delete(located)
+            db.session.delete(unlocated)
+            db.session.delete(subcounty)
+            db.session.commit()
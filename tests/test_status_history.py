@@ -0,0 +1,28 @@
+from datetime import date
+
+import app as app_module
+from app import SchemeStatusHistory, db
+
+
+def test_time_series_matches_point_in_time_counts(app):
+    with app.app_context():
+        rows = [
+            SchemeStatusHistory(scheme_id=910001, recorded_on=date(2023, 11, 5), current_status='Proposed'),
+            SchemeStatusHistory(scheme_id=910001, recorded_on=date(2024, 2, 10), current_status='Active'),
+            SchemeStatusHistory(scheme_id=910002, recorded_on=date(2023, 12, 31), current_status='Active'),
+            SchemeStatusHistory(scheme_id=910002, recorded_on=date(2024, 3, 1), current_status='Dormant'),
+            SchemeStatusHistory(scheme_id=910003, recorded_on=date(2024, 4, 20), current_status=None),
+        ]
+        db.session.add_all(rows)
+        db.session.commit()
+        try:
+            series = app_module.status_time_series('current_status', date(2024, 1, 31), date(2024, 4, 30))
+            assert [point['month'] for point in series] == ['2024-01', '2024-02', '2024-03', '2024-04']
+            for point in series:
+                expected = app_module.status_counts_as_of('current_status', point['as_of'])
+                assert point['counts'] == expected
+                assert point['total'] == sum(expected.values())
+        finally:
+            for row in rows:
+                db.session.delete(row)
+            db.session.commit()
@@ -0,0 +1,65 @@
+import os
+
+import app as app_module
+from app import AttendanceRecord, db
+
+
+def test_dangling_rows_are_reported_on_every_run(app, monkeypatch):
+    monkeypatch.setattr(app_module, 'RECONCILE_MIN_AGE', app_module.timedelta(0))
+    with app.app_context():
+        app_module.reconcile_storage(full=True, quarantine=True)
+        app_module.reconcile_storage()
+
+        path = app_module.unique_upload_path('', 'never-promoted.pdf')
+        record = AttendanceRecord(filename='never-promoted.pdf', filepath=path, venue='Reconcile')
+        db.session.add(record)
+        db.session.commit()
+
+        # The upload folder is unchanged since its checkpoint
+        for _ in range(2):
+            result = app_module.reconcile_storage()
+            assert result['rescanned'] == 0
+            assert ('attendance_record', record.id, path) in result['dangling']
+
+        db.session.delete(record)
+        db.session.commit()
+
+
+def test_orphans_are_found_in_changed_directories(app, monkeypatch):
+    monkeypatch.setattr(app_module, 'RECONCILE_MIN_AGE', app_module.timedelta(0))
+    with app.app_context():
+        app_module.reconcile_storage(full=True, quarantine=True)
+        orphan = os.path.join(app_module.UPLOAD_FOLDER, 'orphan.pdf')
+        with open(orphan, 'wb') as f:
+            f.write(b'%PDF-1.4')
+        assert app_module.reconcile_storage()['orphans'] == [orphan]
+
+
+def test_row_delete_expires_the_checkpoint(app, monkeypatch):
+    monkeypatch.setattr(app_module, 'RECONCILE_MIN_AGE', app_module.timedelta(0))
+    with app.app_context():
+        path = app_module.unique_upload_path('expiry', 'kept.pdf')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(b'%PDF-1.4')
+        record = AttendanceRecord(filename='kept.pdf', filepath=path, venue='Reconcile')
+        db.session.add(record)
+        db.session.commit()
+        # Quarantining leftovers from other tests changes the root again
+        app_module.reconcile_storage(full=True, quarantine=True)
+        app_module.reconcile_storage(full=True)
+        assert app_module.reconcile_storage()['rescanned'] == 0
+
+        # Deleting the row without a tombstone leaves the directory mtime alone
+        db.session.delete(record)
+        db.session.commit()
+        result = app_module.reconcile_storage()
+        assert result['orphans'] == [path]
+
+        def refuse(_):
+            raise PermissionError('read-only volume')
+        monkeypatch.setattr(app_module, 'quarantine_file', refuse)
+        result = app_module.reconcile_storage(quarantine=True)
+        assert result['failed'] == [(path, 'read-only volume')]
+        assert result['orphans'] == []
+        os.remove(path)
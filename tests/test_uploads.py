@@ -0,0 +1,69 @@
+import io
+import zipfile
+
+import app as app_module
+
+PDF = b'%PDF-1.4\n' + b'0' * 100
+
+
+def make_archive(files):
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, 'w') as archive:
+        for name, data in files.items():
+            archive.writestr(name, data)
+    buf.seek(0)
+    return buf
+
+
+def post_bulk(client, files, manifest):
+    return client.post('/api/attendance/bulk', data={
+        'archive': (make_archive(files), 'sheets.zip'),
+        'manifest': (io.BytesIO(manifest.encode('utf-8')), 'manifest.csv'),
+    }, content_type='multipart/form-data')
+
+
+def test_read_manifest_reports_rows_with_too_many_columns():
+    entries, errors = app_module.read_manifest(
+        'filename,venue,date,event\n'
+        'a.pdf,Kabarnet,2024-01-01,Training\n'
+        'b.pdf,Marigat,2024-01-02,Training,extra\n'
+    )
+    assert list(entries) == ['a.pdf']
+    assert errors == ['Manifest line 3: too many columns']
+
+
+def test_bulk_ingest_with_malformed_manifest_returns_report(client):
+    response = post_bulk(client, {'a.pdf': PDF, 'b.pdf': PDF + b'1'}, (
+        'filename,venue,date,event\n'
+        'a.pdf,Kabarnet,2024-01-01,Training\n'
+        'b.pdf,Marigat,2024-01-02,Training,extra\n'
+    ))
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['files'] == ['a.pdf']
+    assert 'Manifest line 3: too many columns' in body['errors']
+
+
+def post_upload(client, name, data):
+    return client.post('/api/upload', data={
+        'venue': 'Kabarnet', 'date': '2024-01-01', 'files': [(io.BytesIO(data), name)],
+    }, content_type='multipart/form-data')
+
+
+def test_oversized_pdf_is_rejected_with_json(client):
+    limit = app_module.UPLOAD_SIZE_LIMITS['pdf']
+    response = post_upload(client, 'big.pdf', PDF + b'0' * limit)
+    assert response.status_code == 413
+    assert response.get_json() == {'success': False, 'message': 'big.pdf: file exceeds the 10MB limit'}
+
+
+def test_body_over_request_limit_is_rejected_with_json(client):
+    response = post_upload(client, 'huge.pdf', PDF + b'0' * app_module.MAX_CONTENT_LENGTH)
+    assert response.status_code == 413
+    assert response.get_json()['success'] is False
+
+
+def test_mislabelled_file_is_rejected(client):
+    response = post_upload(client, 'photo.png', PDF)
+    assert response.status_code == 415
+    assert 'does not match' in response.get_json()['message']